@@ -23,7 +23,7 @@ import requests
 import sys
 import time
 from enum import Enum, auto
-from functools import total_ordering, wraps
+from functools import partial, total_ordering, wraps
 from threading import Lock
 from typing import Optional
 from weakref import WeakKeyDictionary
@@ -40,8 +40,11 @@ from web3.exceptions import TransactionNotFound
 from eth_abi.codec import ABICodec
 from eth_abi.registry import registry as default_registry
 
-from pymaker.gas import DefaultGasPrice, GasPrice
+from pymaker.concurrency import concurrency_controller
+from pymaker.gas import DefaultGasPrice, gas_price_feed, GasFees, GasPrice
 from pymaker.numeric import Wad
+from pymaker.tracing import BROADCAST, FIRST_SEEN, GAS_BUMP, GAS_ESTIMATION, LOCK_WAIT, MINED, NONCE, \
+    RECEIPT_DECODE, SIGNING, TransactionTrace
 from pymaker.util import synchronize, bytes_to_hexstring, is_contract_at
 
 filter_threads = []
@@ -51,7 +54,20 @@ transaction_lock = Lock()
 logger = logging.getLogger()
 
 
-def web3_via_http(endpoint_uri: str, timeout=60, http_pool_size=20):
+def web3_via_http(endpoint_uri: str, timeout=60, http_pool_size=20, instrumentation=None, single_flight=None,
+                  fast_json=False):
+    """Creates a `Web3` instance talking to the node over a pooled HTTP session.
+
+    Args:
+        endpoint_uri: HTTP(S) endpoint of the node.
+        timeout: Request timeout (in seconds).
+        http_pool_size: Maximum number of pooled connections.
+        instrumentation: Optional :py:class:`pymaker.rpc.RpcInstrumentation` accounting for all requests.
+        single_flight: Optional :py:class:`pymaker.rpc.SingleFlight` coalescing identical concurrent reads.
+        fast_json: Use :py:class:`pymaker.rpc.FastHTTPProvider`, decoding large responses faster.
+    """
+    from pymaker.rpc import FastHTTPProvider
+
     assert isinstance(endpoint_uri, str)
     adapter = requests.adapters.HTTPAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size)
     session = requests.Session()
@@ -61,7 +77,13 @@ def web3_via_http(endpoint_uri: str, timeout=60, http_pool_size=20):
         session.mount('https://', adapter)
     else:
         raise ValueError("Unsupported protocol")
-    return Web3(HTTPProvider(endpoint_uri=endpoint_uri, request_kwargs={"timeout": timeout}, session=session))
+    provider_class = FastHTTPProvider if fast_json else HTTPProvider
+    web3 = Web3(provider_class(endpoint_uri=endpoint_uri, request_kwargs={"timeout": timeout}, session=session))
+    if instrumentation is not None:
+        instrumentation.install(web3, session)
+    if single_flight is not None:
+        single_flight.install(web3)
+    return web3
 
 
 class NonceCalculation(Enum):
@@ -127,10 +149,14 @@ def _track_status(f):
         # Set current status to in progress
         args[0].status = TransactStatus.IN_PROGRESS
 
+        result = None
         try:
-            return await f(*args, **kwds)
+            result = await f(*args, **kwds)
+            return result
         finally:
             args[0].status = TransactStatus.FINISHED
+            args[0]._record_finished()
+            args[0]._export_trace(result)
 
     return wrapper
 
@@ -234,6 +260,19 @@ class Contract:
 
         return list(map(_event_callback(cls, True), result))
 
+    def _decode_events(self, contract, event, cls, logs: list) -> list:
+        assert(isinstance(logs, list))
+
+        event_abi = contract.events[event]._get_event_abi()
+        topic = eth_utils.event_abi_to_log_topic(event_abi)
+
+        result = []
+        for log in logs:
+            if len(log['topics']) > 0 and HexBytes(log['topics'][0]) == HexBytes(topic):
+                result.append(cls(get_event_data(contract.web3.codec, event_abi, log)))
+
+        return result
+
     @staticmethod
     def _load_abi(package, resource) -> list:
         return json.loads(pkg_resources.resource_string(package, resource))
@@ -385,12 +424,58 @@ class Receipt:
         return self.raw_receipt['logs']
 
 
+def allocate_nonces(web3: Web3, from_account: str, count: int) -> int:
+    """Reserves `count` consecutive nonces for `from_account` and returns the first one.
+
+    Must be called with `transaction_lock` held, and the transactions using these nonces should
+    be sent before releasing it, as otherwise nonces may get allocated twice.
+    """
+    assert isinstance(web3, Web3)
+    assert isinstance(from_account, str)
+    assert isinstance(count, int)
+    assert count > 0
+
+    nonce_calculation = _get_nonce_calc(web3)
+    if nonce_calculation == NonceCalculation.PARITY_NEXTNONCE:
+        nonce = int(web3.manager.request_blocking("parity_nextNonce", [from_account]), 16)
+    elif nonce_calculation == NonceCalculation.TX_COUNT:
+        nonce = web3.eth.getTransactionCount(from_account, block_identifier='pending')
+    elif nonce_calculation == NonceCalculation.SERIAL:
+        tx_count = web3.eth.getTransactionCount(from_account, block_identifier='pending')
+        nonce = max(tx_count, next_nonce.get(from_account, 0))
+    elif nonce_calculation == NonceCalculation.PARITY_SERIAL:
+        tx_count = int(web3.manager.request_blocking("parity_nextNonce", [from_account]), 16)
+        nonce = max(tx_count, next_nonce.get(from_account, 0))
+    next_nonce[from_account] = nonce + count
+    return nonce
+
+
 class TransactStatus(Enum):
      NEW = auto()
      IN_PROGRESS = auto()
      FINISHED = auto()
 
 
+def _quantity(value) -> Optional[int]:
+    if isinstance(value, str):
+        return int(value, 16)
+    return value
+
+
+def _pending_gas_fees(item: dict) -> Optional[GasFees]:
+    if item.get('maxFeePerGas') is None or item.get('maxPriorityFeePerGas') is None:
+        return None
+    return GasFees(_quantity(item['maxFeePerGas']), _quantity(item['maxPriorityFeePerGas']))
+
+
+def _pending_transaction(item: dict) -> dict:
+    data = item.get('input') or "0x"
+    return {'to': item['to'],
+            'data': data if isinstance(data, str) else bytes_to_hexstring(data),
+            'value': _quantity(item.get('value') or 0),
+            'gas': _quantity(item['gas'])}
+
+
 def get_pending_transactions(web3: Web3, address: Address = None) -> list:
     """Retrieves a list of pending transactions from the mempool."""
     assert isinstance(web3, Web3)
@@ -405,14 +490,18 @@ def get_pending_transactions(web3: Web3, address: Address = None) -> list:
         items = filter(lambda item: item['from'].lower() == address.address.lower(), items)
         items = filter(lambda item: item['blockNumber'] is None, items)
         txes = map(lambda item: RecoveredTransact(web3=web3, address=address, nonce=int(item['nonce'], 16),
-                                                  latest_tx_hash=item['hash'], current_gas=int(item['gasPrice'], 16)),
+                                                  latest_tx_hash=item['hash'], current_gas=int(item['gasPrice'], 16),
+                                                  current_fees=_pending_gas_fees(item),
+                                                  transaction=_pending_transaction(item)),
                    items)
     else:
         items = web3.manager.request_blocking("eth_getBlockByNumber", ["pending", True])['transactions']
         items = filter(lambda item: item['from'].lower() == address.address.lower(), items)
         list(items)  # Unsure why this is required
         txes = map(lambda item: RecoveredTransact(web3=web3, address=address, nonce=item['nonce'],
-                                                  latest_tx_hash=item['hash'], current_gas=item['gasPrice']),
+                                                  latest_tx_hash=item['hash'], current_gas=_quantity(item['gasPrice']),
+                                                  current_fees=_pending_gas_fees(item),
+                                                  transaction=_pending_transaction(item)),
                    items)
 
     return list(txes)
@@ -423,6 +512,9 @@ class Transact:
 
     logger = logging.getLogger()
     gas_estimate_for_bad_txs = None
+    gas_limit_model = None
+    journal = None
+    trace_sink = None
 
     def __init__(self,
                  origin: Optional[object],
@@ -459,19 +551,115 @@ class Transact:
         self.replaced = False
         self.gas_price = None
         self.gas_price_last = 0
+        self.gas_fees_last = None
         self.tx_hashes = []
+        self.trace = None
+        self._first_seen_poll_at = 0.0
+        self._first_seen_poll_interval = 1.0
 
     def _get_receipt(self, transaction_hash: str) -> Optional[Receipt]:
         try:
-            raw_receipt = self.web3.eth.getTransactionReceipt(transaction_hash)
+            raw_receipt = concurrency_controller(self.web3).run(self.web3.eth.getTransactionReceipt, transaction_hash)
             if raw_receipt is not None and raw_receipt['blockNumber'] is not None:
+                self._trace_mined()
+                decode_start = time.time()
                 receipt = Receipt(raw_receipt)
                 receipt.result = self.result_function(receipt) if self.result_function is not None else None
+                self._add_span(RECEIPT_DECODE, decode_start, time.time())
+                self._record_gas_used(receipt)
                 return receipt
         except (TransactionNotFound, ValueError):
             self.logger.debug(f"Transaction {transaction_hash} not found (may have been dropped/replaced)")
         return None
 
+    def _record_gas_used(self, receipt: Receipt):
+        if Transact.gas_limit_model is not None and receipt.successful and self.function_name is not None:
+            Transact.gas_limit_model.record(self.address.address, self.function_name, receipt.gas_used)
+
+    def _modelled_gas(self, **kwargs) -> Optional[int]:
+        if Transact.gas_limit_model is None or 'gas' in kwargs or 'gas_buffer' in kwargs:
+            return None
+        return Transact.gas_limit_model.gas_limit(self.address.address, self.function_name)
+
+    def _transaction(self, from_account: str, gas: int, gas_price, nonce: int) -> dict:
+        from pymaker.batch import build_transaction
+        return build_transaction(self, from_account, gas, gas_price, nonce)
+
+    def _record_sent(self, from_account: str, gas: int, gas_price, tx_hash: str):
+        if Transact.journal is not None:
+            self._record_transaction(from_account, tx_hash, self._transaction(from_account, gas, gas_price, self.nonce))
+
+    def _record_transaction(self, from_account: str, tx_hash: str, transaction: dict):
+        if Transact.journal is None:
+            return
+        try:
+            Transact.journal.record_sent(from_account, transaction['nonce'], tx_hash, transaction)
+        except Exception as e:
+            self.logger.error(f"Failed to record transaction {tx_hash} in the journal ({e})")
+
+    def _record_unsent(self, tx_hash: str):
+        if Transact.journal is None:
+            return
+        try:
+            Transact.journal.record_unsent(tx_hash)
+        except Exception as e:
+            self.logger.error(f"Failed to record transaction {tx_hash} as not sent in the journal ({e})")
+
+    def _record_finished(self):
+        if Transact.journal is None or self.replaced or len(self.tx_hashes) == 0:
+            return
+        try:
+            Transact.journal.record_finished(self.tx_hashes)
+        except Exception as e:
+            self.logger.error(f"Failed to record completion of {self.tx_hashes} in the journal ({e})")
+
+    def _trace_function(self) -> str:
+        if self.function_name is None:
+            return "transfer" if self.contract is None else "call"
+        function_name = self.function_name.split("(")[0]
+        return f"{type(self.origin).__name__}.{function_name}" if self.origin is not None else function_name
+
+    def _start_trace(self):
+        if Transact.trace_sink is not None:
+            self.trace = TransactionTrace(self._trace_function())
+
+    def _add_span(self, stage: str, start: float, end: float, **attributes):
+        if self.trace is not None:
+            self.trace.add_span(stage, start, end, **attributes)
+
+    def _trace_first_seen(self):
+        if self.trace is None or self.trace.first(BROADCAST) is None or self.trace.first(FIRST_SEEN) is not None:
+            return
+
+        # polled with backoff, so tracing does not noticeably add to the load it is measuring
+        now = time.time()
+        if now < self._first_seen_poll_at:
+            return
+        self._first_seen_poll_at = now + self._first_seen_poll_interval
+        self._first_seen_poll_interval = min(self._first_seen_poll_interval * 2, 8.0)
+
+        broadcast = self.trace.first(BROADCAST)
+        try:
+            seen = self.web3.manager.request_blocking("eth_getTransactionByHash",
+                                                      [broadcast.attributes['tx_hash']]) is not None
+        except Exception:
+            seen = False
+        if seen:
+            self.trace.add_span(FIRST_SEEN, broadcast.start, time.time())
+
+    def _trace_mined(self):
+        if self.trace is not None and self.trace.first(BROADCAST) is not None and self.trace.first(MINED) is None:
+            self.trace.add_span(MINED, self.trace.first(BROADCAST).start, time.time())
+
+    def _export_trace(self, receipt: Optional[Receipt]):
+        if self.trace is None or Transact.trace_sink is None or self.replaced:
+            return
+        self.trace.finish(receipt is not None)
+        try:
+            Transact.trace_sink.export(self.trace)
+        except Exception as e:
+            self.logger.warning(f"Failed to export the trace of {self.name()} ({e})")
+
     def _as_dict(self, dict_or_none) -> dict:
         if dict_or_none is None:
             return {}
@@ -489,7 +677,67 @@ class Transact:
         else:
             return gas_estimate + 100000
 
-    def _func(self, from_account: str, gas: int, gas_price: Optional[int], nonce: Optional[int]):
+    def _previous_gas_fees(self) -> Optional[GasFees]:
+        # a legacy transaction counts as one paying its gas price both as the maximum and the priority fee
+        if self.gas_fees_last is not None:
+            return self.gas_fees_last
+        elif self.gas_price_last:
+            return GasFees(self.gas_price_last, self.gas_price_last)
+        else:
+            return None
+
+    def _send_with_fees(self, transaction: dict, record: bool = False) -> str:
+        # web3.py adds `gasPrice` to every transaction it sends itself, which nodes reject alongside
+        # EIP-1559 fees, so type-2 transactions get either signed here or passed to the node as they are.
+        # Transactions signed here get recorded in the journal before being broadcast, as a crash
+        # in between would otherwise lose exactly the transaction the journal is there to recover.
+        from pymaker.batch import _to_json
+        from pymaker.keys import registered_account
+
+        account = registered_account(self.web3, Address(transaction['from']))
+        if account is not None:
+            chain_id = self.web3.eth.chainId
+            signing_start = time.time()
+            signed = account.sign_transaction({**{key: value for key, value in transaction.items() if key != 'from'},
+                                               'chainId': chain_id})
+            self._add_span(SIGNING, signing_start, time.time())
+            tx_hash = bytes_to_hexstring(signed.hash)
+            if record:
+                self._record_transaction(transaction['from'], tx_hash, transaction)
+            try:
+                self.web3.eth.sendRawTransaction(signed.rawTransaction)
+            except Exception:
+                if record:
+                    self._record_unsent(tx_hash)
+                raise
+            return tx_hash
+        else:
+            tx_hash = self.web3.manager.request_blocking("eth_sendTransaction", [_to_json(transaction)])
+            tx_hash = tx_hash if isinstance(tx_hash, str) else bytes_to_hexstring(tx_hash)
+            if record:
+                self._record_transaction(transaction['from'], tx_hash, transaction)
+            return tx_hash
+
+    def _signs_locally(self, from_account: str) -> bool:
+        # with a journal, transactions get signed by pymaker rather than by the signing middleware,
+        # so they can be recorded before being broadcast
+        from pymaker.keys import registered_account
+
+        return Transact.journal is not None and registered_account(self.web3, Address(from_account)) is not None
+
+    def _func(self, from_account: str, gas: int, gas_price: Optional[int], nonce: Optional[int],
+              gas_fees: Optional[GasFees] = None):
+        if gas_fees is not None:
+            return self._send_with_fees(self._transaction(from_account, gas, gas_fees, nonce), record=True)
+        if self._signs_locally(from_account):
+            gas_price = gas_price if gas_price is not None else gas_price_feed(self.web3).gas_price()
+            return self._send_with_fees(self._transaction(from_account, gas, gas_price, nonce), record=True)
+
+        tx_hash = self._send_legacy(from_account, gas, gas_price, nonce)
+        self._record_sent(from_account, gas, gas_price, tx_hash)
+        return tx_hash
+
+    def _send_legacy(self, from_account: str, gas: int, gas_price: Optional[int], nonce: Optional[int]) -> str:
         gas_price_dict = {'gasPrice': gas_price} if gas_price is not None else {}
         nonce_dict = {'nonce': nonce} if nonce is not None else {}
 
@@ -603,10 +851,21 @@ class Transact:
 
         Allowed keyword arguments are: `from_address`, `replace`, `gas`, `gas_buffer`, `gas_price`.
         `gas_price` needs to be an instance of a class inheriting from :py:class:`pymaker.gas.GasPrice`.
+        If it provides EIP-1559 fees (see :py:meth:`pymaker.gas.GasPrice.get_gas_fees`), a type-2
+        transaction gets sent, and replaced with both fees raised by at least 10% whenever the
+        strategy asks for higher fees.
 
         The `gas` keyword argument is the gas limit for the transaction, whereas `gas_buffer`
         specifies how much gas should be added to the estimate. They can not be present
-        at the same time. If none of them are present, a default buffer is added to the estimate.
+        at the same time. If none of them are present, a default buffer is added to the estimate,
+        unless `Transact.gas_limit_model` (see :py:class:`pymaker.gas.GasLimitModel`) provides the gas limit.
+        Transactions failing gas estimation are not sent, but with a modelled gas limit there is no
+        estimation, so a transaction which reverts gets sent, mined and paid for, and `None` is returned
+        once its receipt shows the failure.
+
+        Requests to the node, and waiting for other transactions to be sent, happen on the default
+        executor of the event loop, so many transactions can be awaited concurrently on one loop
+        without stalling each other or other tasks.
 
         Returns:
             A future value of either a :py:class:`pymaker.Receipt` object if the transaction
@@ -615,6 +874,7 @@ class Transact:
 
         global next_nonce
         self.initial_time = time.time()
+        self._start_trace()
         unknown_kwargs = set(kwargs.keys()) - {'from_address', 'replace', 'gas', 'gas_buffer', 'gas_price'}
         if len(unknown_kwargs) > 0:
             raise ValueError(f"Unknown kwargs: {unknown_kwargs}")
@@ -622,25 +882,38 @@ class Transact:
         # Get the from account; initialize the first nonce for the account.
         from_account = kwargs['from_address'].address if ('from_address' in kwargs) else self.web3.eth.defaultAccount
         if not next_nonce or from_account not in next_nonce:
-            next_nonce[from_account] = self.web3.eth.getTransactionCount(from_account, block_identifier='pending')
+            tx_count = await self._blocking(self.web3.eth.getTransactionCount, from_account, 'pending')
+            next_nonce.setdefault(from_account, tx_count)
+
+        # If a gas limit model is installed and knows this function well enough, we take the gas
+        # limit from it and skip estimation, validating it in the background if configured to.
+        estimation_start = time.time()
+        modelled_gas = self._modelled_gas(**kwargs)
+        if modelled_gas is not None:
+            gas = modelled_gas
+            Transact.gas_limit_model.validate_in_background(self.address.address, self.function_name, gas,
+                                                            lambda: self.estimated_gas(Address(from_account)))
+        else:
+            # First we try to estimate the gas usage of the transaction. If gas estimation fails
+            # it means there is no point in sending the transaction, thus we fail instantly and
+            # do not increment the nonce. If the estimation is successful, we pass the calculated
+            # gas value (plus some `gas_buffer`) to the subsequent `transact` calls so it does not
+            # try to estimate it again.
+            try:
+                gas_estimate = await self._blocking(self.estimated_gas, Address(from_account))
+            except:
+                if Transact.gas_estimate_for_bad_txs:
+                    self.logger.warning(f"Transaction {self.name()} will fail, submitting anyway")
+                    gas_estimate = Transact.gas_estimate_for_bad_txs
+                else:
+                    self.logger.warning(f"Transaction {self.name()} will fail, refusing to send ({sys.exc_info()[1]})")
+                    return None
 
-        # First we try to estimate the gas usage of the transaction. If gas estimation fails
-        # it means there is no point in sending the transaction, thus we fail instantly and
-        # do not increment the nonce. If the estimation is successful, we pass the calculated
-        # gas value (plus some `gas_buffer`) to the subsequent `transact` calls so it does not
-        # try to estimate it again.
-        try:
-            gas_estimate = self.estimated_gas(Address(from_account))
-        except:
-            if Transact.gas_estimate_for_bad_txs:
-                self.logger.warning(f"Transaction {self.name()} will fail, submitting anyway")
-                gas_estimate = Transact.gas_estimate_for_bad_txs
-            else:
-                self.logger.warning(f"Transaction {self.name()} will fail, refusing to send ({sys.exc_info()[1]})")
-                return None
+            # Get or calculate `gas`.
+            gas = self._gas(gas_estimate, **kwargs)
+        self._add_span(GAS_ESTIMATION, estimation_start, time.time())
 
-        # Get or calculate `gas`. Get `gas_price`, which in fact refers to a gas pricing algorithm.
-        gas = self._gas(gas_estimate, **kwargs)
+        # Get `gas_price`, which in fact refers to a gas pricing algorithm.
         self.gas_price = kwargs['gas_price'] if ('gas_price' in kwargs) else DefaultGasPrice()
         assert(isinstance(self.gas_price, GasPrice))
 
@@ -659,6 +932,7 @@ class Transact:
             if 'gas_price' not in kwargs:
                 self.gas_price = replaced_tx.gas_price if replaced_tx.gas_price else DefaultGasPrice()
             self.gas_price_last = replaced_tx.gas_price_last
+            self.gas_fees_last = replaced_tx.gas_fees_last
             # Detain replacement until gas strategy produces a price acceptable to the node
             if replaced_tx.tx_hashes:
                 most_recent_tx = replaced_tx.tx_hashes[-1]
@@ -667,8 +941,12 @@ class Transact:
         while True:
             seconds_elapsed = int(time.time() - self.initial_time)
 
+            if self.trace is not None:
+                await self._blocking(self._trace_first_seen)
+
             # CAUTION: if transact_async is called rapidly, we will hammer the node with these JSON-RPC requests
-            if self.nonce is not None and self.web3.eth.getTransactionCount(from_account) > self.nonce:
+            if self.nonce is not None and await self._blocking(self.web3.eth.getTransactionCount,
+                                                               from_account) > self.nonce:
                 # Check if any transaction sent so far has been mined (has a receipt).
                 # If it has, we return either the receipt (if if was successful) or `None`.
                 for attempt in range(1, 11):
@@ -677,7 +955,7 @@ class Transact:
                         return None
 
                     for tx_hash in self.tx_hashes:
-                        receipt = self._get_receipt(tx_hash)
+                        receipt = await self._blocking(self._get_receipt, tx_hash)
                         if receipt:
                             if receipt.successful:
                                 self.logger.info(f"Transaction {self.name()} was successful (tx_hash={tx_hash})")
@@ -687,8 +965,7 @@ class Transact:
                                                     f" log entry, assuming it has failed (tx_hash={tx_hash})")
                                 return None
 
-                    self.logger.debug(f"No receipt found in attempt #{attempt}/10 (nonce={self.nonce},"
-                                      f" getTransactionCount={self.web3.eth.getTransactionCount(from_account)})")
+                    self.logger.debug(f"No receipt found in attempt #{attempt}/10 (nonce={self.nonce})")
 
                     await asyncio.sleep(0.5)
 
@@ -707,53 +984,74 @@ class Transact:
             # - no transaction has been sent yet, or
             # - the requested gas price has changed enough since the last transaction has been sent
             # - the gas price on a replacement has sufficiently exceeded that of the original transaction
-            gas_price_value = self.gas_price.get_gas_price(seconds_elapsed)
+            # EIP-1559 fees get raised where needed, so that both go up by the 10% nodes require for a replacement.
+            # strategies may ask the node, so they get called off the event loop thread too
+            gas_fees = await self._blocking(self.gas_price.get_gas_fees, seconds_elapsed)
+            gas_price_value = await self._blocking(self.gas_price.get_gas_price, seconds_elapsed) \
+                if gas_fees is None else None
             transaction_was_sent = len(self.tx_hashes) > 0 or (replaced_tx is not None and len(replaced_tx.tx_hashes) > 0)
             # Uncomment this to debug state during transaction submission
             # self.logger.debug(f"Transaction {self.name()} is churning: was_sent={transaction_was_sent}, gas_price_value={gas_price_value} gas_price_last={self.gas_price_last}")
-            if not transaction_was_sent or (gas_price_value is not None and gas_price_value > self.gas_price_last * 1.125):
-                self.gas_price_last = gas_price_value
+            if gas_fees is not None:
+                previous_fees = self._previous_gas_fees()
+                should_send = not transaction_was_sent or previous_fees is None or gas_fees.exceeds(previous_fees)
+                if should_send and transaction_was_sent and previous_fees is not None:
+                    gas_fees = gas_fees.bumped_from(previous_fees)
+            else:
+                should_send = not transaction_was_sent or \
+                              (gas_price_value is not None and gas_price_value > self.gas_price_last * 1.125)
+
+            if should_send:
+                self.gas_price_last = gas_price_value if gas_fees is None else gas_fees.max_fee
+                self.gas_fees_last = gas_fees
+                pricing = f"gas_fees={gas_fees}" if gas_fees is not None else \
+                    f"gas_price={gas_price_value if gas_price_value is not None else 'default'}"
+                if self.trace is not None and self.trace.first(BROADCAST) is not None:
+                    # time spent at the previous gas price, until the strategy raised it enough
+                    self._add_span(GAS_BUMP, self.trace.stages(BROADCAST)[-1].end, time.time(), pricing=pricing)
 
                 try:
-                    # We need the lock in order to not try to send two transactions with the same nonce.
-                    with transaction_lock:
-                        if self.nonce is None:
-                            nonce_calculation = _get_nonce_calc(self.web3)
-                            if nonce_calculation == NonceCalculation.PARITY_NEXTNONCE:
-                                self.nonce = int(self.web3.manager.request_blocking("parity_nextNonce", [from_account]), 16)
-                            elif nonce_calculation == NonceCalculation.TX_COUNT:
-                                self.nonce = self.web3.eth.getTransactionCount(from_account, block_identifier='pending')
-                            elif nonce_calculation == NonceCalculation.SERIAL:
-                                tx_count = self.web3.eth.getTransactionCount(from_account, block_identifier='pending')
-                                next_serial = next_nonce[from_account]
-                                self.nonce = max(tx_count, next_serial)
-                            elif nonce_calculation == NonceCalculation.PARITY_SERIAL:
-                                tx_count = int(self.web3.manager.request_blocking("parity_nextNonce", [from_account]), 16)
-                                next_serial = next_nonce[from_account]
-                                self.nonce = max(tx_count, next_serial)
-                            next_nonce[from_account] = self.nonce + 1
-
-                        # Trap replacement while original is holding the lock awaiting nonce assignment
-                        if self.replaced:
-                            self.logger.info(f"Transaction {self.name()} with nonce={self.nonce} was replaced")
-                            return None
-
-                        tx_hash = self._func(from_account, gas, gas_price_value, self.nonce)
-                        self.tx_hashes.append(tx_hash)
+                    tx_hash = await self._blocking(self._send, from_account, gas, gas_price_value, gas_fees, pricing)
+                    if tx_hash is None:
+                        return None
 
                     self.logger.info(f"Sent transaction {self.name()} with nonce={self.nonce}, gas={gas},"
-                                     f" gas_price={gas_price_value if gas_price_value is not None else 'default'}"
-                                     f" (tx_hash={tx_hash})")
+                                     f" {pricing} (tx_hash={tx_hash})")
                 except Exception as e:
                     self.logger.warning(f"Failed to send transaction {self.name()} with nonce={self.nonce}, gas={gas},"
-                                        f" gas_price={gas_price_value if gas_price_value is not None else 'default'}"
-                                        f" ({e})")
+                                        f" {pricing} ({e})")
 
                     if len(self.tx_hashes) == 0:
                         raise
 
             await asyncio.sleep(0.25)
 
+    async def _blocking(self, function, *args):
+        # Calls to the node, and waiting for `transaction_lock`, block the calling thread. They run on
+        # the default executor, so that a pending transaction does not stall other tasks of the event loop.
+        return await asyncio.get_event_loop().run_in_executor(None, partial(function, *args))
+
+    def _send(self, from_account: str, gas: int, gas_price_value: Optional[int], gas_fees: Optional[GasFees],
+              pricing: str) -> Optional[str]:
+        # We need the lock in order to not try to send two transactions with the same nonce.
+        lock_start = time.time()
+        with transaction_lock:
+            self._add_span(LOCK_WAIT, lock_start, time.time())
+            if self.nonce is None:
+                self.nonce = allocate_nonces(self.web3, from_account, 1)
+                self._add_span(NONCE, lock_start, time.time())
+
+            # Trap replacement while original is holding the lock awaiting nonce assignment
+            if self.replaced:
+                self.logger.info(f"Transaction {self.name()} with nonce={self.nonce} was replaced")
+                return None
+
+            broadcast_start = time.time()
+            tx_hash = self._func(from_account, gas, gas_price_value, self.nonce, gas_fees)
+            self.tx_hashes.append(tx_hash)
+            self._add_span(BROADCAST, broadcast_start, time.time(), tx_hash=tx_hash, pricing=pricing)
+            return tx_hash
+
     def invocation(self) -> Invocation:
         """Returns the `Invocation` object for this pending Ethereum transaction.
 
@@ -771,15 +1069,22 @@ class Transact:
 class RecoveredTransact(Transact):
     """ Models a pending transaction retrieved from the mempool.
 
-    These can be created by a call to `get_pending_transactions`, enabling the consumer to implement logic which
-    cancels pending transactions upon keeper/bot startup.
+    These can be created by a call to `get_pending_transactions`, or from a local journal with
+    :py:meth:`pymaker.journal.TransactionJournal.recover`, enabling the consumer to implement logic which
+    cancels or resubmits pending transactions upon keeper/bot startup.
+
+    Resubmitting requires the original `transaction` (`to`, `data`, `value` and `gas`) to be known.
     """
     def __init__(self, web3: Web3,
                  address: Address,
                  nonce: int,
                  latest_tx_hash: str,
-                 current_gas: int):
+                 current_gas: int,
+                 current_fees: Optional[GasFees] = None,
+                 transaction: Optional[dict] = None):
         assert isinstance(current_gas, int)
+        assert isinstance(current_fees, GasFees) or current_fees is None
+        assert isinstance(transaction, dict) or transaction is None
         super().__init__(origin=None,
                          web3=web3,
                          abi=None,
@@ -790,14 +1095,42 @@ class RecoveredTransact(Transact):
         self.nonce = nonce
         self.tx_hashes.append(latest_tx_hash)
         self.current_gas = current_gas
+        self.current_fees = current_fees
+        self.transaction = transaction
+        self.gas_price_last = current_gas
+        self.gas_fees_last = current_fees
 
     def name(self):
         return f"Recovered tx with nonce {self.nonce}"
 
-    @_track_status
     async def transact_async(self, **kwargs) -> Optional[Receipt]:
-        # TODO: Read transaction data from chain, create a new state machine to manage gas for the transaction.
-        raise NotImplementedError()
+        """Waits for the recovered transaction to get mined, resubmitting it with the same nonce as needed.
+
+        The pending transaction only gets replaced once the gas strategy passed as `gas_price` asks for
+        enough more than it pays already. Allowed keyword arguments are `gas` and `gas_price`.
+        """
+        if self.transaction is None:
+            raise NotImplementedError("Transaction data is not known, the transaction can only be cancelled")
+
+        unknown_kwargs = set(kwargs.keys()) - {'gas', 'gas_price'}
+        if len(unknown_kwargs) > 0:
+            raise ValueError(f"Unknown kwargs: {unknown_kwargs}")
+
+        return await super().transact_async(**{'gas': self.transaction['gas'], **kwargs,
+                                               'from_address': self.address})
+
+    def _transaction(self, from_account: str, gas: int, gas_price, nonce: int) -> dict:
+        transaction = {'from': from_account, 'to': self.transaction['to'], 'data': self.transaction.get('data', "0x"),
+                       'value': self.transaction.get('value', 0), 'gas': gas, 'nonce': nonce}
+        if isinstance(gas_price, GasFees):
+            transaction.update(gas_price.transaction_params())
+        elif gas_price is not None:
+            transaction['gasPrice'] = gas_price
+        return transaction
+
+    def _send_legacy(self, from_account: str, gas: int, gas_price: Optional[int], nonce: Optional[int]) -> str:
+        return bytes_to_hexstring(self.web3.eth.sendTransaction(self._transaction(from_account, gas, gas_price,
+                                                                                  nonce)))
 
     def cancel(self, gas_price: GasPrice):
         return synchronize([self.cancel_async(gas_price)])[0]
@@ -806,16 +1139,38 @@ class RecoveredTransact(Transact):
         assert isinstance(gas_price, GasPrice)
         initial_time = time.time()
         self.gas_price_last = self.current_gas
+        self.gas_fees_last = self.current_fees
         self.tx_hashes.clear()
 
-        if gas_price.get_gas_price(0) <= self.current_gas * 1.125:
+        if gas_price.get_gas_fees(0) is None and gas_price.get_gas_price(0) <= self.current_gas * 1.125:
             self.logger.warning(f"Recovery gas price is less than current gas price {self.current_gas}; "
                                 "cancellation will be deferred until the strategy produces an acceptable price.")
 
         while True:
             seconds_elapsed = int(time.time() - initial_time)
-            gas_price_value = gas_price.get_gas_price(seconds_elapsed)
-            if gas_price_value > self.gas_price_last * 1.125:
+            gas_fees = gas_price.get_gas_fees(seconds_elapsed)
+            if gas_fees is not None:
+                # The first cancellation gets sent straight away, with fees raised enough to replace the pending tx
+                previous_fees = self._previous_gas_fees()
+                if len(self.tx_hashes) == 0 or gas_fees.exceeds(previous_fees):
+                    if previous_fees is not None:
+                        gas_fees = gas_fees.bumped_from(previous_fees)
+                    self.gas_price_last = gas_fees.max_fee
+                    self.gas_fees_last = gas_fees
+                    tx_hash = self._send_with_fees({'from': self.address.address,
+                                                    'to': self.address.address,
+                                                    'gas': 21000,
+                                                    'nonce': self.nonce,
+                                                    'value': 0,
+                                                    **gas_fees.transaction_params()})
+                    self.tx_hashes.append(tx_hash)
+                    self.logger.info(f"Attempting to cancel recovered tx with nonce={self.nonce}, "
+                                     f"gas_fees={gas_fees} (tx_hash={tx_hash})")
+                gas_price_value = None
+            else:
+                gas_price_value = gas_price.get_gas_price(seconds_elapsed)
+
+            if gas_price_value is not None and gas_price_value > self.gas_price_last * 1.125:
                 self.gas_price_last = gas_price_value
                 # Transaction lock isn't needed here, as we are replacing an existing nonce
                 tx_hash = bytes_to_hexstring(self.web3.eth.sendTransaction({'from': self.address.address,
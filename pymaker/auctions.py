@@ -27,9 +27,11 @@ from eth_abi.codec import ABICodec
 from eth_abi.registry import registry as default_registry
 
 from pymaker import Contract, Address, Transact
+from pymaker.concurrency import get_logs
 from pymaker.dss import Dog, Vat
 from pymaker.logging import LogNote
 from pymaker.numeric import Wad, Rad, Ray
+from pymaker.rpc import SenderResolver
 from pymaker.token import ERC20Token
 
 
@@ -106,28 +108,30 @@ class AuctionContract(Contract):
         assert isinstance(abi, list)
 
         logger.debug(f"Consumer requested auction data from block {from_block} to {to_block}")
-        start = from_block
-        end = None
-        chunks_queried = 0
-        events = []
-        while end is None or start <= to_block:
-            chunks_queried += 1
-            end = min(to_block, start + chunk_size)
-
-            filter_params = {
-                'address': self.address.address,
-                'fromBlock': start,
-                'toBlock': end
-            }
-            logger.debug(f"Querying logs from block {start} to {end} ({end-start} blocks); "
-                         f"accumulated {len(events)} events in {chunks_queried-1} requests")
-
-            logs = self.web3.eth.getLogs(filter_params)
-            events.extend(list(map(lambda l: self.parse_event(l), logs)))
-            start += chunk_size
+        logs = get_logs(self.web3, {'address': self.address.address}, from_block, to_block, chunk_size)
+        self._prepare_logs(logs)
+        events = list(map(lambda l: self.parse_event(l), logs))
 
         return list(filter(lambda l: l is not None, events))
 
+    def decode_logs(self, logs: list) -> list:
+        """Decodes raw logs emitted by this contract into the history returned by `past_logs`.
+
+        Args:
+            logs: List of raw logs, as returned by `eth_getLogs`.
+        """
+        assert isinstance(logs, list)
+
+        self._prepare_logs(logs)
+        return self._history(list(map(lambda l: self.parse_event(l), logs)))
+
+    def _prepare_logs(self, logs: list):
+        """Called with each batch of raw logs before they are parsed; subclasses may prefetch data here."""
+        pass
+
+    def _history(self, logs: list) -> list:
+        raise NotImplemented()
+
     def parse_event(self, event):
         raise NotImplemented()
 
@@ -338,8 +342,9 @@ class Flipper(DealableAuctionContract):
         return Transact(self, self.web3, self.abi, self.address, self._contract, 'dent', [id, lot.value, bid.value])
 
     def past_logs(self, from_block: int, to_block: int = None, chunk_size=20000):
-        logs = super().get_past_lognotes(Flipper.abi, from_block, to_block, chunk_size)
+        return self._history(super().get_past_lognotes(Flipper.abi, from_block, to_block, chunk_size))
 
+    def _history(self, logs: list) -> list:
         history = []
         for log in logs:
             if log is None:
@@ -473,8 +478,9 @@ class Flapper(DealableAuctionContract):
         return Transact(self, self.web3, self.abi, self.address, self._contract, 'yank', [id])
 
     def past_logs(self, from_block: int, to_block: int = None, chunk_size=20000):
-        logs = super().get_past_lognotes(Flapper.abi, from_block, to_block, chunk_size)
+        return self._history(super().get_past_lognotes(Flapper.abi, from_block, to_block, chunk_size))
 
+    def _history(self, logs: list) -> list:
         history = []
         for log in logs:
             if log is None:
@@ -615,8 +621,9 @@ class Flopper(DealableAuctionContract):
         return Transact(self, self.web3, self.abi, self.address, self._contract, 'yank', [id])
 
     def past_logs(self, from_block: int, to_block: int = None, chunk_size=20000):
-        logs = super().get_past_lognotes(Flopper.abi, from_block, to_block, chunk_size)
+        return self._history(super().get_past_lognotes(Flopper.abi, from_block, to_block, chunk_size))
 
+    def _history(self, logs: list) -> list:
         history = []
         for log in logs:
             if log is None:
@@ -657,6 +664,8 @@ class Clipper(AuctionContract):
     abi = Contract._load_abi(__name__, 'abi/Clipper.abi')
     bin = Contract._load_bin(__name__, 'abi/Clipper.bin')
 
+    TAKE_SIGNATURE = "0x05e309fd6ce72f2ab888a20056bb4210df08daed86f21f95053deb19964d86b1"
+
     class KickLog:
         def __init__(self, log):
             args = log['args']
@@ -737,14 +746,20 @@ class Clipper(AuctionContract):
             if not self.redo_abi and member.get('name') == 'Redo':
                 self.redo_abi = member
 
+        # Take events do not carry the address of the bidder, so it is resolved from the transaction
+        self.senders = SenderResolver(web3)
+
     def active_auctions(self) -> list:
-        active_auctions = []
-        for index in range(1, self.kicks()+1):
-            sale = self.sales(index)
-            if sale.usr != Address.zero():
-                active_auctions.append(sale)
-            index += 1
-        return active_auctions
+        """Returns the details of active and redoable auctions, ordered by id.
+
+        Only auctions from the active list are queried, so the cost does not grow with the number of
+        auctions which have already finished.
+        """
+        return [self.sales(id) for id in sorted(self.active_ids())]
+
+    def active_ids(self) -> List[int]:
+        """Identifiers of active and redoable auctions."""
+        return [int(id) for id in self._contract.functions.list().call()]
 
     def ilk_name(self) -> str:
         ilk = self._contract.functions.ilk().call()
@@ -886,8 +901,9 @@ class Clipper(AuctionContract):
         return Transact(self, self.web3, self.abi, self.address, self._contract, 'upchost', [])
 
     def past_logs(self, from_block: int, to_block: int = None, chunk_size=20000):
-        logs = super().get_past_lognotes(Clipper.abi, from_block, to_block, chunk_size)
+        return self._history(super().get_past_lognotes(Clipper.abi, from_block, to_block, chunk_size))
 
+    def _history(self, logs: list) -> list:
         history = []
         for log in logs:
             if log is None:
@@ -906,9 +922,8 @@ class Clipper(AuctionContract):
         if signature == "0x7c5bfdc0a5e8192f6cd4972f382cec69116862fb62e6abff8003874c58e064b8":
             event_data = get_event_data(codec, self.kick_abi, event)
             return Clipper.KickLog(event_data)
-        elif signature == "0x05e309fd6ce72f2ab888a20056bb4210df08daed86f21f95053deb19964d86b1":
+        elif signature == Clipper.TAKE_SIGNATURE:
             event_data = get_event_data(codec, self.take_abi, event)
-            self._get_sender_for_eventlog(event_data)
             return Clipper.TakeLog(event_data, self._get_sender_for_eventlog(event_data))
         elif signature == "0x275de7ecdd375b5e8049319f8b350686131c219dd4dc450a08e9cf83b03c865f":
             event_data = get_event_data(codec, self.redo_abi, event)
@@ -916,10 +931,13 @@ class Clipper(AuctionContract):
         else:
             logger.debug(f"Found event signature {signature}")
 
+    def _prepare_logs(self, logs: list):
+        take_logs = [log for log in logs if Web3.toHex(log['topics'][0]) == Clipper.TAKE_SIGNATURE]
+        if len(take_logs) > 0:
+            self.senders.prefetch(take_logs)
+
     def _get_sender_for_eventlog(self, event_data) -> Address:
-        tx_hash = event_data['transactionHash'].hex()
-        receipt = self.web3.eth.getTransactionReceipt(tx_hash)
-        return Address(receipt['from'])
+        return self.senders.sender(event_data['transactionHash'])
 
     def __repr__(self):
         return f"Clipper('{self.address}')"
@@ -0,0 +1,309 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import bisect
+import json
+import logging
+import math
+from typing import List, Optional
+
+from web3 import Web3
+
+from pymaker.gas import GasFees, GasPrice
+
+logger = logging.getLogger()
+
+
+class BlockRecord:
+    """Gas prices paid in a single block, as needed to replay it.
+
+    Attributes:
+        number: Block number.
+        timestamp: Block timestamp.
+        base_fee: Base fee of the block in Wei, `0` before EIP-1559.
+        gas_prices: Effective gas prices paid by the transactions included in the block, ascending, in Wei.
+    """
+
+    def __init__(self, number: int, timestamp: int, base_fee: int, gas_prices: List[int]):
+        assert isinstance(number, int)
+        assert isinstance(timestamp, int)
+        assert isinstance(base_fee, int)
+        assert isinstance(gas_prices, list)
+
+        self.number = number
+        self.timestamp = timestamp
+        self.base_fee = base_fee
+        self.gas_prices = sorted(gas_prices)
+
+    def inclusion_price(self, percentile: float) -> int:
+        """Returns the lowest gas price which would have beaten `percentile` percent of the included transactions."""
+        assert 0 <= percentile <= 100
+
+        if len(self.gas_prices) == 0:
+            return self.base_fee
+        index = min(int(len(self.gas_prices) * percentile / 100), len(self.gas_prices) - 1)
+        return max(self.gas_prices[index], self.base_fee)
+
+    def to_json(self) -> dict:
+        return {'number': self.number, 'timestamp': self.timestamp, 'baseFee': self.base_fee,
+                'gasPrices': self.gas_prices}
+
+    @staticmethod
+    def from_json(data: dict) -> 'BlockRecord':
+        return BlockRecord(data['number'], data['timestamp'], data['baseFee'], data['gasPrices'])
+
+    @staticmethod
+    def from_block(block: dict) -> 'BlockRecord':
+        """Creates a record from a block with full transactions, as returned by `eth_getBlockByNumber`."""
+        def quantity(value) -> int:
+            return int(value, 16) if isinstance(value, str) else int(value)
+
+        base_fee = quantity(block.get('baseFeePerGas') or 0)
+        gas_prices = []
+        for transaction in block['transactions']:
+            if transaction.get('maxFeePerGas') is not None:
+                gas_prices.append(min(quantity(transaction['maxFeePerGas']),
+                                      base_fee + quantity(transaction['maxPriorityFeePerGas'])))
+            else:
+                gas_prices.append(quantity(transaction['gasPrice']))
+        return BlockRecord(quantity(block['number']), quantity(block['timestamp']), base_fee, gas_prices)
+
+    def __repr__(self):
+        return f"BlockRecord(number={self.number}, base_fee={self.base_fee}, transactions={len(self.gas_prices)})"
+
+
+class BlockHistory:
+    """A sequence of consecutive :py:class:`pymaker.backtest.BlockRecord`-s gas price strategies get replayed against.
+
+    Attributes:
+        blocks: Block records, in ascending block order.
+    """
+
+    def __init__(self, blocks: List[BlockRecord]):
+        assert isinstance(blocks, list)
+        assert all(isinstance(block, BlockRecord) for block in blocks)
+        assert len(blocks) > 0
+
+        self.blocks = sorted(blocks, key=lambda block: block.number)
+        self.timestamps = [block.timestamp for block in self.blocks]
+
+    @staticmethod
+    def from_node(web3: Web3, from_block: int, to_block: int, batch_size: int = 20) -> 'BlockHistory':
+        """Records blocks `from_block` to `to_block` (inclusive) from the node."""
+        from pymaker.rpc import batch_request
+
+        assert isinstance(web3, Web3)
+        assert isinstance(from_block, int)
+        assert isinstance(to_block, int)
+        assert from_block <= to_block
+
+        calls = [("eth_getBlockByNumber", [hex(number), True]) for number in range(from_block, to_block + 1)]
+        blocks = batch_request(web3, calls, batch_size=batch_size)
+        logger.info(f"Recorded gas prices of {len(blocks)} blocks from block {from_block} to {to_block}")
+        return BlockHistory([BlockRecord.from_block(block) for block in blocks])
+
+    @staticmethod
+    def from_file(path: str) -> 'BlockHistory':
+        """Reads blocks from a file written by `to_file`, with one block per line."""
+        with open(path, 'r') as file:
+            return BlockHistory([BlockRecord.from_json(json.loads(line)) for line in file if line.strip()])
+
+    def to_file(self, path: str):
+        with open(path, 'w') as file:
+            for block in self.blocks:
+                file.write(json.dumps(block.to_json()) + "\n")
+
+    def first_block_after(self, timestamp: float) -> int:
+        """Returns the index of the first block mined after `timestamp`, or `len(blocks)` if there is none."""
+        return bisect.bisect_right(self.timestamps, timestamp)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __repr__(self):
+        return f"BlockHistory({self.blocks[0].number}..{self.blocks[-1].number})"
+
+
+class BacktestResult:
+    """Outcome of replaying a gas price strategy against a block history.
+
+    Attributes:
+        inclusion_times: Seconds from submission to inclusion of each simulated transaction,
+            `None` for transactions not included within the block limit.
+        inclusion_blocks: Number of blocks from submission to inclusion, `None` likewise.
+        costs: Fee paid by each included transaction (gas times effective gas price), in Wei.
+        replacements: Total number of replacement transactions sent.
+    """
+
+    def __init__(self):
+        self.inclusion_times = []
+        self.inclusion_blocks = []
+        self.costs = []
+        self.replacements = 0
+
+    @property
+    def included(self) -> int:
+        return len(self.costs)
+
+    @property
+    def total_cost(self) -> int:
+        return sum(self.costs)
+
+    @property
+    def average_cost(self) -> float:
+        return self.total_cost / self.included if self.included > 0 else 0.0
+
+    def inclusion_time(self, quantile: float) -> float:
+        """Returns the `quantile` (between 0 and 1) of inclusion times, `inf` if it falls among missed transactions."""
+        assert 0 <= quantile <= 1
+
+        if len(self.inclusion_times) == 0:
+            return 0.0
+        times = sorted(self.inclusion_times, key=lambda value: math.inf if value is None else value)
+        value = times[min(int(quantile * len(times)), len(times) - 1)]
+        return math.inf if value is None else value
+
+    def summary(self) -> dict:
+        return {'transactions': len(self.inclusion_times),
+                'included': self.included,
+                'p50': self.inclusion_time(0.5),
+                'p90': self.inclusion_time(0.9),
+                'p99': self.inclusion_time(0.99),
+                'total_cost': self.total_cost,
+                'average_cost': self.average_cost,
+                'replacements': self.replacements}
+
+    def __repr__(self):
+        return f"BacktestResult({self.summary()})"
+
+
+class GasBacktest:
+    """Replays gas price strategies against recorded blocks, to compare time to inclusion and cost.
+
+    A simulated transaction gets submitted at the timestamp of each block (or at the given times).
+    In every following block, it asks the strategy for a gas price or EIP-1559 fees, based on the time
+    elapsed, and replaces itself following the same rules as :py:class:`pymaker.Transact`. It is
+    considered included in the first block where its effective gas price is at least the base fee and
+    beats `inclusion_percentile` percent of the transactions actually included in that block.
+
+    Strategies are expected to depend on the elapsed time only, so their answers get reused between
+    simulated transactions. Strategies querying the node, like :py:class:`pymaker.gas.NodeAwareGasPrice`
+    subclasses, can not be backtested.
+
+    Attributes:
+        history: The :py:class:`pymaker.backtest.BlockHistory` to replay.
+        gas: Gas used by each simulated transaction.
+        max_blocks: Number of blocks after which a simulated transaction is considered missed.
+        inclusion_percentile: Percentile of included gas prices a transaction has to match to be included.
+    """
+
+    def __init__(self, history: BlockHistory, gas: int = 21000, max_blocks: int = 100,
+                 inclusion_percentile: float = 10):
+        assert isinstance(history, BlockHistory)
+        assert isinstance(gas, int)
+        assert isinstance(max_blocks, int)
+        assert max_blocks > 0
+        assert 0 <= inclusion_percentile <= 100
+
+        self.history = history
+        self.gas = gas
+        self.max_blocks = max_blocks
+        self.inclusion_percentile = inclusion_percentile
+        self.inclusion_prices = [block.inclusion_price(inclusion_percentile) for block in history.blocks]
+
+    def run(self, strategy: GasPrice, submit_times: Optional[List[float]] = None) -> BacktestResult:
+        """Simulates transactions priced by `strategy`, submitted at each of `submit_times`.
+
+        Returns:
+            :py:class:`pymaker.backtest.BacktestResult` of the simulated transactions. Those submitted
+            too late to be included within `max_blocks` blocks of the history are left out.
+        """
+        assert isinstance(strategy, GasPrice)
+
+        if submit_times is None:
+            submit_times = self.history.timestamps
+        pricing = {}
+        result = BacktestResult()
+
+        for submit_time in submit_times:
+            first = self.history.first_block_after(submit_time)
+            if first + self.max_blocks > len(self.history):
+                continue
+
+            sent = None
+            for index in range(first, first + self.max_blocks):
+                block = self.history.blocks[index]
+                elapsed = int(block.timestamp - submit_time)
+                if elapsed not in pricing:
+                    pricing[elapsed] = strategy.get_gas_fees(elapsed) or strategy.get_gas_price(elapsed)
+
+                price = pricing[elapsed]
+                if sent is None:
+                    sent = price
+                elif self._replaces(price, sent):
+                    previous = self._as_fees(sent)
+                    if isinstance(price, GasFees) and previous is not None:
+                        sent = price.bumped_from(previous)
+                    else:
+                        sent = price
+                    result.replacements += 1
+
+                effective_price = self._effective_price(sent, block.base_fee)
+                if effective_price is not None and effective_price >= self.inclusion_prices[index]:
+                    result.inclusion_times.append(block.timestamp - submit_time)
+                    result.inclusion_blocks.append(index - first + 1)
+                    result.costs.append(self.gas * effective_price)
+                    break
+            else:
+                result.inclusion_times.append(None)
+                result.inclusion_blocks.append(None)
+
+        return result
+
+    def compare(self, strategies: dict, submit_times: Optional[List[float]] = None) -> dict:
+        """Runs each of `strategies` (a dictionary of strategies by name) and returns their summaries by name."""
+        assert isinstance(strategies, dict)
+
+        return {name: self.run(strategy, submit_times).summary() for name, strategy in strategies.items()}
+
+    @staticmethod
+    def _as_fees(sent) -> Optional[GasFees]:
+        # a legacy transaction counts as one paying its gas price both as the maximum and the priority fee
+        if sent is None or isinstance(sent, GasFees):
+            return sent
+        return GasFees(sent, sent)
+
+    @staticmethod
+    def _replaces(price, sent) -> bool:
+        if isinstance(price, GasFees):
+            previous = GasBacktest._as_fees(sent)
+            return previous is None or price.exceeds(previous)
+        return price is not None and price > (sent.max_fee if isinstance(sent, GasFees) else sent or 0) * 1.125
+
+    @staticmethod
+    def _effective_price(sent, base_fee: int) -> Optional[int]:
+        if isinstance(sent, GasFees):
+            if sent.max_fee < base_fee:
+                return None
+            return min(sent.max_fee, base_fee + sent.max_priority_fee)
+        if sent is None or sent < base_fee:
+            return None
+        return sent
+
+    def __repr__(self):
+        return f"GasBacktest({self.history}, gas={self.gas})"
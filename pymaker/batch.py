@@ -0,0 +1,370 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Union
+from weakref import WeakKeyDictionary
+
+from web3 import Web3
+from web3._utils.method_formatters import receipt_formatter
+
+from pymaker import Address, allocate_nonces, next_nonce, Receipt, Transact, transaction_lock, TransactStatus
+from pymaker.concurrency import concurrency_controller
+from pymaker.gas import DefaultGasPrice, GasFees, GasPrice, gas_price_feed
+from pymaker.keys import registered_account
+from pymaker.rpc import batch_request
+from pymaker.tracing import BROADCAST, GAS_ESTIMATION, LOCK_WAIT, NONCE, RECEIPT_DECODE, SIGNING
+from pymaker.util import bytes_to_hexstring
+
+logger = logging.getLogger()
+
+
+def build_transaction(transact: Transact, from_account: str, gas: int, gas_price: Union[int, GasFees, None],
+                      nonce: int) -> dict:
+    """Returns the transaction dictionary `transact` would send, ready to be signed or sent to the node.
+
+    A :py:class:`pymaker.gas.GasFees` passed as `gas_price` makes it an EIP-1559 (type-2) transaction.
+    """
+    assert isinstance(transact, Transact)
+    assert isinstance(from_account, str)
+    assert isinstance(gas, int)
+    assert isinstance(gas_price, (int, GasFees)) or gas_price is None
+    assert isinstance(nonce, int)
+
+    transaction = {**transact._as_dict(transact.extra),
+                   'from': from_account,
+                   'to': transact.address.address,
+                   'gas': gas,
+                   'nonce': nonce}
+    if isinstance(gas_price, GasFees):
+        transaction.update(gas_price.transaction_params())
+    elif gas_price is not None:
+        transaction['gasPrice'] = gas_price
+
+    if transact.contract is not None:
+        if transact.function_name is None:
+            data = transact.parameters[0]
+            transaction['data'] = data if isinstance(data, str) else bytes_to_hexstring(data)
+        else:
+            transaction['data'] = transact._contract_function()._encode_transaction_data()
+
+    return transaction
+
+
+def _to_json(transaction: dict) -> dict:
+    return {key: hex(value) if isinstance(value, int) else value for key, value in transaction.items()}
+
+
+class ReceiptTracker:
+    """Polls receipts of many pending transactions at once, one JSON-RPC batch per poll.
+
+    Each tracked transaction gets its future resolved with a :py:class:`pymaker.Receipt` once
+    mined successfully, or with `None` if it failed, got replaced, or got overridden by another
+    transaction with the same nonce. The polling thread only runs while there is anything to track.
+
+    Attributes:
+        web3: An instance of `Web3` from `web3.py`.
+        poll_interval: Time (in seconds) between polls.
+    """
+
+    def __init__(self, web3: Web3, poll_interval: float = 1.0):
+        assert isinstance(web3, Web3)
+
+        self.web3 = web3
+        self.poll_interval = poll_interval
+        self.pending = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, transact: Transact, from_account: str, future: Future):
+        assert isinstance(transact, Transact)
+        assert isinstance(future, Future)
+
+        with self._lock:
+            self.pending.append({'transact': transact, 'from': from_account, 'future': future, 'misses': 0})
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="receipt-tracker", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                pending = list(self.pending)
+                if len(pending) == 0:
+                    self._thread = None
+                    return
+
+            try:
+                self.poll(pending)
+            except Exception as e:
+                logger.warning(f"Failed to poll receipts of {len(pending)} transactions ({e})")
+
+    def poll(self, pending: List[dict]):
+        """Checks receipts of `pending` transactions, resolving the futures of those which are done."""
+        accounts = sorted(set(entry['from'] for entry in pending))
+        hashes = [(entry, tx_hash) for entry in pending for tx_hash in entry['transact'].tx_hashes]
+        calls = [("eth_getTransactionCount", [account, "latest"]) for account in accounts] + \
+                [("eth_getTransactionReceipt", [tx_hash]) for _, tx_hash in hashes]
+        results = batch_request(self.web3, calls, raise_on_error=False)
+
+        tx_counts = {account: int(result, 16) for account, result in zip(accounts, results)
+                     if not isinstance(result, Exception)}
+        receipts = {}
+        for (entry, tx_hash), result in zip(hashes, results[len(accounts):]):
+            if isinstance(result, dict) and result.get('blockNumber') is not None:
+                receipts[id(entry)] = (tx_hash, result)
+
+        for entry in pending:
+            transact = entry['transact']
+            if id(entry) in receipts:
+                tx_hash, raw_receipt = receipts[id(entry)]
+                try:
+                    self._resolve(entry, self._receipt(transact, tx_hash, raw_receipt))
+                except Exception as e:
+                    self._resolve(entry, exception=e)
+            elif transact.replaced:
+                logger.info(f"Transaction with nonce={transact.nonce} was replaced with a newer transaction")
+                self._resolve(entry, None)
+            elif tx_counts.get(entry['from'], 0) > transact.nonce:
+                # the nonce has been used, but the receipt may not be available from this node yet
+                entry['misses'] += 1
+                if entry['misses'] >= 10:
+                    logger.warning(f"Transaction {transact.name()} has been overridden by another transaction"
+                                   f" with the same nonce, which means it has failed")
+                    self._resolve(entry, None)
+
+    @staticmethod
+    def _receipt(transact: Transact, tx_hash: str, raw_receipt: dict) -> Optional[Receipt]:
+        transact._trace_mined()
+        decode_start = time.time()
+        receipt = Receipt(receipt_formatter(raw_receipt))
+        if receipt.successful:
+            receipt.result = transact.result_function(receipt) if transact.result_function is not None else None
+            transact._add_span(RECEIPT_DECODE, decode_start, time.time())
+            transact._record_gas_used(receipt)
+            logger.info(f"Transaction {transact.name()} was successful (tx_hash={tx_hash})")
+            return receipt
+        else:
+            logger.warning(f"Transaction {transact.name()} mined successfully but generated no single"
+                           f" log entry, assuming it has failed (tx_hash={tx_hash})")
+            return None
+
+    def _resolve(self, entry: dict, result: Optional[Receipt] = None, exception: Optional[Exception] = None):
+        with self._lock:
+            self.pending.remove(entry)
+        entry['transact'].status = TransactStatus.FINISHED
+        entry['transact']._record_finished()
+        entry['transact']._export_trace(result)
+        if exception is not None:
+            entry['future'].set_exception(exception)
+        else:
+            entry['future'].set_result(result)
+
+
+_trackers = WeakKeyDictionary()
+_trackers_lock = threading.Lock()
+
+
+def receipt_tracker(web3: Web3) -> ReceiptTracker:
+    """Returns the :py:class:`pymaker.batch.ReceiptTracker` shared by all batches sent through `web3`."""
+    assert isinstance(web3, Web3)
+
+    with _trackers_lock:
+        if web3 not in _trackers:
+            _trackers[web3] = ReceiptTracker(web3)
+        return _trackers[web3]
+
+
+class TransactBatch:
+    """Submits many transactions from one account at once.
+
+    Compared to calling `transact_async` for each of them, gas is estimated for all transactions
+    concurrently, consecutive nonces are reserved in one go, and all transactions are sent
+    in a single JSON-RPC batch: signed locally with `eth_sendRawTransaction` if the key of the account
+    has been registered with :py:mod:`pymaker.keys`, or with `eth_sendTransaction` otherwise.
+    Receipts of all transactions are then polled together by a :py:class:`pymaker.batch.ReceiptTracker`.
+
+    Transactions are sent once, at the gas price given by the gas strategy at the time of submission.
+    The `Transact` objects get their `nonce` and `tx_hashes` set, so any of them can be bumped
+    afterwards with `transact_async(replace=...)`.
+
+    Allowed keyword arguments are the ones of `transact_async`, except `replace`.
+    """
+
+    def __init__(self, web3: Web3, transacts: List[Transact], **kwargs):
+        assert isinstance(web3, Web3)
+        assert isinstance(transacts, list)
+        assert all(isinstance(transact, Transact) for transact in transacts)
+
+        unknown_kwargs = set(kwargs.keys()) - {'from_address', 'gas', 'gas_buffer', 'gas_price'}
+        if len(unknown_kwargs) > 0:
+            raise ValueError(f"Unknown kwargs: {unknown_kwargs}")
+
+        self.web3 = web3
+        self.transacts = transacts
+        self.kwargs = kwargs
+        self.futures = [Future() for _ in transacts]
+
+    def submit(self) -> List[Future]:
+        """Submits all transactions.
+
+        Returns:
+            One `concurrent.futures.Future` per transaction, in the same order, resolving to either
+            a :py:class:`pymaker.Receipt` or `None`, like `transact_async` does.
+            Use `asyncio.wrap_future` to await them.
+        """
+        from_account = self.kwargs['from_address'].address if 'from_address' in self.kwargs \
+            else self.web3.eth.defaultAccount
+        gas_price = self.kwargs.get('gas_price', DefaultGasPrice())
+        assert isinstance(gas_price, GasPrice)
+        initial_time = time.time()
+
+        gas_limits = concurrency_controller(self.web3).map(lambda transact: self._gas(transact, from_account),
+                                                            self.transacts)
+        to_send = [index for index, gas in enumerate(gas_limits) if gas is not None]
+        for index, gas in enumerate(gas_limits):
+            if gas is None:
+                self.transacts[index].status = TransactStatus.FINISHED
+                self.transacts[index]._export_trace(None)
+                self.futures[index].set_result(None)
+        if len(to_send) == 0:
+            return self.futures
+
+        account = registered_account(self.web3, Address(from_account))
+        gas_fees = gas_price.get_gas_fees(0)
+        gas_price_value = gas_price.get_gas_price(0) if gas_fees is None else None
+        if account is not None and gas_fees is None and gas_price_value is None:
+            gas_price_value = gas_price_feed(self.web3).gas_price()
+        chain_id = self.web3.eth.chainId if account is not None else None
+
+        lock_start = time.time()
+        with transaction_lock:
+            nonce_start = time.time()
+            first_nonce = allocate_nonces(self.web3, from_account, len(to_send))
+            nonce_end = time.time()
+            calls = []
+            recorded = {}
+            for offset, index in enumerate(to_send):
+                transact = self.transacts[index]
+                transact._add_span(LOCK_WAIT, lock_start, nonce_start)
+                transact._add_span(NONCE, lock_start, nonce_end)
+                transaction = build_transaction(transact, from_account, gas_limits[index],
+                                                gas_fees or gas_price_value, first_nonce + offset)
+                if account is not None:
+                    del transaction['from']
+                    signing_start = time.time()
+                    signed = account.sign_transaction({**transaction, 'chainId': chain_id})
+                    transact._add_span(SIGNING, signing_start, time.time())
+                    # recorded ahead of the broadcast, so a crash in between does not lose the transaction
+                    recorded[index] = bytes_to_hexstring(signed.hash)
+                    transact._record_transaction(from_account, recorded[index], transaction)
+                    calls.append(("eth_sendRawTransaction", [bytes_to_hexstring(signed.rawTransaction)]))
+                else:
+                    calls.append(("eth_sendTransaction", [_to_json(transaction)]))
+
+            broadcast_start = time.time()
+            try:
+                results = batch_request(self.web3, calls, raise_on_error=False)
+            except Exception as e:
+                results = [e] * len(calls)
+            broadcast_end = time.time()
+
+            failed_nonces = [first_nonce + offset for offset, result in enumerate(results)
+                             if isinstance(result, Exception)]
+            if len(failed_nonces) > 0:
+                # let the next transaction fill the gap, so the ones sent after it do not get stuck
+                next_nonce[from_account] = min(failed_nonces)
+
+        tracker = receipt_tracker(self.web3)
+        for offset, (index, result) in enumerate(zip(to_send, results)):
+            transact = self.transacts[index]
+            transact.initial_time = initial_time
+            transact.gas_price = gas_price
+            transact.gas_price_last = gas_fees.max_fee if gas_fees is not None else gas_price_value or 0
+            transact.gas_fees_last = gas_fees
+            transact.nonce = first_nonce + offset
+            gas_price_text = gas_fees or (gas_price_value if gas_price_value is not None else 'default')
+
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to send transaction {transact.name()} with nonce={transact.nonce},"
+                               f" gas={gas_limits[index]}, gas_price={gas_price_text} ({result})")
+                if index in recorded:
+                    transact._record_unsent(recorded[index])
+                transact.status = TransactStatus.FINISHED
+                transact._export_trace(None)
+                self.futures[index].set_exception(result)
+                continue
+
+            logger.info(f"Sent transaction {transact.name()} with nonce={transact.nonce}, gas={gas_limits[index]},"
+                        f" gas_price={gas_price_text} (tx_hash={result})")
+            transact.status = TransactStatus.IN_PROGRESS
+            transact.tx_hashes.append(result)
+            transact._add_span(BROADCAST, broadcast_start, broadcast_end, tx_hash=result)
+            if index not in recorded:
+                transact._record_sent(from_account, gas_limits[index], gas_fees or gas_price_value, result)
+            tracker.track(transact, from_account, self.futures[index])
+
+        return self.futures
+
+    def _gas(self, transact: Transact, from_account: str) -> Optional[int]:
+        if transact.status != TransactStatus.NEW:
+            raise Exception("Each `Transact` can only be executed once")
+
+        transact._start_trace()
+        estimation_start = time.time()
+        modelled_gas = transact._modelled_gas(**self.kwargs)
+        if modelled_gas is not None:
+            transact._add_span(GAS_ESTIMATION, estimation_start, time.time())
+            return modelled_gas
+
+        try:
+            gas_estimate = transact.estimated_gas(Address(from_account))
+        except:
+            if Transact.gas_estimate_for_bad_txs:
+                logger.warning(f"Transaction {transact.name()} will fail, submitting anyway")
+                gas_estimate = Transact.gas_estimate_for_bad_txs
+            else:
+                logger.warning(f"Transaction {transact.name()} will fail, refusing to send ({sys.exc_info()[1]})")
+                return None
+
+        transact._add_span(GAS_ESTIMATION, estimation_start, time.time())
+        return transact._gas(gas_estimate, **self.kwargs)
+
+
+def submit_many(transacts: List[Transact], **kwargs) -> List[Future]:
+    """Submits many transactions at once, see :py:class:`pymaker.batch.TransactBatch`.
+
+    Args:
+        transacts: Transactions to be submitted, all through the same `Web3` instance.
+        kwargs: Keyword arguments of `transact_async`, except `replace`.
+
+    Returns:
+        One `concurrent.futures.Future` per transaction, resolving to either a :py:class:`pymaker.Receipt` or `None`.
+    """
+    assert isinstance(transacts, list)
+    if len(transacts) == 0:
+        return []
+
+    web3 = transacts[0].web3
+    assert all(transact.web3 is web3 for transact in transacts)
+
+    return TransactBatch(web3, transacts, **kwargs).submit()
@@ -0,0 +1,520 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import logging
+import threading
+from threading import Lock
+from typing import List, Optional
+
+from eth_utils import keccak
+from hexbytes import HexBytes
+from web3 import Web3
+
+from pymaker import Address
+
+
+logger = logging.getLogger()
+
+
+def bloom_contains(logs_bloom, value: bytes) -> bool:
+    """Checks whether a value (an address or a topic) may be present in a block `logsBloom`.
+
+    As with any bloom filter, `False` is definite while `True` may be a false positive.
+
+    Args:
+        logs_bloom: The 256-byte `logsBloom` of a block header, as bytes or a hex string.
+        value: Raw bytes of the address (20 bytes) or topic (32 bytes).
+    """
+    bloom = int.from_bytes(HexBytes(logs_bloom), byteorder='big')
+    value_hash = keccak(value)
+
+    for index in (0, 2, 4):
+        bit = ((value_hash[index] << 8) | value_hash[index + 1]) & 2047
+        if not (bloom >> bit) & 1:
+            return False
+
+    return True
+
+
+class LogTailer:
+    """Retrieves logs of new blocks, querying the node only if the block may contain any.
+
+    Every block header carries a `logsBloom`. Before issuing an `eth_getLogs` request, the bloom
+    is tested locally for the tracked addresses and (optionally) topics. Blocks which definitely
+    do not contain any relevant log are skipped without a round-trip to the node.
+
+    Attributes:
+        web3: An instance of `Web3` from `web3.py`.
+        addresses: Addresses of the contracts whose logs are tracked.
+        topics: Optional list of `topic0` values (event signatures) which are tracked.
+            If `None`, all logs of the tracked addresses are retrieved.
+    """
+
+    def __init__(self, web3: Web3, addresses: List[Address], topics: Optional[list] = None):
+        assert isinstance(web3, Web3)
+        assert isinstance(addresses, list)
+        assert len(addresses) > 0
+        assert all(isinstance(address, Address) for address in addresses)
+        assert isinstance(topics, list) or topics is None
+
+        self.web3 = web3
+        self.addresses = addresses
+        self.topics = [HexBytes(topic) for topic in topics] if topics is not None else None
+        self.blocks_skipped = 0
+        self.blocks_queried = 0
+
+    def matches(self, logs_bloom) -> bool:
+        """Checks whether a block with the specified `logsBloom` may contain any of the tracked logs."""
+        if not any(bloom_contains(logs_bloom, address.as_bytes()) for address in self.addresses):
+            return False
+
+        if self.topics is not None:
+            return any(bloom_contains(logs_bloom, bytes(topic)) for topic in self.topics)
+
+        return True
+
+    def logs(self, block) -> list:
+        """Returns the tracked logs of a block.
+
+        Args:
+            block: Block, as returned by `web3.eth.getBlock`. Needs to contain `hash` and `logsBloom`.
+
+        Returns:
+            List of raw logs, as returned by `eth_getLogs`. Empty if the bloom rules out any tracked log.
+        """
+        if not self.matches(block['logsBloom']):
+            self.blocks_skipped += 1
+            return []
+
+        self.blocks_queried += 1
+        filter_params = {
+            'blockHash': HexBytes(block['hash']).hex(),
+            'address': [address.address for address in self.addresses]
+        }
+        if self.topics is not None:
+            filter_params['topics'] = [[topic.hex() for topic in self.topics]]
+
+        return self.web3.eth.getLogs(filter_params)
+
+    def __repr__(self):
+        return f"LogTailer({self.addresses}, skipped={self.blocks_skipped}, queried={self.blocks_queried})"
+
+
+class BlockContext:
+    """Everything keeper logic usually needs to know about a new block, built from a single header fetch.
+
+    Reads made while handling a block should pass `block_identifier=context.number` (or use
+    `context.block_identifier`), so that all of them observe the same state even if a newer block
+    arrives in the meantime.
+
+    The context can also be used where a block dictionary is expected, i.e. it can be passed
+    to :py:meth:`pymaker.blocks.LogTailer.logs` or :py:meth:`pymaker.blocks.BlockStream.process`.
+
+    Attributes:
+        number: Block number.
+        hash: Block hash.
+        parent_hash: Hash of the parent block.
+        timestamp: Block timestamp.
+        base_fee: Base fee per gas (in Wei), or `None` for blocks preceding EIP-1559.
+        logs_bloom: Bloom filter of the logs emitted in the block.
+    """
+
+    _keys = {'number': 'number', 'hash': 'hash', 'parentHash': 'parent_hash', 'timestamp': 'timestamp',
+             'baseFeePerGas': 'base_fee', 'logsBloom': 'logs_bloom'}
+
+    def __init__(self, number: int, hash: HexBytes, parent_hash: HexBytes, timestamp: int,
+                 base_fee: Optional[int], logs_bloom: HexBytes):
+        assert isinstance(number, int)
+        assert isinstance(hash, HexBytes)
+        assert isinstance(parent_hash, HexBytes)
+        assert isinstance(timestamp, int)
+        assert isinstance(base_fee, int) or base_fee is None
+        assert isinstance(logs_bloom, HexBytes)
+
+        self.number = number
+        self.hash = hash
+        self.parent_hash = parent_hash
+        self.timestamp = timestamp
+        self.base_fee = base_fee
+        self.logs_bloom = logs_bloom
+
+    @staticmethod
+    def from_block(block) -> 'BlockContext':
+        """Builds the context from a block as returned by `web3.eth.getBlock` (or a websocket header)."""
+        base_fee = block.get('baseFeePerGas')
+        return BlockContext(number=int(block['number']),
+                            hash=HexBytes(block['hash']),
+                            parent_hash=HexBytes(block['parentHash']),
+                            timestamp=int(block['timestamp']),
+                            base_fee=int(base_fee) if base_fee is not None else None,
+                            logs_bloom=HexBytes(block['logsBloom']))
+
+    @property
+    def block_identifier(self) -> int:
+        return self.number
+
+    def __getitem__(self, key: str):
+        return getattr(self, self._keys[key])
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self._keys else default
+
+    def __repr__(self):
+        return f"BlockContext(#{self.number}, {self.hash.hex()})"
+
+
+class StreamedBlock:
+    """A block delivered by :py:class:`pymaker.blocks.BlockStream`.
+
+    Attributes:
+        number: Block number.
+        hash: Block hash.
+        parent_hash: Hash of the parent block.
+        timestamp: Block timestamp.
+        logs: Tracked logs of this block. When the block gets orphaned by a reorganization,
+            these are the logs which have been removed from the canonical chain.
+        removed: `True` once the block has been orphaned by a reorganization.
+    """
+
+    def __init__(self, number: int, hash: HexBytes, parent_hash: HexBytes, timestamp: int, logs: list):
+        assert isinstance(number, int)
+        assert isinstance(hash, HexBytes)
+        assert isinstance(parent_hash, HexBytes)
+        assert isinstance(timestamp, int)
+        assert isinstance(logs, list)
+
+        self.number = number
+        self.hash = hash
+        self.parent_hash = parent_hash
+        self.timestamp = timestamp
+        self.logs = logs
+        self.removed = False
+
+    @staticmethod
+    def from_block(block, logs: list):
+        return StreamedBlock(number=int(block['number']),
+                             hash=HexBytes(block['hash']),
+                             parent_hash=HexBytes(block['parentHash']),
+                             timestamp=int(block['timestamp']),
+                             logs=logs)
+
+    def __repr__(self):
+        return f"StreamedBlock(#{self.number}, {self.hash.hex()}{', removed' if self.removed else ''})"
+
+
+class BlockStream:
+    """Follows the canonical chain block by block, detecting chain reorganizations.
+
+    New head blocks are fed to `process`. The stream keeps the last `depth` blocks and checks that
+    each new block builds on top of them by comparing parent hashes. Missing blocks are fetched
+    by hash, so callbacks always see a contiguous chain.
+
+    When a new block does not build on the current tip, the stream walks the new branch back
+    to the common ancestor, calls the `on_reorg` callbacks with the orphaned blocks (newest first,
+    each carrying the logs which are no longer canonical), and then calls `on_block` for each block
+    of the new branch. Incremental indexes can roll back exactly the removed logs instead of being
+    rebuilt from scratch.
+
+    Callbacks are executed synchronously on the thread calling `process`, so they should be quick.
+
+    Attributes:
+        web3: An instance of `Web3` from `web3.py`.
+        depth: Number of most recent blocks tracked; reorganizations deeper than that are reported
+            as orphaning all tracked blocks.
+        tailer: Optional :py:class:`pymaker.blocks.LogTailer` used to retrieve the logs of each block.
+    """
+
+    def __init__(self, web3: Web3, depth: int = 64, tailer: Optional[LogTailer] = None):
+        assert isinstance(web3, Web3)
+        assert isinstance(depth, int)
+        assert depth > 0
+        assert isinstance(tailer, LogTailer) or tailer is None
+
+        self.web3 = web3
+        self.depth = depth
+        self.tailer = tailer
+        self.block_callbacks = []
+        self.reorg_callbacks = []
+        self._chain = []
+        self._lock = Lock()
+
+    def on_block(self, callback):
+        """Register a callback called with each new canonical :py:class:`pymaker.blocks.StreamedBlock`."""
+        assert callable(callback)
+        self.block_callbacks.append(callback)
+
+    def on_reorg(self, callback):
+        """Register a callback called as `callback(depth, orphaned_blocks)` on every reorganization."""
+        assert callable(callback)
+        self.reorg_callbacks.append(callback)
+
+    @property
+    def tip(self) -> Optional[StreamedBlock]:
+        """The most recent canonical block, or `None` if nothing has been processed yet."""
+        return self._chain[-1] if len(self._chain) > 0 else None
+
+    def process(self, block):
+        """Processes a new head block.
+
+        Args:
+            block: Block, as returned by `web3.eth.getBlock`.
+        """
+        with self._lock:
+            block_hash = HexBytes(block['hash'])
+            if any(streamed.hash == block_hash for streamed in self._chain):
+                return
+
+            # Walk the new branch back until it connects to one of the tracked blocks
+            known = {streamed.hash: index for index, streamed in enumerate(self._chain)}
+            branch = [block]
+            ancestor_index = None
+            while len(self._chain) > 0:
+                parent_hash = HexBytes(branch[-1]['parentHash'])
+                if parent_hash in known:
+                    ancestor_index = known[parent_hash]
+                    break
+                if int(branch[-1]['number']) - 1 < self._chain[0].number or len(branch) > self.depth:
+                    break
+                branch.append(self.web3.eth.getBlock(parent_hash))
+
+            if ancestor_index is not None:
+                orphaned = self._chain[ancestor_index + 1:]
+                self._chain = self._chain[:ancestor_index + 1]
+            elif len(self._chain) > 0:
+                # The branch could not be connected to any tracked block. If it overlaps tracked heights,
+                # all tracked blocks have been orphaned. Otherwise we have just fallen too far behind.
+                logger.warning(f"Block #{block['number']} ({block_hash.hex()}) does not connect to any of the"
+                               f" {len(self._chain)} tracked blocks")
+                overlaps = int(branch[-1]['number']) <= self._chain[-1].number
+                orphaned = self._chain if overlaps else []
+                self._chain = []
+            else:
+                orphaned = []
+
+            if len(orphaned) > 0:
+                orphaned = list(reversed(orphaned))
+                for streamed in orphaned:
+                    streamed.removed = True
+
+                logger.warning(f"Chain reorganization of depth {len(orphaned)} detected at block #{block['number']}")
+                for callback in self.reorg_callbacks:
+                    callback(len(orphaned), orphaned)
+
+            for new_block in reversed(branch):
+                logs = self.tailer.logs(new_block) if self.tailer is not None else []
+                streamed = StreamedBlock.from_block(new_block, logs)
+                self._chain.append(streamed)
+                if len(self._chain) > self.depth:
+                    self._chain.pop(0)
+
+                for callback in self.block_callbacks:
+                    callback(streamed)
+
+
+class WebsocketBlockSource:
+    """Receives new block headers and logs as they arrive, using `eth_subscribe` over a websocket.
+
+    The subscription runs on its own websocket connection, in a dedicated thread with its own asyncio
+    event loop. Only subscription notifications travel over that connection; any other request
+    (like backfilling) goes through the regular `web3` instance, so this does not suffer from the
+    `WebsocketProvider` threading limitations.
+
+    If the connection drops, it is re-established and all subscriptions are renewed. Headers and logs
+    of blocks produced in the meantime are then backfilled through `web3`, so no block is missed.
+    As backfilled blocks may also arrive as notifications, delivered headers are tracked by hash and
+    logs by `(blockHash, logIndex)`, and repeats within the last `backfill_limit` blocks are skipped.
+
+    Requires the `websockets` package, which is imported only once the source is started.
+
+    Attributes:
+        web3: An instance of `Web3` from `web3.py`, used for backfilling.
+        endpoint_uri: Websocket endpoint of the node, i.e. `ws://localhost:8546`.
+        reconnect_delay: Number of seconds to wait before reconnecting.
+        backfill_limit: Maximum number of missed blocks to backfill after a gap.
+    """
+
+    def __init__(self, web3: Web3, endpoint_uri: str, reconnect_delay: float = 1.0, backfill_limit: int = 64):
+        assert isinstance(web3, Web3)
+        assert isinstance(endpoint_uri, str)
+        assert endpoint_uri.startswith("ws")
+        assert isinstance(backfill_limit, int)
+
+        self.web3 = web3
+        self.endpoint_uri = endpoint_uri
+        self.reconnect_delay = reconnect_delay
+        self.backfill_limit = backfill_limit
+        self.head_callbacks = []
+        self.log_subscriptions = []
+        self.last_block_number = None
+        self._delivered_heads = {}
+        self._delivered_logs = {}
+        self._stopped = False
+        self._request_id = 0
+
+    def on_head(self, callback):
+        """Register a callback called with each new block header.
+
+        Headers are dictionaries with the same keys as `web3.eth.getBlock` results (without transactions);
+        `number` and `timestamp` are integers, `hash` and `parentHash` are `HexBytes`.
+        """
+        assert callable(callback)
+        self.head_callbacks.append(callback)
+
+    def subscribe_logs(self, filter_params: dict, callback):
+        """Register a callback called with each new log matching `filter_params` (`address` and/or `topics`).
+
+        Logs removed by a chain reorganization are delivered again with `removed` set to `True`.
+        """
+        assert isinstance(filter_params, dict)
+        assert callable(callback)
+        self.log_subscriptions.append((filter_params, callback))
+
+    def start(self) -> threading.Thread:
+        """Starts receiving notifications on a new daemon thread, which is returned."""
+        thread = threading.Thread(target=self._run_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stopped = True
+
+    def _run_forever(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._run())
+        finally:
+            loop.close()
+
+    async def _run(self):
+        import websockets
+
+        while not self._stopped:
+            try:
+                async with websockets.connect(self.endpoint_uri, max_size=None) as connection:
+                    handlers = {}
+                    handlers[await self._subscribe(connection, handlers, ["newHeads"])] = self._handle_head
+                    for filter_params, callback in self.log_subscriptions:
+                        subscription = await self._subscribe(connection, handlers, ["logs", filter_params])
+                        handlers[subscription] = self._log_handler(callback)
+                    logger.info(f"Subscribed to new heads and {len(self.log_subscriptions)} log filter(s)"
+                                f" at {self.endpoint_uri}")
+
+                    self._backfill(self.web3.eth.blockNumber)
+
+                    while not self._stopped:
+                        self._dispatch(handlers, json.loads(await connection.recv()))
+
+            except Exception as e:
+                if not self._stopped:
+                    logger.warning(f"Websocket subscription to {self.endpoint_uri} failed ({e}), reconnecting")
+                    await asyncio.sleep(self.reconnect_delay)
+
+    async def _subscribe(self, connection, handlers: dict, params: list) -> str:
+        self._request_id += 1
+        request_id = self._request_id
+        await connection.send(json.dumps({"jsonrpc": "2.0", "id": request_id, "method": "eth_subscribe",
+                                          "params": params}))
+        while True:
+            message = json.loads(await connection.recv())
+            if message.get('id') == request_id:
+                if 'error' in message:
+                    raise ValueError(message['error'])
+                return message['result']
+            self._dispatch(handlers, message)
+
+    @staticmethod
+    def _dispatch(handlers: dict, message: dict):
+        if message.get('method') == 'eth_subscription':
+            handler = handlers.get(message['params']['subscription'])
+            if handler is not None:
+                handler(message['params']['result'])
+
+    def _handle_head(self, raw_header: dict):
+        header = self._format_header(raw_header)
+        if self.last_block_number is not None and header['number'] > self.last_block_number + 1:
+            self._backfill(header['number'] - 1)
+        self._deliver_head(header)
+
+    def _deliver_head(self, header: dict):
+        if HexBytes(header['hash']) in self._delivered_heads:
+            return
+
+        self._delivered_heads[HexBytes(header['hash'])] = header['number']
+        self.last_block_number = max(header['number'], self.last_block_number or 0)
+        self._forget_delivered(self.last_block_number - self.backfill_limit)
+        for callback in self.head_callbacks:
+            callback(header)
+
+    def _deliver_log(self, callback, log: dict):
+        block_hash = HexBytes(log['blockHash']) if log.get('blockHash') is not None else None
+        key = (id(callback), block_hash, log.get('logIndex'), bool(log.get('removed', False)))
+        if key in self._delivered_logs:
+            return
+
+        self._delivered_logs[key] = log.get('blockNumber')
+        callback(log)
+
+    def _forget_delivered(self, below_block: int):
+        for delivered in (self._delivered_heads, self._delivered_logs):
+            for key in [key for key, number in delivered.items() if number is not None and number < below_block]:
+                del delivered[key]
+
+    def _backfill(self, to_block: int):
+        if self.last_block_number is None or to_block <= self.last_block_number:
+            return
+
+        from_block = max(self.last_block_number + 1, to_block - self.backfill_limit + 1)
+        logger.info(f"Backfilling blocks #{from_block} to #{to_block}")
+        for filter_params, callback in self.log_subscriptions:
+            for log in self.web3.eth.getLogs({**filter_params, 'fromBlock': from_block, 'toBlock': to_block}):
+                self._deliver_log(callback, log)
+        for block_number in range(from_block, to_block + 1):
+            self._deliver_head(self.web3.eth.getBlock(block_number))
+
+    def _log_handler(self, callback):
+        def handler(raw_log: dict):
+            self._deliver_log(callback, self._format_log(raw_log))
+
+        return handler
+
+    @staticmethod
+    def _format_header(raw_header: dict) -> dict:
+        header = dict(raw_header)
+        for key in ['number', 'timestamp', 'gasLimit', 'gasUsed', 'baseFeePerGas', 'difficulty']:
+            if header.get(key) is not None:
+                header[key] = int(header[key], 16)
+        for key in ['hash', 'parentHash', 'logsBloom', 'miner', 'stateRoot', 'receiptsRoot', 'transactionsRoot']:
+            if header.get(key) is not None:
+                header[key] = HexBytes(header[key])
+        return header
+
+    @staticmethod
+    def _format_log(raw_log: dict) -> dict:
+        log = dict(raw_log)
+        for key in ['blockNumber', 'logIndex', 'transactionIndex']:
+            if log.get(key) is not None:
+                log[key] = int(log[key], 16)
+        for key in ['blockHash', 'transactionHash']:
+            if log.get(key) is not None:
+                log[key] = HexBytes(log[key])
+        log['topics'] = [HexBytes(topic) for topic in log.get('topics', [])]
+        return log
+
+    def __repr__(self):
+        return f"WebsocketBlockSource('{self.endpoint_uri}')"
@@ -0,0 +1,264 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional
+from weakref import WeakKeyDictionary
+
+import requests
+from web3 import Web3
+
+from pymaker.metrics import MetricsSink
+
+logger = logging.getLogger()
+
+# JSON-RPC error codes used by hosted nodes when a rate limit has been exceeded
+THROTTLING_ERROR_CODES = (-32005, 429)
+
+
+def is_throttled(exception: Exception) -> bool:
+    """Tells whether `exception` means the node is throttling us or is overloaded, so requests should slow down."""
+    if isinstance(exception, requests.HTTPError):
+        return exception.response is not None and exception.response.status_code in (429, 503)
+    if isinstance(exception, requests.Timeout):
+        return True
+    if isinstance(exception, ValueError) and len(exception.args) > 0 and isinstance(exception.args[0], dict):
+        error = exception.args[0]
+        return error.get('code') in THROTTLING_ERROR_CODES or 'rate limit' in str(error.get('message', '')).lower()
+    return False
+
+
+def _retry_after(exception: Exception) -> Optional[float]:
+    if isinstance(exception, requests.HTTPError) and exception.response is not None:
+        try:
+            return float(exception.response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class AdaptiveConcurrency:
+    """Limits the number of concurrent RPC requests, adapting the limit to what the node can take.
+
+    The limit follows AIMD (additive increase, multiplicative decrease): every successful request
+    raises it by `1/limit`, so by one per limit's worth of requests, while a throttled request
+    (HTTP 429 or 503, a rate limit JSON-RPC error, or a timeout) halves it, at most once per round-trip.
+    Latencies growing beyond `latency_tolerance` times the usual low ones also lower the limit
+    slightly, as they mean requests are getting queued on the node side. Throttled requests are retried
+    after a backoff, honouring `Retry-After` if present.
+
+    One instance should be shared by all parallel paths talking to the same node, see
+    :py:func:`pymaker.concurrency.concurrency_controller`.
+
+    Attributes:
+        min_limit: Lowest concurrency limit.
+        max_limit: Highest concurrency limit, also the number of worker threads used by `map`.
+        latency_tolerance: Ratio to the 10th percentile of recent latencies above which the limit gets lowered.
+        max_retries: How many times a throttled request gets retried before giving up.
+        limit: Current concurrency limit.
+        throttled: Number of throttled requests so far.
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 latency_tolerance: float = 2.0, max_retries: int = 5, metrics: Optional[MetricsSink] = None):
+        assert isinstance(initial_limit, int)
+        assert isinstance(min_limit, int)
+        assert isinstance(max_limit, int)
+        assert 0 < min_limit <= initial_limit <= max_limit
+        assert latency_tolerance > 1
+        assert isinstance(max_retries, int)
+        assert isinstance(metrics, MetricsSink) or metrics is None
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.max_retries = max_retries
+        self.metrics = metrics if metrics is not None else MetricsSink()
+        self.limit = float(initial_limit)
+        self.throttled = 0
+        self.in_flight = 0
+        self._latencies = deque(maxlen=100)
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self._executor = None
+
+    def run(self, function: Callable, *args, **kwargs):
+        """Calls `function` once a slot is available, retrying it with backoff as long as it gets throttled.
+
+        Returns:
+            Whatever `function` returns. Exceptions other than throttling are raised straight away.
+        """
+        assert callable(function)
+
+        attempt = 0
+        while True:
+            self._acquire()
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                self._release()
+                if not is_throttled(e) or attempt >= self.max_retries:
+                    raise
+                self._on_throttled()
+                delay = _retry_after(e) or min(0.25 * 2 ** attempt, 10.0)
+                logger.debug(f"Request throttled ({e}), retrying in {delay:.2f}s with concurrency limit"
+                             f" lowered to {int(self.limit)}")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self._release()
+            self._on_success(time.perf_counter() - start)
+            return result
+
+    def map(self, function: Callable, items: Iterable) -> List:
+        """Calls `function` for each of `items` in parallel, within the concurrency limit.
+
+        Returns:
+            Results in the same order as `items`. The first exception raised, if any, is raised again.
+        """
+        items = list(items)
+        if len(items) < 2:
+            return [self.run(function, item) for item in items]
+
+        with self._condition:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_limit, thread_name_prefix="rpc-fanout")
+
+        futures = [self._executor.submit(self.run, function, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _acquire(self):
+        with self._condition:
+            while self.in_flight >= max(int(self.limit), self.min_limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def _release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _on_success(self, seconds: float):
+        with self._condition:
+            self._latencies.append(seconds)
+            if seconds > self.latency_tolerance * self._baseline_latency():
+                self.limit = max(self.min_limit, self.limit * 0.95)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            limit = self.limit
+
+        self.metrics.gauge("pymaker_rpc_concurrency_limit", limit)
+
+    def _baseline_latency(self) -> float:
+        # a low percentile rather than the minimum, so a single unusually fast response does not count
+        if len(self._latencies) < 10:
+            return float('inf')
+        return sorted(self._latencies)[len(self._latencies) // 10]
+
+    def _on_throttled(self):
+        with self._condition:
+            self.throttled += 1
+            # requests already in flight were sent under the old limit, so decrease once per round-trip only
+            round_trip = max(self._latencies) if len(self._latencies) > 0 else 1.0
+            now = time.time()
+            if now - self._last_decrease >= round_trip:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self._last_decrease = now
+            limit = self.limit
+
+        self.metrics.increment("pymaker_rpc_throttled_total")
+        self.metrics.gauge("pymaker_rpc_concurrency_limit", limit)
+
+    def install(self, web3: Web3):
+        """Makes this the controller returned by :py:func:`pymaker.concurrency.concurrency_controller` for `web3`."""
+        assert isinstance(web3, Web3)
+
+        _controllers[web3] = self
+
+    def __repr__(self):
+        return f"AdaptiveConcurrency(limit={self.limit:.1f}, in_flight={self.in_flight}, throttled={self.throttled})"
+
+
+_controllers = WeakKeyDictionary()
+_controllers_lock = threading.Lock()
+
+
+def concurrency_controller(web3: Web3) -> AdaptiveConcurrency:
+    """Returns the :py:class:`pymaker.concurrency.AdaptiveConcurrency` shared by all requests made through `web3`.
+
+    One with default settings gets created on first use, unless one has been installed beforehand.
+    """
+    assert isinstance(web3, Web3)
+
+    with _controllers_lock:
+        if web3 not in _controllers:
+            _controllers[web3] = AdaptiveConcurrency()
+        return _controllers[web3]
+
+
+def block_chunks(from_block: int, to_block: int, chunk_size: int) -> List[tuple]:
+    """Splits a block range into `(start, end)` ranges the way the `past_logs` methods always have."""
+    assert isinstance(from_block, int)
+    assert isinstance(to_block, int)
+    assert chunk_size > 0
+
+    chunks = []
+    start = from_block
+    end = None
+    while end is None or start <= to_block:
+        end = min(to_block, start + chunk_size)
+        chunks.append((start, end))
+        start += chunk_size
+    return chunks
+
+
+def get_logs(web3: Web3, filter_params: dict, from_block: int, to_block: int, chunk_size: int) -> list:
+    """Retrieves logs over a block range with one `eth_getLogs` request per chunk, the chunks being fetched in parallel.
+
+    Responses skip the web3.py result formatters, see :py:func:`pymaker.rpc.get_raw_logs`, which makes a
+    difference for large backfills. Logs come out the same as from `web3.eth.getLogs`.
+
+    Args:
+        web3: An instance of `Web3` from `web3.py`.
+        filter_params: Filter parameters other than `fromBlock` and `toBlock`.
+        from_block: Oldest block to retrieve logs from.
+        to_block: Newest block to retrieve logs from.
+        chunk_size: Number of blocks queried by a single request.
+
+    Returns:
+        List of raw logs, as returned by `eth_getLogs`, ordered by chunk.
+    """
+    from pymaker.rpc import format_raw_log, get_raw_logs
+
+    assert isinstance(web3, Web3)
+    assert isinstance(filter_params, dict)
+
+    chunks = block_chunks(from_block, to_block, chunk_size)
+    logger.debug(f"Querying logs from block {from_block} to {to_block} in {len(chunks)} requests")
+
+    def get_chunk(chunk: tuple) -> list:
+        raw_logs = get_raw_logs(web3, {**filter_params, 'fromBlock': chunk[0], 'toBlock': chunk[1]})
+        return [format_raw_log(raw_log) for raw_log in raw_logs]
+
+    return [log for logs in concurrency_controller(web3).map(get_chunk, chunks) for log in logs]
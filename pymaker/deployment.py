@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import logging
 import os
 import re
 from typing import Dict, List, Optional
@@ -29,6 +30,7 @@ from pymaker.approval import directly, hope_directly
 from pymaker.auth import DSGuard
 from pymaker.etherdelta import EtherDelta
 from pymaker.collateral import Collateral
+from pymaker.concurrency import get_logs
 from pymaker.dss import Cat, Dog, Jug, Pot, Spotter, TokenFaucet, Vat, Vow
 from pymaker.join import DaiJoin, GemJoin, GemJoin5
 from pymaker.proxy import ProxyRegistry, DssProxyActionsDsr
@@ -45,6 +47,9 @@ from pymaker.cdpmanager import CdpManager
 from pymaker.dsrmanager import DsrManager
 
 
+logger = logging.getLogger()
+
+
 def deploy_contract(web3: Web3, contract_name: str, args: Optional[list] = None) -> Address:
     """Deploys a new contract.
 
@@ -408,5 +413,54 @@ class DssDeployment:
             "flops": self.flopper.active_auctions()
         }
 
+    def log_sources(self) -> Dict[Address, object]:
+        """Returns the contracts whose logs are retrieved by `past_logs`, keyed by address."""
+        contracts = [self.vat, self.cat, self.dog, self.jug, self.flapper, self.flopper]
+        for collateral in self.collaterals.values():
+            contracts.append(collateral.flipper if collateral.flipper else collateral.clipper)
+
+        return {contract.address: contract for contract in contracts if contract is not None}
+
+    def past_logs(self, from_block: int, to_block: int = None, chunk_size=20000) -> Dict[Address, list]:
+        """Synchronously retrieve the history of the whole system in one pass over the block range.
+
+        Logs of the Vat, Cat, Dog, Jug, Flapper, Flopper and every collateral auction contract are retrieved
+        with a single `eth_getLogs` request per chunk, chunks being fetched in parallel, and then dispatched
+        to the `decode_logs` method of the contract which emitted them.
+
+        Args:
+            from_block: Oldest Ethereum block to retrieve the events from.
+            to_block: Optional newest Ethereum block to retrieve the events from, defaults to current block
+            chunk_size: Number of blocks to fetch from chain at one time, for performance tuning
+        Returns:
+            Dictionary keyed by contract address, with values being the list of decoded logs of that contract
+            (as returned by its `past_logs` method).
+        """
+        current_block = self.web3.eth.blockNumber
+        assert isinstance(from_block, int)
+        assert from_block <= current_block
+        if to_block is None:
+            to_block = current_block
+        else:
+            assert isinstance(to_block, int)
+            assert to_block >= from_block
+            assert to_block <= current_block
+        assert chunk_size > 0
+
+        sources = self.log_sources()
+        result = {address: [] for address in sources.keys()}
+
+        logger.debug(f"Consumer requested data of {len(sources)} contracts from block {from_block} to {to_block}")
+        logs_by_address = {}
+        filter_params = {'address': [address.address for address in sources.keys()]}
+        for log in get_logs(self.web3, filter_params, from_block, to_block, chunk_size):
+            logs_by_address.setdefault(Address(log['address']), []).append(log)
+
+        for address, logs in logs_by_address.items():
+            result[address].extend(sources[address].decode_logs(logs))
+
+        logger.debug(f"Found {sum(map(len, result.values()))} logs")
+        return result
+
     def __repr__(self):
         return f'DssDeployment({self.config.to_json()})'
@@ -0,0 +1,178 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+from weakref import WeakKeyDictionary
+
+from web3 import Web3
+
+from pymaker import Address, Receipt, RecoveredTransact, synchronize, Transact
+from pymaker.batch import submit_many
+from pymaker.keys import registered_addresses
+
+logger = logging.getLogger()
+
+
+class TransactDispatcher:
+    """Spreads independent transactions over a pool of accounts, so they do not queue behind each other's nonces.
+
+    Each account has its own nonce sequence, so transactions sent from different accounts do not wait
+    for each other, and a transaction stuck in the mempool only holds up the ones sent from the same account.
+    Every transaction goes to the account with the fewest transactions in flight, leaving out accounts
+    with a transaction pending for longer than `stuck_after` seconds, unless all of them are in that state.
+
+    Transactions which have to come from a specific account (i.e. `frob` on a vault owned by it) keep
+    their `from_address`; they still count towards the load of that account. Replacements (`replace=`)
+    always go to the account the replaced transaction has been sent from, as they reuse its nonce.
+
+    Attributes:
+        web3: An instance of `Web3` from `web3.py`.
+        accounts: Pool of accounts, by default all accounts registered with :py:func:`pymaker.keys.register_keys`.
+        stuck_after: Time (in seconds) after which an account with a pending transaction is considered stuck.
+    """
+
+    def __init__(self, web3: Web3, accounts: Optional[List[Address]] = None, stuck_after: int = 300):
+        assert isinstance(web3, Web3)
+        assert isinstance(accounts, list) or accounts is None
+        assert isinstance(stuck_after, int)
+
+        self.web3 = web3
+        self.accounts = accounts if accounts is not None else registered_addresses(web3)
+        self.stuck_after = stuck_after
+        self._in_flight = {address: [] for address in self.accounts}
+        self._senders = WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+        assert all(isinstance(address, Address) for address in self.accounts)
+        if len(self.accounts) == 0:
+            raise ValueError("No accounts to dispatch transactions to")
+
+    def in_flight(self) -> Dict[Address, int]:
+        """Returns the number of transactions in flight for each account."""
+        with self._lock:
+            return {address: len(transacts) for address, transacts in self._in_flight.items()}
+
+    def is_stuck(self, address: Address) -> bool:
+        """Tells whether `address` has had a transaction pending for longer than `stuck_after` seconds."""
+        assert isinstance(address, Address)
+
+        with self._lock:
+            return self._is_stuck(address, time.time())
+
+    def transact(self, transact: Transact, **kwargs) -> Optional[Receipt]:
+        """Executes `transact` synchronously from the least loaded account, see `transact_async`."""
+        return synchronize([self.transact_async(transact, **kwargs)])[0]
+
+    async def transact_async(self, transact: Transact, **kwargs) -> Optional[Receipt]:
+        """Executes `transact` from the least loaded account, or from `from_address` if given.
+
+        Allowed keyword arguments are the ones of :py:meth:`pymaker.Transact.transact_async`. With `replace`,
+        `transact` gets sent from the account the replaced transaction has been sent from.
+        """
+        assert isinstance(transact, Transact)
+
+        from_address = kwargs.get('from_address')
+        if kwargs.get('replace') is not None:
+            from_address = self._sender_of(kwargs['replace'], from_address)
+
+        address = self._acquire([transact], from_address)[0]
+        try:
+            return await transact.transact_async(**{**kwargs, 'from_address': address})
+        finally:
+            self._release(address, transact)
+
+    def submit_many(self, transacts: List[Transact], **kwargs) -> List[Future]:
+        """Submits `transacts` with :py:func:`pymaker.batch.submit_many`, spread over the least loaded accounts.
+
+        With `from_address` given, all of them get sent from that account.
+
+        Returns:
+            One `concurrent.futures.Future` per transaction, in the same order as `transacts`.
+        """
+        assert isinstance(transacts, list)
+
+        addresses = self._acquire(transacts, kwargs.get('from_address'))
+        futures = [None] * len(transacts)
+        try:
+            for address in set(addresses):
+                indexes = [index for index, assigned in enumerate(addresses) if assigned == address]
+                account_futures = submit_many([transacts[index] for index in indexes],
+                                              **{**kwargs, 'from_address': address})
+                for index, future in zip(indexes, account_futures):
+                    future.add_done_callback(lambda _, address=address, transact=transacts[index]:
+                                             self._release(address, transact))
+                    futures[index] = future
+        except Exception:
+            # transactions which have not been submitted would otherwise keep their accounts loaded forever
+            for index, future in enumerate(futures):
+                if future is None:
+                    self._release(addresses[index], transacts[index])
+            raise
+        return futures
+
+    def _acquire(self, transacts: List[Transact], from_address: Optional[Address]) -> List[Address]:
+        assert isinstance(from_address, Address) or from_address is None
+
+        addresses = []
+        with self._lock:
+            now = time.time()
+            for transact in transacts:
+                address = from_address if from_address is not None else self._least_loaded(now)
+                self._in_flight.setdefault(address, []).append(transact)
+                self._senders[transact] = address
+                addresses.append(address)
+        return addresses
+
+    def _sender_of(self, replaced: Transact, from_address: Optional[Address]) -> Address:
+        assert isinstance(replaced, Transact)
+
+        with self._lock:
+            sender = self._senders.get(replaced)
+        if sender is None and isinstance(replaced, RecoveredTransact):
+            sender = replaced.address
+        if sender is None:
+            if from_address is None:
+                raise ValueError(f"{replaced.name()} has not been sent through this dispatcher,"
+                                 f" `from_address` has to be given to replace it")
+            return from_address
+        if from_address is not None and from_address != sender:
+            raise ValueError(f"{replaced.name()} has been sent from {sender}, it can not be replaced from {from_address}")
+        return sender
+
+    def _release(self, address: Address, transact: Transact):
+        with self._lock:
+            self._in_flight[address].remove(transact)
+
+    def _least_loaded(self, now: float) -> Address:
+        healthy = [address for address in self.accounts if not self._is_stuck(address, now)]
+        if len(healthy) == 0:
+            logger.warning(f"All {len(self.accounts)} accounts have stuck transactions")
+            healthy = self.accounts
+
+        return min(healthy, key=lambda address: len(self._in_flight[address]))
+
+    def _is_stuck(self, address: Address, now: float) -> bool:
+        return any(transact.initial_time is not None and now - transact.initial_time > self.stuck_after
+                   for transact in self._in_flight.get(address, []))
+
+    def __repr__(self):
+        return f"TransactDispatcher({len(self.accounts)} accounts)"
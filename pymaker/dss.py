@@ -23,6 +23,7 @@ from typing import List
 from web3 import Web3
 
 from pymaker import Address, Contract, Transact
+from pymaker.concurrency import get_logs
 from pymaker.ilk import Ilk
 from pymaker.logging import LogNote
 from pymaker.token import DSToken, ERC20Token
@@ -397,50 +398,47 @@ class Vat(Contract):
         assert chunk_size > 0
 
         logger.debug(f"Consumer requested frob data from block {from_block} to {to_block}")
-        start = from_block
-        end = None
-        chunks_queried = 0
-        retval = []
-        while end is None or start <= to_block:
-            chunks_queried += 1
-            end = min(to_block, start+chunk_size)
-
-            filter_params = {
-                'address': self.address.address,
-                'fromBlock': start,
-                'toBlock': end
-            }
-            logger.debug(f"Querying logs from block {start} to {end} ({end-start} blocks); "
-                         f"accumulated {len(retval)} logs in {chunks_queried-1} requests")
+        logs = get_logs(self.web3, {'address': self.address.address}, from_block, to_block, chunk_size)
+        retval = self.decode_logs(logs, ilk, include_forks, include_moves)
 
-            logs = self.web3.eth.getLogs(filter_params)
+        logger.debug(f"Found {len(retval)} logs")
+        return retval
 
-            lognotes = list(map(lambda l: LogNote.from_event(l, Vat.abi), logs))
+    def decode_logs(self, logs: list, ilk: Ilk = None, include_forks=True, include_moves=True) -> List[object]:
+        """Decodes raw logs emitted by the Vat into the objects returned by `past_logs`.
+        Args:
+            logs: List of raw logs, as returned by `eth_getLogs`.
+            ilk: Optionally filter frobs by ilk.name
+        Returns:
+            Unordered list of `LogFork`, `LogFrob`, and `LogMove` events.
+        """
+        assert isinstance(logs, list)
+        assert isinstance(ilk, Ilk) or ilk is None
 
-            # '0x7cdd3fde' is Vat.slip (from GemJoin.join) and '0x76088703' is Vat.frob
-            logfrobs = list(filter(lambda l: l.sig == '0x76088703', lognotes))
-            logfrobs = list(map(lambda l: Vat.LogFrob(l), logfrobs))
+        retval = []
+        lognotes = list(filter(None, map(lambda l: LogNote.from_event(l, Vat.abi), logs)))
+
+        # '0x7cdd3fde' is Vat.slip (from GemJoin.join) and '0x76088703' is Vat.frob
+        logfrobs = list(filter(lambda l: l.sig == '0x76088703', lognotes))
+        logfrobs = list(map(lambda l: Vat.LogFrob(l), logfrobs))
+        if ilk is not None:
+            logfrobs = list(filter(lambda l: l.ilk == ilk.name, logfrobs))
+        retval.extend(logfrobs)
+
+        # '0xbb35783b' is Vat.move
+        if include_moves:
+            logmoves = list(filter(lambda l: l.sig == '0xbb35783b', lognotes))
+            logmoves = list(map(lambda l: Vat.LogMove(l), logmoves))
+            retval.extend(logmoves)
+
+        # '0x870c616d' is Vat.fork
+        if include_forks:
+            logforks = list(filter(lambda l: l.sig == '0x870c616d', lognotes))
+            logforks = list(map(lambda l: Vat.LogFork(l), logforks))
             if ilk is not None:
-                logfrobs = list(filter(lambda l: l.ilk == ilk.name, logfrobs))
-            retval.extend(logfrobs)
-
-            # '0xbb35783b' is Vat.move
-            if include_moves:
-                logmoves = list(filter(lambda l: l.sig == '0xbb35783b', lognotes))
-                logmoves = list(map(lambda l: Vat.LogMove(l), logmoves))
-                retval.extend(logmoves)
-
-            # '0x870c616d' is Vat.fork
-            if include_forks:
-                logforks = list(filter(lambda l: l.sig == '0x870c616d', lognotes))
-                logforks = list(map(lambda l: Vat.LogFork(l), logforks))
-                if ilk is not None:
-                    logforks = list(filter(lambda l: l.ilk == ilk.name, logforks))
-                retval.extend(logforks)
-
-            start += chunk_size
-
-        logger.debug(f"Found {len(retval)} logs in {chunks_queried} requests")
+                logforks = list(filter(lambda l: l.ilk == ilk.name, logforks))
+            retval.extend(logforks)
+
         return retval
 
     def heal(self, vice: Rad) -> Transact:
@@ -634,6 +632,16 @@ class Jug(Contract):
 
         return Web3.toInt(self._contract.functions.ilks(ilk.toBytes()).call()[1])
 
+    def decode_logs(self, logs: list) -> List[LogNote]:
+        """Decodes raw logs emitted by the Jug (`drip`, `file`, `init`) into `LogNote` objects.
+
+        Args:
+            logs: List of raw logs, as returned by `eth_getLogs`.
+        """
+        assert isinstance(logs, list)
+
+        return list(filter(None, map(lambda l: LogNote.from_event(l, Jug.abi), logs)))
+
     def __repr__(self):
         return f"Jug('{self.address}')"
 
@@ -778,6 +786,14 @@ class Cat(Contract):
 
         return self._past_events(self._contract, 'Bite', Cat.LogBite, number_of_past_blocks, event_filter)
 
+    def decode_logs(self, logs: list) -> List[LogBite]:
+        """Decodes the `Bite` events from a list of raw logs emitted by the Cat.
+
+        Args:
+            logs: List of raw logs, as returned by `eth_getLogs`.
+        """
+        return self._decode_events(self._contract, 'Bite', Cat.LogBite, logs)
+
     def __repr__(self):
         return f"Cat('{self.address}')"
 
@@ -897,6 +913,14 @@ class Dog(Contract):
 
         return self._past_events(self._contract, 'Bark', Dog.LogBark, number_of_past_blocks, event_filter)
 
+    def decode_logs(self, logs: list) -> List[LogBark]:
+        """Decodes the `Bark` events from a list of raw logs emitted by the Dog.
+
+        Args:
+            logs: List of raw logs, as returned by `eth_getLogs`.
+        """
+        return self._decode_events(self._contract, 'Bark', Dog.LogBark, logs)
+
 
 class Pot(Contract):
     """A client for the `Pot` contract, which implements the DSR.
@@ -15,10 +15,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+import logging
 import math
-from typing import Optional
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+from weakref import WeakKeyDictionary
+
 from web3 import Web3
 
+logger = logging.getLogger()
+
 
 class GasPrice(object):
     GWEI = 1000000000
@@ -57,6 +66,79 @@ class GasPrice(object):
         """
         raise NotImplementedError("Please implement this method")
 
+    def get_gas_fees(self, time_elapsed: int) -> Optional['GasFees']:
+        """Return EIP-1559 fees applicable for a given point in time.
+
+        Strategies returning fees here make :py:class:`pymaker.Transact` send type-2 transactions,
+        with `get_gas_price` only used by code which does not support them. The default implementation
+        returns `None`, meaning legacy transactions priced by `get_gas_price` get sent.
+
+        Args:
+            time_elapsed: Number of seconds since this specific Ethereum transaction
+                has been originally sent for the first time.
+
+        Returns:
+            :py:class:`pymaker.gas.GasFees` to be used, or `None` for a legacy transaction.
+        """
+        return None
+
+
+class GasFees(object):
+    """Fees of an EIP-1559 (type-2) transaction.
+
+    Nodes accept a replacement of a pending type-2 transaction only if both fees go up by at least 10%.
+
+    Attributes:
+        max_fee: Maximum total fee per gas (`maxFeePerGas`) in Wei.
+        max_priority_fee: Maximum priority fee per gas (`maxPriorityFeePerGas`) paid to the miner, in Wei.
+    """
+
+    # nodes compare fees in integer arithmetic, so do we, to avoid rounding down to a rejected replacement
+    REPLACEMENT_BUMP_PERCENT = 10
+
+    def __init__(self, max_fee: int, max_priority_fee: int):
+        assert(isinstance(max_fee, int))
+        assert(isinstance(max_priority_fee, int))
+        assert(0 <= max_priority_fee <= max_fee)
+
+        self.max_fee = max_fee
+        self.max_priority_fee = max_priority_fee
+
+    def replaces(self, previous: 'GasFees') -> bool:
+        """Tells whether a transaction with these fees may replace one sent with `previous` fees."""
+        assert(isinstance(previous, GasFees))
+
+        return self.max_fee >= self._bump(previous.max_fee) and \
+            self.max_priority_fee >= self._bump(previous.max_priority_fee)
+
+    def exceeds(self, previous: 'GasFees') -> bool:
+        """Tells whether either of the fees went up by at least 10% since `previous`, so a replacement is worth it."""
+        assert(isinstance(previous, GasFees))
+
+        return self.max_fee >= self._bump(previous.max_fee) or \
+            self.max_priority_fee >= self._bump(previous.max_priority_fee)
+
+    def bumped_from(self, previous: 'GasFees') -> 'GasFees':
+        """Returns these fees, raised where needed so they replace `previous` fees."""
+        assert(isinstance(previous, GasFees))
+
+        max_priority_fee = max(self.max_priority_fee, self._bump(previous.max_priority_fee))
+        max_fee = max(self.max_fee, self._bump(previous.max_fee), max_priority_fee)
+        return GasFees(max_fee, max_priority_fee)
+
+    def _bump(self, fee: int) -> int:
+        return -(-fee * (100 + self.REPLACEMENT_BUMP_PERCENT) // 100)
+
+    def transaction_params(self) -> dict:
+        return {'type': 2, 'maxFeePerGas': self.max_fee, 'maxPriorityFeePerGas': self.max_priority_fee}
+
+    def __eq__(self, other):
+        return isinstance(other, GasFees) and (self.max_fee, self.max_priority_fee) == \
+               (other.max_fee, other.max_priority_fee)
+
+    def __repr__(self):
+        return f"GasFees(max_fee={self.max_fee}, max_priority_fee={self.max_priority_fee})"
+
 
 class DefaultGasPrice(GasPrice):
     """Default gas price.
@@ -69,10 +151,150 @@ class DefaultGasPrice(GasPrice):
         return None
 
 
+class GasPriceFeed(object):
+    """Gas pricing data of a node, shared by all gas price strategies using the same `Web3` instance.
+
+    `eth_gasPrice` and the likes change once per block at most, while pending transactions ask their
+    strategies for a gas price several times per second. Instead of querying the node every time,
+    values get cached and refreshed by a background thread, in a single batch per new block, or once
+    `max_age` seconds have passed. Reading a value only waits for the node the first time it is read;
+    after that, the cached value is returned straight away.
+
+    The background thread stops if nothing has been read for `idle_secs` seconds, and starts again
+    with the next read. Values older than `max_age` are never returned, they get requested from the
+    node again instead, so the first read after a quiet period does not get stale prices.
+
+    Use :py:func:`pymaker.gas.gas_price_feed` to get the feed of a `Web3` instance.
+
+    Attributes:
+        web3: An instance of `Web3` from `web3.py`.
+        poll_interval: Time (in seconds) between checks for a new block.
+        max_age: Maximum age (in seconds) of cached values, should the chain not progress.
+        idle_secs: Time (in seconds) without reads after which the background thread stops.
+        block_number: Number of the block the values have been last refreshed at.
+    """
+
+    def __init__(self, web3: Web3, poll_interval: float = 1.0, max_age: float = 30.0, idle_secs: float = 300.0):
+        assert isinstance(web3, Web3)
+        assert poll_interval > 0
+        assert max_age > 0
+
+        self.web3 = web3
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self.idle_secs = idle_secs
+        self.block_number = None
+        self._values = {}
+        self._fetched_at = {}
+        self._refreshed_at = 0.0
+        self._last_read = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def gas_price(self) -> int:
+        """Returns the gas price suggested by the node (`eth_gasPrice`), in Wei."""
+        return int(self.get("eth_gasPrice", []), 16)
+
+    def fee_history(self, block_count: int, reward_percentile: float) -> dict:
+        """Returns the `eth_feeHistory` of the latest `block_count` blocks, as received from the node."""
+        assert isinstance(block_count, int)
+
+        return self.get("eth_feeHistory", [hex(block_count), "latest", [reward_percentile]])
+
+    def get(self, method: str, params: list):
+        """Returns the cached result of a JSON-RPC request, adding the request to the ones being refreshed.
+
+        Results are returned as received from the node, i.e. quantities are hexadecimal strings.
+        """
+        assert isinstance(method, str)
+        assert isinstance(params, list)
+
+        key = (method, json.dumps(params))
+        with self._lock:
+            self._last_read = time.time()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gas-price-feed", daemon=True)
+                self._thread.start()
+            if key in self._values and time.time() - self._fetched_at[key] <= self.max_age:
+                return self._values[key]
+
+        value = self._request([(method, params)])[0]
+        with self._lock:
+            if key not in self._values or time.time() - self._fetched_at[key] > self.max_age:
+                self._values[key] = value
+                self._fetched_at[key] = time.time()
+            return self._values[key]
+
+    def refresh(self):
+        """Refreshes all cached values in one batch, if there is a new block or they are older than `max_age`."""
+        from pymaker.rpc import batch_request
+
+        block_number = int(batch_request(self.web3, [("eth_blockNumber", [])])[0], 16)
+        if block_number == self.block_number and time.time() - self._refreshed_at < self.max_age:
+            return
+
+        with self._lock:
+            keys = list(self._values.keys())
+        values = self._request([(method, json.loads(params)) for method, params in keys])
+        with self._lock:
+            now = time.time()
+            self._values.update(zip(keys, values))
+            self._fetched_at.update((key, now) for key in keys)
+            self.block_number = block_number
+            self._refreshed_at = now
+
+    def _request(self, calls: list) -> list:
+        from pymaker.rpc import batch_request
+
+        return batch_request(self.web3, calls) if len(calls) > 0 else []
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if time.time() - self._last_read > self.idle_secs:
+                    # nothing keeps the values up to date from now on
+                    self._values.clear()
+                    self._fetched_at.clear()
+                    self._thread = None
+                    return
+
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Failed to refresh gas prices, using ones from block {self.block_number} ({e})")
+
+    def install(self):
+        """Makes this the feed returned by :py:func:`pymaker.gas.gas_price_feed` for its `Web3` instance."""
+        _feeds[self.web3] = self
+
+    def __repr__(self):
+        return f"GasPriceFeed(block_number={self.block_number})"
+
+
+_feeds = WeakKeyDictionary()
+_feeds_lock = threading.Lock()
+
+
+def gas_price_feed(web3: Web3) -> GasPriceFeed:
+    """Returns the :py:class:`pymaker.gas.GasPriceFeed` shared by all strategies using `web3`.
+
+    One with default settings gets created on first use, unless one has been installed beforehand.
+    """
+    assert isinstance(web3, Web3)
+
+    with _feeds_lock:
+        if web3 not in _feeds:
+            _feeds[web3] = GasPriceFeed(web3)
+        return _feeds[web3]
+
+
 class NodeAwareGasPrice(GasPrice):
     """Abstract baseclass which is Web3-aware.
 
-    Retrieves the default gas price provided by the Ethereum node to be consumed by subclasses.
+    Retrieves the default gas price provided by the Ethereum node to be consumed by subclasses,
+    through the :py:class:`pymaker.gas.GasPriceFeed` of the `Web3` instance, so it does not cost
+    a request to the node every time.
     """
 
     def __init__(self, web3: Web3):
@@ -87,7 +309,7 @@ class NodeAwareGasPrice(GasPrice):
         raise NotImplementedError("Please implement this method")
 
     def get_node_gas_price(self):
-        return max(self.web3.manager.request_blocking("eth_gasPrice", []), 1 * self.GWEI)
+        return max(gas_price_feed(self.web3).gas_price(), 1 * self.GWEI)
 
 
 class FixedGasPrice(GasPrice):
@@ -204,3 +426,206 @@ class GeometricGasPrice(GasPrice):
             result = min(result, self.max_price)
 
         return math.ceil(result)
+
+
+class FixedGasFees(GasPrice):
+    """Fixed EIP-1559 fees.
+
+    The fees may be later changed (while the transaction is still in progress) by calling
+    the `update_gas_fees` method, in which case the transaction gets replaced if both fees
+    went up by at least 10%.
+
+    Attributes:
+        gas_fees: :py:class:`pymaker.gas.GasFees` to be used.
+    """
+    def __init__(self, max_fee: int, max_priority_fee: int):
+        self.gas_fees = GasFees(max_fee, max_priority_fee)
+
+    def update_gas_fees(self, max_fee: int, max_priority_fee: int):
+        self.gas_fees = GasFees(max_fee, max_priority_fee)
+
+    def get_gas_price(self, time_elapsed: int) -> Optional[int]:
+        return self.gas_fees.max_fee
+
+    def get_gas_fees(self, time_elapsed: int) -> Optional[GasFees]:
+        assert(isinstance(time_elapsed, int))
+        return self.gas_fees
+
+
+class FeeHistoryGasPrice(NodeAwareGasPrice):
+    """EIP-1559 fees derived from recent blocks, as reported by `eth_feeHistory`.
+
+    The priority fee is the median, over the last `block_count` blocks, of the `reward_percentile`
+    percentile of priority fees paid in each block; empty blocks are left out. The maximum fee
+    leaves room for the base fee to grow by `base_fee_multiplier` before the transaction stops
+    being includable. Both get multiplied by `coefficient` every `every_secs` seconds the transaction
+    is pending, so it gets replaced with a more attractive one, up to the optional `max_fee`.
+
+    Fee history comes from the :py:class:`pymaker.gas.GasPriceFeed` of the `Web3` instance.
+
+    Attributes:
+        reward_percentile: Percentile of priority fees paid in each block the priority fee is based on.
+        block_count: Number of recent blocks taken into account.
+        base_fee_multiplier: Multiplier applied to the base fee of the next block in the maximum fee.
+        every_secs: Fee increase interval (in seconds).
+        coefficient: Fee multiplier, at least 1.1 so that increases replace the pending transaction.
+        max_fee: Optional upper limit of the maximum fee.
+        min_priority_fee: Lower limit of the priority fee.
+    """
+    def __init__(self, web3: Web3, reward_percentile: float = 50, block_count: int = 20,
+                 base_fee_multiplier: float = 2.0, every_secs: int = 30, coefficient: float = 1.125,
+                 max_fee: Optional[int] = None, min_priority_fee: int = GasPrice.GWEI):
+        super().__init__(web3)
+        assert(0 <= reward_percentile <= 100)
+        assert(isinstance(block_count, int))
+        assert(block_count > 0)
+        assert(base_fee_multiplier >= 1)
+        assert(isinstance(every_secs, int))
+        assert(every_secs > 0)
+        assert(coefficient >= 1 + GasFees.REPLACEMENT_BUMP_PERCENT / 100)
+        assert(isinstance(max_fee, int) or max_fee is None)
+        assert(isinstance(min_priority_fee, int))
+
+        self.reward_percentile = reward_percentile
+        self.block_count = block_count
+        self.base_fee_multiplier = base_fee_multiplier
+        self.every_secs = every_secs
+        self.coefficient = coefficient
+        self.max_fee = max_fee
+        self.min_priority_fee = min_priority_fee
+
+    def current_fees(self) -> GasFees:
+        """Returns fees for a transaction sent now, based on the cached fee history."""
+        return self._fees_from_history(gas_price_feed(self.web3).fee_history(self.block_count,
+                                                                             self.reward_percentile))
+
+    def _fees_from_history(self, history) -> GasFees:
+        def to_int(value) -> int:
+            return int(value, 16) if isinstance(value, str) else int(value)
+
+        # the last base fee is the one of the next block
+        next_base_fee = to_int(history['baseFeePerGas'][-1])
+        rewards = sorted(to_int(reward[0]) for reward, ratio in zip(history.get('reward') or [],
+                                                                    history.get('gasUsedRatio') or [])
+                         if ratio > 0 and len(reward) > 0)
+        priority_fee = max(rewards[len(rewards) // 2] if len(rewards) > 0 else 0, self.min_priority_fee)
+        return GasFees(math.ceil(next_base_fee * self.base_fee_multiplier) + priority_fee, priority_fee)
+
+    def get_gas_price(self, time_elapsed: int) -> Optional[int]:
+        return self.get_gas_fees(time_elapsed).max_fee
+
+    def get_gas_fees(self, time_elapsed: int) -> Optional[GasFees]:
+        assert(isinstance(time_elapsed, int))
+
+        fees = self.current_fees()
+        multiplier = self.coefficient ** math.floor(time_elapsed / self.every_secs)
+        max_priority_fee = math.ceil(fees.max_priority_fee * multiplier)
+        max_fee = math.ceil(fees.max_fee * multiplier)
+        if self.max_fee is not None:
+            max_fee = min(max_fee, self.max_fee)
+            max_priority_fee = min(max_priority_fee, max_fee)
+
+        return GasFees(max_fee, max_priority_fee)
+
+
+class GasLimitModel(object):
+    """Learns gas limits of frequently sent contract functions from the gas they actually used.
+
+    Gas used by every successful transaction is recorded per contract address and function name.
+    Once enough samples are collected for one of `functions`, :py:class:`pymaker.Transact` can take
+    the gas limit from here rather than calling `eth_estimateGas`, saving a round-trip and an EVM
+    execution on the node right when the transaction is most time-critical. The limit is a high
+    quantile of recent samples with a safety margin on top.
+
+    Install it with `Transact.gas_limit_model = GasLimitModel()`. Passing `gas` or `gas_buffer`
+    to `transact_async` still takes precedence.
+
+    Skipping `eth_estimateGas` also skips the check that the call does not revert: a transaction which
+    would fail (i.e. a `take` on an auction someone else already took) gets broadcast anyway and pays
+    for the gas it uses until the revert. Only list functions here for which a lost race costs less
+    than the latency saved, and check preconditions with calls of their own where that is not the case.
+
+    Attributes:
+        functions: Names of the functions the model may provide gas limits for.
+        quantile: Quantile of recent samples the gas limit is based on.
+        margin: Multiplier applied on top of the quantile.
+        min_samples: Number of samples required before a gas limit is provided.
+        validate: Whether to run `eth_estimateGas` in the background after sending with a modelled limit,
+            learning from estimates exceeding it.
+        underestimates: Number of background estimates which exceeded the modelled limit.
+    """
+
+    DEFAULT_FUNCTIONS = frozenset(['bark', 'bite', 'take', 'tend', 'dent', 'deal', 'offer'])
+
+    def __init__(self, functions=DEFAULT_FUNCTIONS, quantile: float = 0.99, margin: float = 1.25,
+                 min_samples: int = 10, window: int = 200, validate: bool = True):
+        assert 0 < quantile <= 1
+        assert margin >= 1
+        assert isinstance(min_samples, int)
+        assert isinstance(window, int)
+        assert window >= min_samples > 0
+
+        self.functions = frozenset(functions)
+        self.quantile = quantile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.window = window
+        self.validate = validate
+        self.underestimates = 0
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(address: str, function_name: str) -> tuple:
+        return address.lower(), function_name.split('(')[0]
+
+    def record(self, address: str, function_name: str, gas_used: int):
+        """Records gas used by a successful invocation of `function_name` on the contract at `address`."""
+        assert isinstance(address, str)
+        assert isinstance(function_name, str)
+        assert isinstance(gas_used, int)
+
+        with self._lock:
+            key = self._key(address, function_name)
+            if key not in self.samples:
+                self.samples[key] = deque(maxlen=self.window)
+            self.samples[key].append(gas_used)
+
+    def gas_limit(self, address: str, function_name: Optional[str]) -> Optional[int]:
+        """Returns the gas limit to use for `function_name` on the contract at `address`, or `None` if unknown."""
+        if function_name is None:
+            return None
+
+        key = self._key(address, function_name)
+        if key[1] not in self.functions:
+            return None
+
+        with self._lock:
+            samples = sorted(self.samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+
+        return int(samples[min(int(self.quantile * len(samples)), len(samples) - 1)] * self.margin)
+
+    def validate_in_background(self, address: str, function_name: str, gas: int, estimate: Callable[[], int]):
+        """Calls `estimate` on a separate thread, logging and learning from estimates exceeding `gas`."""
+        assert callable(estimate)
+
+        def validate():
+            try:
+                estimated_gas = estimate()
+            except Exception as e:
+                logger.debug(f"Background gas estimation of {function_name} failed ({e})")
+                return
+
+            if estimated_gas > gas:
+                logger.warning(f"Modelled gas limit {gas} of {function_name} is below the estimate {estimated_gas}")
+                self.record(address, function_name, estimated_gas)
+                with self._lock:
+                    self.underestimates += 1
+
+        if self.validate:
+            threading.Thread(target=validate, daemon=True).start()
+
+    def __repr__(self):
+        return f"GasLimitModel({len(self.samples)} functions, quantile={self.quantile}, margin={self.margin})"
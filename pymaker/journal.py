@@ -0,0 +1,222 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import List
+
+from web3 import Web3
+
+from pymaker import Address, RecoveredTransact
+from pymaker.gas import GasFees
+
+logger = logging.getLogger()
+
+
+class TransactionJournal:
+    """Append-only local record of every transaction sent, so pending ones can be recovered after a restart.
+
+    Every transaction sent by :py:class:`pymaker.Transact` (including replacements, batches and pre-signed
+    transactions) gets a line with its sender, nonce, hash, and the full transaction: recipient, calldata,
+    value, gas limit and gas price or fees. Transactions signed by pymaker get their line written before
+    they are broadcast, as their hash is known by then, followed by an `unsent` line should the broadcast
+    fail; transactions signed by the node can only be recorded once it has returned their hash. Once a
+    `Transact` completes, a line with its hashes marks its nonce as done. Lines are flushed and synced to
+    disk before the call returns, so a crash can at most lose the line being written, which gets skipped
+    on reading.
+
+    Pending transactions are also kept in memory, and the file gets compacted to only them once
+    `compact_every` of its lines are about transactions which are not pending anymore.
+
+    Enable it by setting `Transact.journal`, i.e. `Transact.journal = TransactionJournal("txs.jsonl")`,
+    and use `recover` on startup.
+
+    Attributes:
+        path: Path of the journal file.
+        fsync: Whether to sync the file to disk after every line.
+        compact_every: Number of obsolete lines after which the file gets compacted.
+    """
+
+    def __init__(self, path: str, fsync: bool = True, compact_every: int = 1000):
+        assert isinstance(path, str)
+        assert isinstance(fsync, bool)
+        assert isinstance(compact_every, int)
+        assert compact_every > 0
+
+        self.path = path
+        self.fsync = fsync
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        # `sent` records of every pending nonce, by sender and nonce, read from the file on first use
+        self._sent = None
+        self._nonces_by_hash = {}
+        self._lines = 0
+
+    def record_sent(self, from_account: str, nonce: int, tx_hash: str, transaction: dict):
+        """Records a transaction which has just been sent, or which is just about to be.
+
+        Args:
+            from_account: Sender of the transaction.
+            nonce: Nonce of the transaction.
+            tx_hash: Hash of the transaction.
+            transaction: The transaction sent, with `to`, `data`, `value`, `gas` and either `gasPrice`
+                or `maxFeePerGas` and `maxPriorityFeePerGas`.
+        """
+        assert isinstance(from_account, str)
+        assert isinstance(nonce, int)
+        assert isinstance(tx_hash, str)
+        assert isinstance(transaction, dict)
+
+        fields = ('to', 'data', 'value', 'gas', 'gasPrice', 'maxFeePerGas', 'maxPriorityFeePerGas')
+        self._append({'event': 'sent', 'time': time.time(), 'from': from_account, 'nonce': nonce, 'txHash': tx_hash,
+                      'transaction': {key: value for key, value in transaction.items() if key in fields}})
+
+    def record_unsent(self, tx_hash: str):
+        """Records that a transaction recorded ahead of its broadcast has not been sent after all."""
+        assert isinstance(tx_hash, str)
+
+        self._append({'event': 'unsent', 'time': time.time(), 'txHash': tx_hash})
+
+    def record_finished(self, tx_hashes: List[str]):
+        """Records the completion (whether successful or not) of the transaction sent as `tx_hashes`."""
+        assert isinstance(tx_hashes, list)
+
+        self._append({'event': 'finished', 'time': time.time(), 'txHashes': tx_hashes})
+
+    def pending(self) -> List[dict]:
+        """Returns the last `sent` record of every nonce not marked as finished, ordered by sender and nonce."""
+        with self._lock:
+            self._load()
+            return [self._sent[key][-1] for key in sorted(self._sent.keys())]
+
+    def recover(self, web3: Web3) -> List[RecoveredTransact]:
+        """Rebuilds transactions which were still pending according to the journal, without scanning the mempool.
+
+        Transactions with nonces already used on chain are left out, and the journal gets compacted
+        so it only keeps the ones returned.
+
+        Returns:
+            A list of :py:class:`pymaker.RecoveredTransact` objects, which may be either resubmitted with
+            `transact_async` (i.e. with a more generous gas strategy) or cancelled.
+        """
+        assert isinstance(web3, Web3)
+
+        records = self.pending()
+        tx_counts = {account: web3.eth.getTransactionCount(account, block_identifier='latest')
+                     for account in set(record['from'] for record in records)}
+        records = [record for record in records if record['nonce'] >= tx_counts[record['from']]]
+        self.compact(records)
+
+        recovered = [self._recovered_transact(web3, record) for record in records]
+        logger.info(f"Recovered {len(recovered)} pending transactions from {self.path}")
+        return recovered
+
+    def compact(self, records: List[dict]):
+        """Atomically replaces the journal with `records`."""
+        assert isinstance(records, list)
+
+        with self._lock:
+            self._write(records)
+
+    @staticmethod
+    def _recovered_transact(web3: Web3, record: dict) -> RecoveredTransact:
+        transaction = record['transaction']
+        if 'maxFeePerGas' in transaction:
+            current_fees = GasFees(transaction['maxFeePerGas'], transaction['maxPriorityFeePerGas'])
+            current_gas = transaction['maxFeePerGas']
+        else:
+            current_fees = None
+            current_gas = transaction.get('gasPrice') or 0
+
+        return RecoveredTransact(web3=web3, address=Address(record['from']), nonce=record['nonce'],
+                                 latest_tx_hash=record['txHash'], current_gas=current_gas, current_fees=current_fees,
+                                 transaction={key: transaction[key] for key in ('to', 'data', 'value', 'gas')
+                                              if key in transaction})
+
+    def _append(self, record: dict):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._load()
+            with open(self.path, 'a') as file:
+                file.write(line)
+                file.flush()
+                if self.fsync:
+                    os.fsync(file.fileno())
+            self._lines += 1
+            self._apply(record)
+
+            if self._lines - sum(len(records) for records in self._sent.values()) >= self.compact_every:
+                self._write([record for key in sorted(self._sent.keys()) for record in self._sent[key]])
+
+    def _write(self, records: List[dict]):
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w') as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.path)
+
+        self._reset()
+        for record in records:
+            self._apply(record)
+        self._lines = len(records)
+
+    def _load(self):
+        if self._sent is not None:
+            return
+
+        self._reset()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            for line in file:
+                self._lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping a corrupted line of {self.path}")
+                    continue
+                self._apply(record)
+
+    def _reset(self):
+        self._sent = {}
+        self._nonces_by_hash = {}
+        self._lines = 0
+
+    def _apply(self, record: dict):
+        if record['event'] == 'sent':
+            key = (record['from'], record['nonce'])
+            self._sent.setdefault(key, []).append(record)
+            self._nonces_by_hash[record['txHash']] = key
+        elif record['event'] == 'unsent':
+            key = self._nonces_by_hash.pop(record['txHash'], None)
+            if key in self._sent:
+                self._sent[key] = [sent for sent in self._sent[key] if sent['txHash'] != record['txHash']]
+                if len(self._sent[key]) == 0:
+                    del self._sent[key]
+        elif record['event'] == 'finished':
+            for key in set(self._nonces_by_hash.get(tx_hash) for tx_hash in record['txHashes']):
+                for sent in self._sent.pop(key, []):
+                    self._nonces_by_hash.pop(sent['txHash'], None)
+
+    def __repr__(self):
+        return f"TransactionJournal('{self.path}')"
@@ -16,9 +16,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import getpass
-from typing import Optional
+from typing import List, Optional
 
 from eth_account import Account
+from eth_account.signers.local import LocalAccount
 from web3 import Web3
 from web3.middleware import construct_sign_and_send_raw_middleware
 
@@ -80,6 +81,19 @@ def get_private_key(web3: Web3, key: str):
         private_key = Account.decrypt(read_key, read_pass).hex()
         return private_key
 
+def registered_account(web3: Web3, address: Address) -> Optional[LocalAccount]:
+    """Returns the account registered for `address` on `web3`, so transactions can be signed locally."""
+    assert(isinstance(web3, Web3))
+    assert(isinstance(address, Address))
+
+    return _registered_accounts.get((web3, address))
+
+def registered_addresses(web3: Web3) -> List[Address]:
+    """Returns addresses of all accounts registered on `web3`, in the order they have been registered."""
+    assert(isinstance(web3, Web3))
+
+    return [address for (registered_web3, address) in _registered_accounts.keys() if registered_web3 is web3]
+
 def register_private_key(web3: Web3, private_key):
     assert(isinstance(web3, Web3))
 
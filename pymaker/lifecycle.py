@@ -15,11 +15,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
+import inspect
 import logging
 import signal
 import threading
 import time
+from typing import Optional
 
 import pytz
 from pymaker.sign import eth_sign
@@ -27,7 +30,10 @@ from web3 import Web3
 from web3.exceptions import BlockNotFound, BlockNumberOutofRange
 
 from pymaker import register_filter_thread, any_filter_thread_present, stop_all_filter_threads, all_filter_threads_alive
-from pymaker.util import AsyncCallback
+from pymaker.blocks import BlockContext, BlockStream, LogTailer, WebsocketBlockSource
+from pymaker.metrics import InMemoryMetrics, MetricsSink, PrometheusExporter
+from pymaker.rpc import AsyncHTTPProvider, rpc_instrumentation
+from pymaker.scheduler import Scheduler, PRIORITY_BLOCK, PRIORITY_EVENT, PRIORITY_TIMER
 
 
 def trigger_event(event: threading.Event):
@@ -53,7 +59,9 @@ class Lifecycle:
     Other quirk is the new block filter callback taking more time to execute that
     the time between subsequent blocks. If you do not handle it explicitly,
     the event queue will pile up and the keeper won't work as expected.
-    `Lifecycle` used :py:class:`pymaker.util.AsyncCallback` to handle it properly.
+    `Lifecycle` runs all callbacks through a :py:class:`pymaker.scheduler.Scheduler` to handle it properly:
+    a callback is never invoked again while its previous invocation is still running, and all of them
+    share a fixed pool of worker threads, block callbacks taking precedence over timers.
 
     It also handles:
     - waiting for the node to have at least one peer and sync before starting the keeper,
@@ -74,18 +82,32 @@ class Lifecycle:
 
     Attributes:
         web3: Instance of the `Web3` class from `web3.py`. Optional.
+        scheduler: The :py:class:`pymaker.scheduler.Scheduler` executing all callbacks.
+        metrics: The :py:class:`pymaker.metrics.MetricsSink` receiving block processing metrics:
+            `pymaker_block_latency_seconds` (block arrival to `on_block` start),
+            `pymaker_block_callback_duration_seconds`, `pymaker_blocks_processed_total`,
+            `pymaker_blocks_skipped_total` (labelled by `reason`), `pymaker_head_block_number`
+            and `pymaker_head_lag_seconds` (block arrival time minus block timestamp).
     """
     logger = logging.getLogger()
 
-    def __init__(self, web3: Web3 = None):
+    def __init__(self, web3: Web3 = None, max_workers: int = 8, metrics: MetricsSink = None):
+        assert(isinstance(metrics, MetricsSink) or metrics is None)
+
         self.web3 = web3
+        self.scheduler = Scheduler(max_workers)
+        self.metrics = metrics if metrics is not None else InMemoryMetrics()
+        self.metrics_exporter = None
 
         self.do_wait_for_sync = True
+        self.sync_check_interval = 30
         self.delay = 0
         self.wait_for_functions = []
         self.startup_function = None
         self.shutdown_function = None
         self.block_function = None
+        self.block_stream = None
+        self.block_source = None
         self.every_timers = []
         self.event_timers = []
 
@@ -94,7 +116,11 @@ class Lifecycle:
         self.fatal_termination = False
         self._at_least_one_every = False
         self._last_block_time = None
+        self._last_block_number = None
         self._on_block_callback = None
+        self._on_block_with_context = False
+        self._syncing = None
+        self._syncing_checked_at = None
 
     def __enter__(self):
         return self
@@ -151,6 +177,9 @@ class Lifecycle:
 
         # Bind `on_block`, bind `every`
         # Enter the main loop
+        self.scheduler.start()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.start()
         self._start_watching_blocks()
         self._start_every_timers()
         self._main_loop()
@@ -163,6 +192,9 @@ class Lifecycle:
             self.logger.info("Waiting for all threads to terminate...")
             stop_all_filter_threads()
 
+        # Stop firing timers, callbacks already queued will still be executed
+        self.scheduler.stop()
+
         # If the `on_block` callback is still running, wait for it to terminate
         if self._on_block_callback is not None:
             self.logger.info("Waiting for outstanding callback to terminate...")
@@ -180,11 +212,19 @@ class Lifecycle:
             for timer in self.event_timers:
                 timer[2].wait()
 
+        for metrics in self.scheduler.metrics():
+            self.logger.debug(f"Callback metrics: {metrics}")
+
+        if self.web3 and rpc_instrumentation(self.web3) is not None:
+            rpc_instrumentation(self.web3).log_summary()
+
         # Shutdown phase
         if self.shutdown_function:
             self.logger.info("Executing keeper shutdown logic...")
             self.shutdown_function()
             self.logger.info("Shutdown logic finished")
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
         self.logger.info("Keeper terminated")
         exit(10 if self.fatal_termination else 0)
 
@@ -281,6 +321,10 @@ class Lifecycle:
     def on_block(self, callback):
         """Register the specified callback to be run for each new block received by the node.
 
+        If the callback accepts an argument, it gets called with a :py:class:`pymaker.blocks.BlockContext`
+        of the block being processed, so the keeper does not need to fetch it again and can pin
+        all its reads to that block.
+
         Args:
             callback: Function to be called for each new blocks.
         """
@@ -290,6 +334,60 @@ class Lifecycle:
         assert(self.block_function is None)
         self.block_function = callback
 
+    def on_reorg(self, callback, depth: int = 64, tailer: Optional[LogTailer] = None):
+        """Register the specified callback to be run when a chain reorganization is detected.
+
+        The callback is called as `callback(depth, orphaned_blocks)`, where `orphaned_blocks` is a list
+        of :py:class:`pymaker.blocks.StreamedBlock` removed from the canonical chain, newest first.
+        With a `tailer`, each of them carries the logs which have been removed along with it, otherwise
+        their `logs` are empty. It is executed on the block watching thread before `on_block` callback
+        is triggered for the new head, so it should be quick.
+
+        Args:
+            callback: Function to be called for each chain reorganization.
+            depth: Number of most recent blocks tracked for reorganizations.
+            tailer: Optional :py:class:`pymaker.blocks.LogTailer` retrieving the logs of each block.
+        """
+        assert(callable(callback))
+        assert(isinstance(tailer, LogTailer) or tailer is None)
+
+        assert(self.web3 is not None)
+        assert(self.block_stream is None)
+        self.block_stream = BlockStream(self.web3, depth, tailer)
+        self.block_stream.on_reorg(callback)
+
+    def watch_blocks_via_websocket(self, endpoint_uri: str) -> WebsocketBlockSource:
+        """Receive new blocks through a websocket `newHeads` subscription instead of polling a block filter.
+
+        Headers pushed by the node are used directly, which saves the `eth_getBlock` round trip and the
+        one second polling delay for each block. Log subscriptions can be added to the returned source
+        with :py:meth:`pymaker.blocks.WebsocketBlockSource.subscribe_logs`.
+
+        Args:
+            endpoint_uri: Websocket endpoint of the node, i.e. `ws://localhost:8546`.
+
+        Returns:
+            The :py:class:`pymaker.blocks.WebsocketBlockSource` used to receive new blocks.
+        """
+        assert(isinstance(endpoint_uri, str))
+
+        assert(self.web3 is not None)
+        assert(self.block_source is None)
+        self.block_source = WebsocketBlockSource(self.web3, endpoint_uri)
+        return self.block_source
+
+    def serve_metrics(self, port: int, host: str = "0.0.0.0"):
+        """Serve the metrics over HTTP in the Prometheus text exposition format while the keeper is running.
+
+        Args:
+            port: Port to listen on.
+            host: Interface to listen on.
+        """
+        assert(isinstance(self.metrics, InMemoryMetrics))
+        assert(self.metrics_exporter is None)
+
+        self.metrics_exporter = PrometheusExporter(self.metrics, port, host)
+
     def on_event(self, event: threading.Event, min_frequency_in_seconds: int, callback):
         """
         Register the specified callback to be called every time event is triggered,
@@ -304,16 +402,28 @@ class Lifecycle:
         assert(isinstance(min_frequency_in_seconds, int))
         assert(callable(callback))
 
-        self.event_timers.append((event, min_frequency_in_seconds, AsyncCallback(callback)))
+        self.event_timers.append((event, min_frequency_in_seconds,
+                                  self.scheduler.callback(callback, PRIORITY_EVENT, f"event #{len(self.event_timers) + 1}")))
 
-    def every(self, frequency_in_seconds: int, callback):
+    def every(self, frequency_in_seconds: int, callback, priority: int = PRIORITY_TIMER):
         """Register the specified callback to be called by a timer.
 
         Args:
             frequency_in_seconds: Execution frequency (in seconds).
             callback: Function to be called by the timer.
+            priority: When more callbacks are waiting for a worker, those with lower priority values
+                get executed first. Block callbacks run with priority `0`, timers with `10` by default.
         """
-        self.every_timers.append((frequency_in_seconds, AsyncCallback(callback)))
+        assert(isinstance(priority, int))
+
+        def timer_callback():
+            if not self.terminated_internally and not self.terminated_externally and not self.fatal_termination:
+                callback()
+            else:
+                self.logger.debug(f"Ignoring timer {timer.name} as keeper is already terminating")
+
+        timer = self.scheduler.callback(timer_callback, priority, f"timer #{len(self.every_timers) + 1}")
+        self.every_timers.append((frequency_in_seconds, timer))
 
     def _sigint_sigterm_handler(self, sig, frame):
         if self.terminated_externally:
@@ -322,53 +432,109 @@ class Lifecycle:
             self.logger.warning("Keeper received SIGINT/SIGTERM signal, will terminate gracefully")
             self.terminated_externally = True
 
-    def _start_watching_blocks(self):
-        def new_block_callback(block_hash):
-            self._last_block_time = datetime.datetime.now(tz=pytz.UTC)
-            block = self.web3.eth.getBlock(block_hash)
-            block_number = block['number']
-            if not self.web3.eth.syncing:
-                max_block_number = self.web3.eth.blockNumber
-                if block_number >= max_block_number:
-                    def on_start():
-                        self.logger.debug(f"Processing block #{block_number} ({block_hash.hex()})")
+    def _node_syncing(self) -> bool:
+        # Sync state changes rarely, so there is no need to query it for every single block
+        now = time.time()
+        if self._syncing_checked_at is None or now - self._syncing_checked_at >= self.sync_check_interval:
+            self._syncing = bool(self.web3.eth.syncing)
+            self._syncing_checked_at = now
 
-                    def on_finish():
-                        self.logger.debug(f"Finished processing block #{block_number} ({block_hash.hex()})")
+        return self._syncing
 
-                    if not self.terminated_internally and not self.terminated_externally and not self.fatal_termination:
-                        if not self._on_block_callback.trigger(on_start, on_finish):
-                            self.logger.debug(f"Ignoring block #{block_number} ({block_hash.hex()}),"
-                                              f" as previous callback is still running")
-                    else:
-                        self.logger.debug(f"Ignoring block #{block_number} as keeper is already terminating")
+    @staticmethod
+    def _accepts_argument(callback) -> bool:
+        try:
+            parameters = inspect.signature(callback).parameters.values()
+        except (TypeError, ValueError):
+            return False
+
+        return any(parameter.kind == parameter.VAR_POSITIONAL
+                   or (parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)
+                       and parameter.default is parameter.empty)
+                   for parameter in parameters)
+
+    def _on_new_block(self, block_hash, block=None):
+        arrival_time = time.time()
+        self._last_block_time = datetime.datetime.now(tz=pytz.UTC)
+        if block is None:
+            block = self.web3.eth.getBlock(block_hash)
+        context = BlockContext.from_block(block)
+        block_number = context.number
+        if not self._node_syncing():
+            if self._last_block_number is None or block_number >= self._last_block_number:
+                if self._last_block_number is not None and block_number > self._last_block_number + 1:
+                    self.metrics.increment("pymaker_blocks_skipped_total", block_number - self._last_block_number - 1,
+                                           {'reason': 'missed'})
+                self._last_block_number = block_number
+                self.metrics.gauge("pymaker_head_block_number", block_number)
+                self.metrics.gauge("pymaker_head_lag_seconds", arrival_time - context.timestamp)
+                if self.block_stream is not None:
+                    self.block_stream.process(context)
+
+                if self._on_block_callback is None:
+                    return
+
+                start_time = None
+
+                def on_start():
+                    nonlocal start_time
+                    start_time = time.time()
+                    self.metrics.observe("pymaker_block_latency_seconds", start_time - arrival_time)
+                    self.logger.debug(f"Processing block #{block_number} ({context.hash.hex()})")
+
+                def on_finish():
+                    self.metrics.observe("pymaker_block_callback_duration_seconds", time.time() - start_time)
+                    self.metrics.increment("pymaker_blocks_processed_total")
+                    self.logger.debug(f"Finished processing block #{block_number} ({context.hash.hex()})")
+
+                if not self.terminated_internally and not self.terminated_externally and not self.fatal_termination:
+                    args = (context,) if self._on_block_with_context else ()
+                    if not self._on_block_callback.trigger(on_start, on_finish, args):
+                        self.metrics.increment("pymaker_blocks_skipped_total", labels={'reason': 'busy'})
+                        self.logger.debug(f"Ignoring block #{block_number} ({context.hash.hex()}),"
+                                          f" as previous callback is still running")
                 else:
-                    self.logger.debug(f"Ignoring block #{block_number} ({block_hash.hex()}),"
-                                      f" as there is already block #{max_block_number} available")
+                    self.logger.debug(f"Ignoring block #{block_number} as keeper is already terminating")
             else:
-                self.logger.info(f"Ignoring block #{block_number} ({block_hash.hex()}), as the node is syncing")
+                self.metrics.increment("pymaker_blocks_skipped_total", labels={'reason': 'stale'})
+                self.logger.debug(f"Ignoring block #{block_number} ({context.hash.hex()}),"
+                                  f" as there is already block #{self._last_block_number} available")
+        else:
+            self.metrics.increment("pymaker_blocks_skipped_total", labels={'reason': 'syncing'})
+            self.logger.info(f"Ignoring block #{block_number} ({context.hash.hex()}), as the node is syncing")
 
+    def _start_watching_blocks(self):
         def new_block_watch():
             event_filter = self.web3.eth.filter('latest')
             logging.debug(f"Created event filter: {event_filter}")
             while True:
                 try:
-                    for event in event_filter.get_new_entries():
-                        new_block_callback(event)
+                    # only the most recent block is of interest, older ones would be ignored anyway
+                    new_entries = event_filter.get_new_entries()
+                    if len(new_entries) > 0:
+                        self._on_new_block(new_entries[-1])
                 except (BlockNotFound, BlockNumberOutofRange, ValueError) as ex:
                     self.logger.warning(f"Node dropped event emitter; recreating latest block filter: {ex}")
                     event_filter = self.web3.eth.filter('latest')
                 finally:
                     time.sleep(1)
 
-        if self.block_function:
-            self._on_block_callback = AsyncCallback(self.block_function)
+        if self.block_function or self.block_stream:
+            if self.block_function:
+                self._on_block_callback = self.scheduler.callback(self.block_function, PRIORITY_BLOCK, "on_block")
+                self._on_block_with_context = self._accepts_argument(self.block_function)
 
-            block_filter = threading.Thread(target=new_block_watch, daemon=True)
-            block_filter.start()
-            register_filter_thread(block_filter)
+            if self.block_source is not None:
+                self.block_source.on_head(lambda header: self._on_new_block(header['hash'], header))
+                register_filter_thread(self.block_source.start())
+            else:
+                block_filter = threading.Thread(target=new_block_watch, daemon=True)
+                block_filter.start()
+                register_filter_thread(block_filter)
 
             self.logger.info("Watching for new blocks")
+        elif self.block_source is not None:
+            register_filter_thread(self.block_source.start())
 
     def _start_thread_safely(self, t: threading.Thread):
         delay = 10
@@ -395,31 +561,7 @@ class Lifecycle:
             self.logger.info(f"Started {len(self.event_timers)} event(s)")
 
     def _start_every_timer(self, idx: int, frequency_in_seconds: int, callback):
-        def setup_timer(delay):
-            timer = threading.Timer(delay, func)
-            timer.daemon = True
-
-            self._start_thread_safely(timer)
-
-        def func():
-            try:
-                if not self.terminated_internally and not self.terminated_externally and not self.fatal_termination:
-                    def on_start():
-                        self.logger.debug(f"Processing the timer #{idx}")
-
-                    def on_finish():
-                        self.logger.debug(f"Finished processing the timer #{idx}")
-
-                    if not callback.trigger(on_start, on_finish):
-                        self.logger.debug(f"Ignoring timer #{idx} as previous one is already running")
-                else:
-                    self.logger.debug(f"Ignoring timer #{idx} as keeper is already terminating")
-            except:
-                setup_timer(frequency_in_seconds)
-                raise
-            setup_timer(frequency_in_seconds)
-
-        setup_timer(1)
+        self.scheduler.every(frequency_in_seconds, callback, first_delay=1)
         self._at_least_one_every = True
 
     def _start_event_timer(self, idx: int, event: threading.Event, min_frequency_in_seconds: int, callback):
@@ -440,8 +582,13 @@ class Lifecycle:
                             self.logger.debug(f"Finished processing the event #{idx}" if event_happened
                                               else f"Finished processing the event #{idx} because of minimum frequency")
 
-                        assert callback.trigger(on_start, on_finish)
-                        callback.wait()
+                        if callback.trigger(on_start, on_finish):
+                            callback.wait()
+                        elif self.scheduler.stopping:
+                            self.logger.debug(f"Stopped processing the event #{idx} as keeper is terminating")
+                            return
+                        else:
+                            self.logger.debug(f"Ignoring event #{idx} as previous one is already running")
 
                     else:
                         self.logger.debug(f"Ignoring event #{idx} as keeper is terminating" if event_happened
@@ -500,3 +647,223 @@ class Lifecycle:
                     self.logger.fatal("No new blocks received for 300 seconds, the keeper will terminate")
                     self.fatal_termination = True
                     break
+
+
+class AsyncLifecycle:
+    """Keeper lifecycle controller running all keeper logic on a single asyncio event loop.
+
+    It is the asyncio counterpart of :py:class:`pymaker.lifecycle.Lifecycle`. Callbacks are coroutine
+    functions, all of them executed as tasks of one long-lived event loop instead of each one
+    getting its own thread, so keeper logic can simply `await tx.transact_async()` and await many
+    node requests concurrently through :py:class:`pymaker.rpc.AsyncHTTPProvider` (available
+    as the `rpc` attribute).
+
+    As with `Lifecycle`, a new invocation of a callback is skipped if the previous one is still
+    running, and on shutdown all outstanding callbacks are awaited before the shutdown callback.
+
+    The typical usage pattern is as follows:
+
+        lifecycle = AsyncLifecycle(self.web3)
+        lifecycle.on_startup(self.some_startup_function)
+        lifecycle.on_block(self.do_something)
+        lifecycle.every(15, self.do_something_else)
+        lifecycle.on_shutdown(self.some_shutdown_function)
+        lifecycle.run()
+
+    Attributes:
+        web3: Instance of the `Web3` class from `web3.py`. Optional.
+        rpc: Instance of :py:class:`pymaker.rpc.AsyncHTTPProvider`, or `None` if there is no `web3`.
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, web3: Web3 = None, block_poll_interval: float = 1.0, sync_check_interval: int = 30):
+        assert(isinstance(web3, Web3) or web3 is None)
+
+        self.web3 = web3
+        self.rpc = AsyncHTTPProvider(web3) if web3 is not None else None
+        self.block_poll_interval = block_poll_interval
+        self.sync_check_interval = sync_check_interval
+        self.startup_function = None
+        self.shutdown_function = None
+        self.block_function = None
+        self.every_functions = []
+        self._block_with_context = False
+
+        self.terminated_internally = False
+        self.terminated_externally = False
+        self.fatal_termination = False
+        self._tasks = {}
+        self._last_block_number = None
+        self._syncing = None
+        self._syncing_checked_at = None
+        self._stopped = None
+
+    def on_startup(self, callback):
+        assert(callable(callback))
+
+        assert(self.startup_function is None)
+        self.startup_function = callback
+
+    def on_shutdown(self, callback):
+        assert(callable(callback))
+
+        assert(self.shutdown_function is None)
+        self.shutdown_function = callback
+
+    def on_block(self, callback):
+        """Register the specified coroutine function to be run for each new block.
+
+        If it accepts an argument, it gets called with a :py:class:`pymaker.blocks.BlockContext`.
+
+        Args:
+            callback: Coroutine function to be called for each new block.
+        """
+        assert(asyncio.iscoroutinefunction(callback))
+
+        assert(self.web3 is not None)
+        assert(self.block_function is None)
+        self.block_function = callback
+        self._block_with_context = Lifecycle._accepts_argument(callback)
+
+    def every(self, frequency_in_seconds: int, callback):
+        """Register the specified coroutine function to be called by a timer.
+
+        Args:
+            frequency_in_seconds: Execution frequency (in seconds).
+            callback: Coroutine function to be called by the timer.
+        """
+        assert(isinstance(frequency_in_seconds, int))
+        assert(asyncio.iscoroutinefunction(callback))
+
+        self.every_functions.append((frequency_in_seconds, callback))
+
+    def terminate(self, message=None):
+        if message is not None:
+            self.logger.warning(message)
+
+        self.terminated_internally = True
+        if self._stopped is not None:
+            self._stopped.set()
+
+    def run(self):
+        """Runs the keeper until it gets terminated, then exits the process like `Lifecycle` does."""
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.run_async())
+        finally:
+            loop.close()
+            if self.rpc is not None:
+                self.rpc.close()
+
+        exit(10 if self.fatal_termination else 0)
+
+    async def run_async(self):
+        """Runs the keeper on the current event loop until it gets terminated."""
+        loop = asyncio.get_event_loop()
+        self._stopped = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._sigint_sigterm_handler)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        if self.web3:
+            self.logger.info(f"Keeper connected to {self.web3.provider}")
+            if 'TestRPC' not in await self.rpc.run(lambda: self.web3.clientVersion):
+                while await self.rpc.syncing():
+                    self.logger.info(f"Waiting for the node to sync...")
+                    await asyncio.sleep(1)
+
+        if self.startup_function:
+            self.logger.info("Executing keeper startup logic")
+            await self._maybe_await(self.startup_function())
+
+        watchers = [asyncio.ensure_future(self._every_loop(index, frequency, callback))
+                    for index, (frequency, callback) in enumerate(self.every_functions)]
+        if self.block_function:
+            watchers.append(asyncio.ensure_future(self._block_loop()))
+            self.logger.info("Watching for new blocks")
+
+        if self.terminated_internally:
+            self._stopped.set()
+        await self._stopped.wait()
+
+        self.logger.info("Shutting down the keeper")
+        for watcher in watchers:
+            watcher.cancel()
+        await asyncio.gather(*watchers, return_exceptions=True)
+
+        outstanding = [task for task in self._tasks.values() if not task.done()]
+        if len(outstanding) > 0:
+            self.logger.info("Waiting for outstanding callbacks to terminate...")
+            await asyncio.gather(*outstanding, return_exceptions=True)
+
+        if self.shutdown_function:
+            self.logger.info("Executing keeper shutdown logic...")
+            await self._maybe_await(self.shutdown_function())
+            self.logger.info("Shutdown logic finished")
+        self.logger.info("Keeper terminated")
+
+    def _sigint_sigterm_handler(self):
+        if self.terminated_externally:
+            self.logger.warning("Graceful keeper termination due to SIGINT/SIGTERM already in progress")
+        else:
+            self.logger.warning("Keeper received SIGINT/SIGTERM signal, will terminate gracefully")
+            self.terminated_externally = True
+            self._stopped.set()
+
+    @staticmethod
+    async def _maybe_await(result):
+        if asyncio.iscoroutine(result):
+            return await result
+        return result
+
+    def _trigger(self, key, coroutine_function, *args) -> bool:
+        task = self._tasks.get(key)
+        if task is not None and not task.done():
+            return False
+
+        async def execute():
+            try:
+                await coroutine_function(*args)
+            except Exception as e:
+                self.logger.exception(f"Callback {coroutine_function} failed ({e})")
+
+        self._tasks[key] = asyncio.ensure_future(execute())
+        return True
+
+    async def _node_syncing(self) -> bool:
+        now = time.time()
+        if self._syncing_checked_at is None or now - self._syncing_checked_at >= self.sync_check_interval:
+            self._syncing = await self.rpc.syncing()
+            self._syncing_checked_at = now
+
+        return self._syncing
+
+    async def _block_loop(self):
+        while True:
+            await self._poll_block()
+            await asyncio.sleep(self.block_poll_interval)
+
+    async def _poll_block(self):
+        try:
+            context = BlockContext.from_block(await self.rpc.get_block('latest'))
+            if self._last_block_number is None or context.number > self._last_block_number:
+                self._last_block_number = context.number
+                args = (context,) if self._block_with_context else ()
+                if await self._node_syncing():
+                    self.logger.info(f"Ignoring block #{context.number} ({context.hash.hex()}), as the node is syncing")
+                elif not self._trigger('block', self.block_function, *args):
+                    self.logger.debug(f"Ignoring block #{context.number} ({context.hash.hex()}),"
+                                      f" as previous callback is still running")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.warning(f"Failed to fetch the latest block ({e})")
+
+    async def _every_loop(self, index: int, frequency_in_seconds: int, callback):
+        while True:
+            if not self._trigger(('every', index), callback):
+                self.logger.debug(f"Ignoring timer callback {callback}, as previous one is still running")
+
+            await asyncio.sleep(frequency_in_seconds)
@@ -0,0 +1,241 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger()
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsSink:
+    """Receives metrics recorded by pymaker components.
+
+    The base class discards everything. Subclass it to forward metrics to a monitoring system,
+    or use :py:class:`pymaker.metrics.InMemoryMetrics` which keeps them in the process.
+    """
+
+    def increment(self, name: str, value: float = 1, labels: Optional[dict] = None):
+        """Increments a counter."""
+        pass
+
+    def gauge(self, name: str, value: float, labels: Optional[dict] = None):
+        """Sets a gauge to the specified value."""
+        pass
+
+    def observe(self, name: str, value: float, labels: Optional[dict] = None):
+        """Records an observation in a histogram."""
+        pass
+
+
+class Histogram:
+    """Cumulative histogram of observed values.
+
+    Attributes:
+        buckets: Upper bounds of the buckets, in ascending order.
+        counts: Number of observations falling in each bucket, the last one counting values above all bounds.
+        count: Total number of observations.
+        sum: Sum of all observed values.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        assert isinstance(buckets, tuple)
+        assert list(buckets) == sorted(buckets)
+
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimates the quantile `q` (between 0 and 1) as the upper bound of the bucket it falls in."""
+        assert 0 <= q <= 1
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count > 0:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def __repr__(self):
+        return f"Histogram(count={self.count}, sum={self.sum})"
+
+
+class InMemoryMetrics(MetricsSink):
+    """Keeps counters, gauges and histograms in memory, so they can be queried or exported.
+
+    Series are identified by name and labels, i.e. `metrics.counter("pymaker_blocks_skipped_total",
+    {'reason': 'busy'})`. Use :py:func:`pymaker.metrics.prometheus_text` to render all of them in
+    the Prometheus text exposition format.
+
+    Attributes:
+        buckets: Bucket upper bounds used for new histograms.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Optional[dict]) -> Tuple[str, tuple]:
+        return name, tuple(sorted((labels or {}).items()))
+
+    def increment(self, name: str, value: float = 1, labels: Optional[dict] = None):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, labels: Optional[dict] = None):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, labels: Optional[dict] = None):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+
+    def counter(self, name: str, labels: Optional[dict] = None) -> float:
+        return self.counters.get(self._key(name, labels), 0)
+
+    def gauge_value(self, name: str, labels: Optional[dict] = None) -> Optional[float]:
+        return self.gauges.get(self._key(name, labels))
+
+    def histogram(self, name: str, labels: Optional[dict] = None) -> Optional[Histogram]:
+        return self.histograms.get(self._key(name, labels))
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Returns all series as plain dictionaries, histograms summarized by count, sum and quantiles."""
+        def series_name(key):
+            name, labels = key
+            return name + _format_labels(labels)
+
+        with self._lock:
+            return {'counters': {series_name(key): value for key, value in self.counters.items()},
+                    'gauges': {series_name(key): value for key, value in self.gauges.items()},
+                    'histograms': {series_name(key): {'count': histogram.count,
+                                                      'sum': histogram.sum,
+                                                      'p50': histogram.quantile(0.5),
+                                                      'p95': histogram.quantile(0.95),
+                                                      'p99': histogram.quantile(0.99)}
+                                   for key, histogram in self.histograms.items()}}
+
+
+def _format_labels(labels: tuple) -> str:
+    if len(labels) == 0:
+        return ""
+
+    def escape(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def prometheus_text(metrics: InMemoryMetrics) -> str:
+    """Renders all series of `metrics` in the Prometheus text exposition format."""
+    assert isinstance(metrics, InMemoryMetrics)
+
+    lines = []
+    with metrics._lock:
+        for kind, series in (('counter', metrics.counters), ('gauge', metrics.gauges)):
+            for name in sorted(set(key[0] for key in series)):
+                lines.append(f"# TYPE {name} {kind}")
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name in sorted(set(key[0] for key in metrics.histograms)):
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), histogram in sorted(metrics.histograms.items(), key=lambda item: item[0]):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    bucket_labels = labels + (('le', _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusExporter:
+    """Serves the metrics over HTTP, in the Prometheus text exposition format, from a daemon thread.
+
+    Attributes:
+        metrics: The :py:class:`pymaker.metrics.InMemoryMetrics` to be exported.
+        port: Port to listen on.
+        host: Interface to listen on.
+    """
+
+    def __init__(self, metrics: InMemoryMetrics, port: int, host: str = "0.0.0.0"):
+        assert isinstance(metrics, InMemoryMetrics)
+        assert isinstance(port, int)
+        assert isinstance(host, str)
+
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+        self.server = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = prometheus_text(metrics).encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on {self.host}:{self.server.server_address[1]}")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,193 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+from eth_utils import keccak
+
+from pymaker import Address, next_nonce, Transact, transaction_lock, TransactStatus
+from pymaker.batch import build_transaction, receipt_tracker
+from pymaker.keys import registered_account
+from pymaker.util import bytes_to_hexstring
+
+logger = logging.getLogger()
+
+
+def gas_price_ladder(base_gas_price: int, steps: int, increase_by: float = 1.125) -> List[int]:
+    """Returns `steps` gas prices starting at `base_gas_price`, each high enough to replace the previous one."""
+    assert isinstance(base_gas_price, int)
+    assert isinstance(steps, int)
+    assert steps > 0
+    assert increase_by >= 1.125
+
+    ladder = [base_gas_price]
+    for _ in range(steps - 1):
+        ladder.append(int(ladder[-1] * increase_by) + 1)
+    return ladder
+
+
+class PresignedTransact:
+    """A transaction encoded and signed ahead of time, for a number of gas prices, so it can be sent instantly.
+
+    Meant for time-critical transactions which can be anticipated, i.e. `Dog.bark`, `Cat.bite` or
+    `Clipper.take` for an urn which will become unsafe at the next OSM update. `prepare` does the
+    slow part (nonce lookup, ABI encoding, signing every gas price of the ladder) beforehand, so
+    `send` only has to broadcast one raw transaction.
+
+    All variants share the next nonce of the account. Sending any other transaction from the account
+    makes them stale: `send` detects it when the other transaction has been sent through pymaker,
+    and `refresh` (i.e. on every block) re-signs them when the nonce has moved for any other reason.
+    The nonce is not reserved until `send`, so other transactions from the account are not held up.
+
+    The key of the account has to be registered with :py:mod:`pymaker.keys`. As the transaction usually
+    fails until the anticipated event happens, the gas limit has to be given rather than estimated.
+
+    Attributes:
+        transact: The transaction to be sent.
+        gas: Gas limit.
+        gas_prices: Gas prices of the variants, ascending.
+        nonce: Nonce of the signed variants, `None` until prepared.
+        raw_transactions: Signed variants, one per gas price.
+    """
+
+    def __init__(self, transact: Transact, gas: int, gas_prices: List[int], from_address: Optional[Address] = None):
+        assert isinstance(transact, Transact)
+        assert isinstance(gas, int)
+        assert isinstance(gas_prices, list)
+        assert len(gas_prices) > 0
+        assert gas_prices == sorted(gas_prices)
+        assert isinstance(from_address, Address) or from_address is None
+
+        self.transact = transact
+        self.web3 = transact.web3
+        self.gas = gas
+        self.gas_prices = gas_prices
+        self.from_address = from_address if from_address is not None else Address(self.web3.eth.defaultAccount)
+        self.account = registered_account(self.web3, self.from_address)
+        if self.account is None:
+            raise ValueError(f"No key registered for {self.from_address}, transactions can not be pre-signed")
+
+        self.nonce = None
+        self.raw_transactions = []
+        self.sent_variants = 0
+        self.future = None
+        self._chain_id = None
+
+    def prepare(self, nonce: Optional[int] = None):
+        """Signs all gas price variants with the next nonce of the account, or with `nonce` if given."""
+        assert isinstance(nonce, int) or nonce is None
+
+        if self._chain_id is None:
+            self._chain_id = self.web3.eth.chainId
+        if nonce is None:
+            nonce = self._pending_nonce()
+
+        transaction = build_transaction(self.transact, self.from_address.address, self.gas, None, nonce)
+        del transaction['from']
+        self.raw_transactions = [bytes_to_hexstring(self.account.sign_transaction({**transaction,
+                                                                                   'gasPrice': gas_price,
+                                                                                   'chainId': self._chain_id})
+                                                    .rawTransaction)
+                                 for gas_price in self.gas_prices]
+        self.nonce = nonce
+        logger.debug(f"Pre-signed {len(self.raw_transactions)} variants of {self.transact.name()} with nonce={nonce}")
+
+    def refresh(self) -> bool:
+        """Re-signs the variants if the nonce of the account has moved since they were prepared.
+
+        Returns:
+            `True` if the variants had to be re-signed.
+        """
+        if self.future is not None:
+            return False
+
+        nonce = self._pending_nonce()
+        if nonce != self.nonce:
+            logger.info(f"Nonce of {self.from_address} moved from {self.nonce} to {nonce},"
+                        f" re-signing {self.transact.name()}")
+            self.prepare(nonce)
+            return True
+        return False
+
+    def is_stale(self) -> bool:
+        """Tells whether another transaction sent through pymaker has already used the nonce of the variants."""
+        return self.nonce is None or next_nonce.get(self.from_address.address, 0) > self.nonce
+
+    def send(self, min_gas_price: int = 0) -> Future:
+        """Broadcasts the cheapest variant priced at least `min_gas_price`, or the most expensive one.
+
+        Returns:
+            A `concurrent.futures.Future` resolving to either a :py:class:`pymaker.Receipt` or `None`,
+            like the ones of :py:func:`pymaker.batch.submit_many`.
+        """
+        assert self.future is None
+
+        with transaction_lock:
+            if self.is_stale():
+                raise ValueError(f"Pre-signed {self.transact.name()} is stale, nonce {self.nonce} has been used")
+
+            variant = next((index for index, gas_price in enumerate(self.gas_prices) if gas_price >= min_gas_price),
+                           len(self.gas_prices) - 1)
+            tx_hash = self._send_variant(variant)
+            next_nonce[self.from_address.address] = max(next_nonce.get(self.from_address.address, 0), self.nonce + 1)
+
+        self.transact.status = TransactStatus.IN_PROGRESS
+        self.transact.initial_time = time.time()
+        self.future = Future()
+        receipt_tracker(self.web3).track(self.transact, self.from_address.address, self.future)
+        return self.future
+
+    def bump(self) -> bool:
+        """Broadcasts the next, more expensive variant, replacing the one sent before.
+
+        Returns:
+            `False` if the most expensive variant has already been sent.
+        """
+        assert self.future is not None
+
+        if self.sent_variants >= len(self.gas_prices) or self.future.done():
+            return False
+
+        self._send_variant(self.sent_variants)
+        return True
+
+    def _send_variant(self, variant: int) -> str:
+        # recorded ahead of the broadcast, so a crash in between does not lose the transaction
+        tx_hash = bytes_to_hexstring(keccak(hexstr=self.raw_transactions[variant]))
+        self.transact.nonce = self.nonce
+        self.transact._record_sent(self.from_address.address, self.gas, self.gas_prices[variant], tx_hash)
+        try:
+            self.web3.eth.sendRawTransaction(self.raw_transactions[variant])
+        except Exception:
+            self.transact._record_unsent(tx_hash)
+            raise
+        self.transact.tx_hashes.append(tx_hash)
+        self.transact.gas_price_last = self.gas_prices[variant]
+        self.sent_variants = variant + 1
+        logger.info(f"Sent pre-signed transaction {self.transact.name()} with nonce={self.nonce}, gas={self.gas},"
+                    f" gas_price={self.gas_prices[variant]} (tx_hash={tx_hash})")
+        return tx_hash
+
+    def _pending_nonce(self) -> int:
+        tx_count = self.web3.eth.getTransactionCount(self.from_address.address, block_identifier='pending')
+        return max(tx_count, next_nonce.get(self.from_address.address, 0))
+
+    def __repr__(self):
+        return f"PresignedTransact({self.transact.name()}, nonce={self.nonce}, gas_prices={self.gas_prices})"
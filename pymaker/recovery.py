@@ -0,0 +1,251 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import time
+from typing import List, Optional
+
+from web3 import Web3
+from web3._utils.method_formatters import receipt_formatter
+
+from pymaker import _pending_transaction, Address, Receipt, RecoveredTransact, TransactStatus
+from pymaker.batch import _to_json, ReceiptTracker
+from pymaker.gas import GasFees, GasPrice
+from pymaker.keys import registered_account
+from pymaker.rpc import batch_request
+from pymaker.util import bytes_to_hexstring
+
+logger = logging.getLogger()
+
+
+class RecoveryManager:
+    """Clears many stuck nonces at once, by either cancelling or resubmitting all of them together.
+
+    Unlike :py:meth:`pymaker.RecoveredTransact.cancel`, which handles one transaction at a time, all
+    replacements get sent in one JSON-RPC batch, and a single loop checks all of them once per new
+    block, again in one batch. Gas gets escalated for all of them according to one gas strategy, using
+    the same replacement rules as :py:class:`pymaker.Transact`: a legacy gas price has to go up by
+    12.5%, EIP-1559 fees get raised so that both go up by at least 10%.
+
+    Replacements are signed locally if the key of the sender is registered with :py:mod:`pymaker.keys`,
+    otherwise they are sent with `eth_sendTransaction`.
+
+    Attributes:
+        web3: An instance of `Web3` from `web3.py`.
+        gas_price: Gas strategy used for replacements.
+        poll_interval: Time (in seconds) between checks for a new block.
+        max_misses: Number of blocks a nonce may be used without a receipt for any of our transactions,
+            before the transaction is considered overridden.
+    """
+
+    def __init__(self, web3: Web3, gas_price: GasPrice, poll_interval: float = 1.0, max_misses: int = 10):
+        assert isinstance(web3, Web3)
+        assert isinstance(gas_price, GasPrice)
+        assert isinstance(max_misses, int)
+
+        self.web3 = web3
+        self.gas_price = gas_price
+        self.poll_interval = poll_interval
+        self.max_misses = max_misses
+        self._chain_id = None
+
+    def cancel_all(self, recovered: List[RecoveredTransact]) -> List[Optional[Receipt]]:
+        """Replaces all `recovered` transactions with zero-value transfers to their senders.
+
+        Returns:
+            For each of `recovered`, in the same order, the receipt of whichever transaction got mined
+            with its nonce (the cancellation or the original one), or `None` if it could not be found.
+        """
+        return self._recover(recovered, cancel=True)
+
+    def resubmit_all(self, recovered: List[RecoveredTransact]) -> List[Optional[Receipt]]:
+        """Rebroadcasts all `recovered` transactions with escalating gas, keeping their nonces and payloads.
+
+        Payloads not known yet are fetched with `eth_getTransactionByHash`, in one batch. Transactions
+        whose payload can not be fetched, usually because they have been dropped from the mempool, get
+        cancelled instead, as their nonces would otherwise stay stuck.
+
+        Returns:
+            For each of `recovered`, in the same order, a :py:class:`pymaker.Receipt` if the transaction
+            was successful, `None` otherwise, including if it got cancelled.
+        """
+        self._fetch_payloads([transact for transact in recovered if transact.transaction is None])
+        return self._recover(recovered, cancel=False)
+
+    def _fetch_payloads(self, recovered: List[RecoveredTransact]):
+        if len(recovered) == 0:
+            return
+
+        results = batch_request(self.web3, [("eth_getTransactionByHash", [transact.tx_hashes[-1]])
+                                            for transact in recovered], raise_on_error=False)
+        for transact, result in zip(recovered, results):
+            if isinstance(result, dict):
+                transact.transaction = _pending_transaction(result)
+            else:
+                logger.warning(f"Could not fetch the payload of {transact.name()} ({result}),"
+                               f" it will be cancelled instead")
+
+    def _recover(self, recovered: List[RecoveredTransact], cancel: bool) -> List[Optional[Receipt]]:
+        assert isinstance(recovered, list)
+        assert all(isinstance(transact, RecoveredTransact) for transact in recovered)
+
+        initial_time = time.time()
+        results = [None] * len(recovered)
+        pending = []
+        for index, transact in enumerate(recovered):
+            if transact.status != TransactStatus.NEW:
+                raise Exception("Each `Transact` can only be executed once")
+            transact.status = TransactStatus.IN_PROGRESS
+            transact.initial_time = initial_time
+            pending.append({'index': index, 'transact': transact, 'misses': 0, 'cancellations': [],
+                            'cancel': cancel or transact.transaction is None})
+
+        block_number = None
+        while True:
+            self._send_replacements(pending, int(time.time() - initial_time))
+
+            while True:
+                current_block_number = int(batch_request(self.web3, [("eth_blockNumber", [])])[0], 16)
+                if current_block_number != block_number:
+                    block_number = current_block_number
+                    break
+                time.sleep(self.poll_interval)
+
+            for entry, result in self._confirm(pending, cancel):
+                results[entry['index']] = result
+                pending.remove(entry)
+                entry['transact'].status = TransactStatus.FINISHED
+                entry['transact']._record_finished()
+
+            if len(pending) == 0:
+                logger.info(f"Recovered {len(recovered)} transactions")
+                return results
+
+    def _send_replacements(self, pending: List[dict], seconds_elapsed: int):
+        gas_fees = self.gas_price.get_gas_fees(seconds_elapsed)
+        gas_price_value = self.gas_price.get_gas_price(seconds_elapsed) if gas_fees is None else None
+
+        to_send = []
+        for entry in pending:
+            transact = entry['transact']
+            if gas_fees is not None:
+                previous_fees = transact._previous_gas_fees()
+                if previous_fees is None:
+                    price = gas_fees
+                elif gas_fees.exceeds(previous_fees) or len(transact.tx_hashes) == 1:
+                    # the first replacement gets sent straight away, raised enough to replace the pending tx
+                    price = gas_fees.bumped_from(previous_fees)
+                else:
+                    continue
+                transact.gas_price_last = price.max_fee
+                transact.gas_fees_last = price
+            elif gas_price_value is not None and gas_price_value > transact.gas_price_last * 1.125:
+                price = gas_price_value
+                transact.gas_price_last = price
+                transact.gas_fees_last = None
+            else:
+                continue
+
+            from_account = transact.address.address
+            if entry['cancel']:
+                transaction = {'from': from_account, 'to': from_account, 'data': "0x", 'value': 0, 'gas': 21000,
+                               'nonce': transact.nonce}
+                transaction.update(price.transaction_params() if isinstance(price, GasFees) else {'gasPrice': price})
+            else:
+                transaction = transact._transaction(from_account, transact.transaction['gas'], price, transact.nonce)
+            to_send.append((entry, price, transaction))
+
+        if len(to_send) == 0:
+            return
+
+        calls = []
+        signed_hashes = []
+        for entry, _, transaction in to_send:
+            call, tx_hash = self._send_call(transaction)
+            if tx_hash is not None:
+                # recorded ahead of the broadcast, so a crash in between does not lose the replacement
+                entry['transact']._record_transaction(transaction['from'], tx_hash, transaction)
+            calls.append(call)
+            signed_hashes.append(tx_hash)
+
+        results = batch_request(self.web3, calls, raise_on_error=False)
+        for (entry, price, transaction), tx_hash, result in zip(to_send, signed_hashes, results):
+            transact = entry['transact']
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to {'cancel' if entry['cancel'] else 'resubmit'} {transact.name()}"
+                               f" with {price} ({result})")
+                if tx_hash is not None:
+                    transact._record_unsent(tx_hash)
+                continue
+
+            transact.tx_hashes.append(result)
+            if entry['cancel']:
+                entry['cancellations'].append(result)
+            if tx_hash is None:
+                transact._record_transaction(transaction['from'], result, transaction)
+            logger.info(f"{'Cancelling' if entry['cancel'] else 'Resubmitting'} {transact.name()} with"
+                        f" {'gas_fees' if isinstance(price, GasFees) else 'gas_price'}={price} (tx_hash={result})")
+
+    def _send_call(self, transaction: dict) -> tuple:
+        # returns the JSON-RPC call sending `transaction`, and its hash if it has been signed locally
+        account = registered_account(self.web3, Address(transaction['from']))
+        if account is None:
+            return ("eth_sendTransaction", [_to_json(transaction)]), None
+
+        if self._chain_id is None:
+            self._chain_id = self.web3.eth.chainId
+        signed = account.sign_transaction({**{key: value for key, value in transaction.items() if key != 'from'},
+                                           'chainId': self._chain_id})
+        return ("eth_sendRawTransaction", [bytes_to_hexstring(signed.rawTransaction)]), bytes_to_hexstring(signed.hash)
+
+    def _confirm(self, pending: List[dict], cancel: bool) -> list:
+        accounts = sorted(set(entry['transact'].address.address for entry in pending))
+        hashes = [(entry, tx_hash) for entry in pending for tx_hash in entry['transact'].tx_hashes]
+        calls = [("eth_getTransactionCount", [account, "latest"]) for account in accounts] + \
+                [("eth_getTransactionReceipt", [tx_hash]) for _, tx_hash in hashes]
+        results = batch_request(self.web3, calls, raise_on_error=False)
+
+        tx_counts = {account: int(result, 16) for account, result in zip(accounts, results)
+                     if not isinstance(result, Exception)}
+        receipts = {}
+        for (entry, tx_hash), result in zip(hashes, results[len(accounts):]):
+            if isinstance(result, dict) and result.get('blockNumber') is not None:
+                receipts[id(entry)] = (tx_hash, result)
+
+        finished = []
+        for entry in pending:
+            transact = entry['transact']
+            if id(entry) in receipts:
+                tx_hash, raw_receipt = receipts[id(entry)]
+                if cancel:
+                    logger.info(f"{transact.name()} was cancelled (tx_hash={tx_hash})")
+                    finished.append((entry, Receipt(receipt_formatter(raw_receipt))))
+                elif tx_hash in entry['cancellations']:
+                    logger.info(f"{transact.name()} was cancelled (tx_hash={tx_hash})")
+                    finished.append((entry, None))
+                else:
+                    finished.append((entry, ReceiptTracker._receipt(transact, tx_hash, raw_receipt)))
+            elif tx_counts.get(transact.address.address, 0) > transact.nonce:
+                entry['misses'] += 1
+                if entry['misses'] >= self.max_misses:
+                    logger.warning(f"{transact.name()} has been overridden by another transaction with the same nonce")
+                    finished.append((entry, None))
+        return finished
+
+    def __repr__(self):
+        return f"RecoveryManager(gas_price={self.gas_price})"
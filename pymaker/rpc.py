@@ -0,0 +1,873 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import as_completed, wait, FIRST_COMPLETED, ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+from typing import List, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+import requests
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3 import HTTPProvider, Web3
+from web3.datastructures import AttributeDict
+from web3._utils.request import make_post_request
+
+from pymaker import Address
+from pymaker.concurrency import concurrency_controller, is_throttled
+from pymaker.metrics import InMemoryMetrics, MetricsSink
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+logger = logging.getLogger()
+
+
+def batch_request(web3: Web3, calls: List[Tuple[str, list]], batch_size: int = 100, raise_on_error: bool = True) -> list:
+    """Sends a list of JSON-RPC requests to the node using as few HTTP round-trips as possible.
+
+    Requests are sent as JSON-RPC batches of up to `batch_size` elements. If the provider is not
+    an `HTTPProvider`, or the node refuses batches, requests are sent one by one instead.
+
+    Batches are sent in parallel, within the limit of :py:func:`pymaker.concurrency.concurrency_controller`.
+
+    Results are returned as received from the node i.e. without any of the web3.py result formatters
+    applied, so quantities and hashes are hexadecimal strings.
+
+    Args:
+        web3: An instance of `Web3` from `web3.py`.
+        calls: List of `(method, params)` tuples, `params` being JSON-serializable.
+        batch_size: Maximum number of requests sent in one HTTP request.
+        raise_on_error: If `False`, a request failing with a JSON-RPC error does not fail the whole call,
+            but gets a `ValueError` in place of its result.
+
+    Returns:
+        List of results, in the same order as `calls`.
+    """
+    assert isinstance(web3, Web3)
+    assert isinstance(calls, list)
+    assert isinstance(batch_size, int)
+    assert batch_size > 0
+
+    provider = web3.provider
+    unwrap = _unwrap_response if raise_on_error else _unwrap_response_or_error
+    if not isinstance(provider, HTTPProvider):
+        return [unwrap(provider.make_request(method, params)) for method, params in calls]
+
+    def send_batch(chunk: list) -> list:
+        payload = [{"jsonrpc": "2.0", "method": method, "params": params, "id": index}
+                   for index, (method, params) in enumerate(chunk)]
+        raw_response = make_post_request(provider.endpoint_uri, json.dumps(payload).encode('utf-8'),
+                                         **provider.get_request_kwargs())
+        responses = json.loads(raw_response)
+
+        if isinstance(responses, dict) and is_throttled(ValueError(responses.get('error'))):
+            raise ValueError(responses['error'])
+        if not isinstance(responses, list):
+            logger.debug(f"Node refused a batch of {len(chunk)} requests, sending them one by one")
+            return [unwrap(provider.make_request(method, params)) for method, params in chunk]
+
+        by_id = {response.get('id'): response for response in responses}
+        return [unwrap(by_id.get(index)) for index in range(len(chunk))]
+
+    chunks = [calls[start:start + batch_size] for start in range(0, len(calls), batch_size)]
+    return [result for results in concurrency_controller(web3).map(send_batch, chunks) for result in results]
+
+
+def _unwrap_response_or_error(response: Optional[dict]):
+    try:
+        return _unwrap_response(response)
+    except ValueError as e:
+        return e
+
+
+def _unwrap_response(response: Optional[dict]):
+    if response is None:
+        raise ValueError("No response received for a batched request")
+    if 'error' in response:
+        raise ValueError(response['error'])
+    return response['result']
+
+
+class SenderResolver:
+    """Resolves the sender of the transaction which emitted a log, caching the results.
+
+    Senders are kept in a LRU cache keyed by transaction hash. When resolving senders for many
+    logs at once (see `prefetch`), all lookups are sent in a single batch. Blocks containing more
+    than one of the requested transactions are fetched once, with full transaction objects,
+    rather than looking each transaction up individually.
+
+    Attributes:
+        web3: An instance of `Web3` from `web3.py`.
+        max_size: Maximum number of senders kept in the cache.
+    """
+
+    def __init__(self, web3: Web3, max_size: int = 10000):
+        assert isinstance(web3, Web3)
+        assert isinstance(max_size, int)
+        assert max_size > 0
+
+        self.web3 = web3
+        self.max_size = max_size
+        self._senders = OrderedDict()
+        self._lock = Lock()
+
+    def sender(self, tx_hash) -> Address:
+        """Returns the sender of the transaction, querying the node only on a cache miss.
+
+        Args:
+            tx_hash: Transaction hash, either as a hex string or bytes.
+        """
+        tx_hash = self._normalize(tx_hash)
+        cached = self._get(tx_hash)
+        if cached is not None:
+            return cached
+
+        transaction = self.web3.eth.getTransaction(tx_hash)
+        sender = Address(transaction['from'])
+        self._put(tx_hash, sender)
+        return sender
+
+    def prefetch(self, logs: list):
+        """Resolves senders for all transactions which emitted the specified logs in one batch.
+
+        Args:
+            logs: List of raw logs, as returned by `eth_getLogs`.
+        """
+        assert isinstance(logs, list)
+
+        by_block = {}
+        for log in logs:
+            tx_hash = self._normalize(log['transactionHash'])
+            if self._get(tx_hash) is None:
+                by_block.setdefault(log['blockNumber'], set()).add(tx_hash)
+
+        calls = []
+        for block_number, tx_hashes in by_block.items():
+            if len(tx_hashes) > 1:
+                calls.append(("eth_getBlockByNumber", [hex(block_number), True]))
+            else:
+                calls.append(("eth_getTransactionByHash", [next(iter(tx_hashes))]))
+
+        if len(calls) == 0:
+            return
+
+        logger.debug(f"Resolving senders of {sum(map(len, by_block.values()))} transactions"
+                     f" in {len(calls)} requests")
+        for (block_number, tx_hashes), result in zip(by_block.items(), batch_request(self.web3, calls)):
+            if result is None:
+                continue
+            transactions = result['transactions'] if 'transactions' in result else [result]
+            for transaction in transactions:
+                tx_hash = self._normalize(transaction['hash'])
+                if tx_hash in tx_hashes:
+                    self._put(tx_hash, Address(transaction['from']))
+
+    def _get(self, tx_hash: str) -> Optional[Address]:
+        with self._lock:
+            if tx_hash in self._senders:
+                self._senders.move_to_end(tx_hash)
+                return self._senders[tx_hash]
+            return None
+
+    def _put(self, tx_hash: str, sender: Address):
+        with self._lock:
+            self._senders[tx_hash] = sender
+            self._senders.move_to_end(tx_hash)
+            while len(self._senders) > self.max_size:
+                self._senders.popitem(last=False)
+
+    @staticmethod
+    def _normalize(tx_hash) -> str:
+        if isinstance(tx_hash, (bytes, bytearray)):
+            return HexBytes(tx_hash).hex().lower()
+        assert isinstance(tx_hash, str)
+        return tx_hash.lower()
+
+
+def loads(raw) -> object:
+    """Parses JSON using `orjson` if it is installed, which is several times faster than `json`."""
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+class FastHTTPProvider(HTTPProvider):
+    """`HTTPProvider` decoding responses with `orjson`, if installed.
+
+    Large responses, i.e. `eth_getLogs` over a busy block range, are dominated by JSON parsing; this
+    provider makes it cheaper. Requests are still encoded by web3.py, as they are small and may contain
+    types `orjson` does not know about.
+    """
+
+    def decode_rpc_response(self, raw_response: bytes) -> dict:
+        return loads(raw_response)
+
+    def __str__(self):
+        return f"Fast RPC connection {self.endpoint_uri}"
+
+
+def get_raw_logs(web3: Web3, filter_params: dict) -> list:
+    """Sends `eth_getLogs` straight to the provider, skipping the web3.py middlewares and result formatters.
+
+    The logs are returned as received from the node, with hexadecimal strings everywhere. Use
+    :py:func:`pymaker.rpc.format_raw_log` to turn them into what `web3.eth.getLogs` would return.
+    :py:class:`pymaker.rpc.RpcInstrumentation` still accounts for the request, if installed.
+
+    Args:
+        web3: An instance of `Web3` from `web3.py`.
+        filter_params: Filter parameters, block numbers being either integers or block tags.
+    """
+    assert isinstance(web3, Web3)
+    assert isinstance(filter_params, dict)
+
+    params = {key: hex(value) if key in ('fromBlock', 'toBlock') and isinstance(value, int) else value
+              for key, value in filter_params.items()}
+
+    make_request = web3.provider.make_request
+    instrumentation = rpc_instrumentation(web3)
+    if instrumentation is not None:
+        make_request = instrumentation.middleware(make_request, web3)
+
+    return _unwrap_response(make_request("eth_getLogs", [params]))
+
+
+@functools.lru_cache(maxsize=1024)
+def _checksum_address(address: str) -> str:
+    return to_checksum_address(address)
+
+
+def _int_or_none(value: Optional[str]) -> Optional[int]:
+    return int(value, 16) if value is not None else None
+
+
+def _bytes_or_none(value: Optional[str]) -> Optional[HexBytes]:
+    return HexBytes(value) if value is not None else None
+
+
+def format_raw_log(raw_log: dict) -> AttributeDict:
+    """Turns a log returned by :py:func:`pymaker.rpc.get_raw_logs` into what `web3.eth.getLogs` would return.
+
+    Fields are converted directly rather than through the generic web3.py formatters, and checksum
+    addresses are cached, as logs of one filter tend to come from a handful of contracts.
+    """
+    log = dict(raw_log)
+    log['address'] = _checksum_address(raw_log['address'])
+    log['topics'] = [HexBytes(topic) for topic in raw_log['topics']]
+    log['blockHash'] = _bytes_or_none(raw_log.get('blockHash'))
+    log['transactionHash'] = _bytes_or_none(raw_log.get('transactionHash'))
+    for field in ('blockNumber', 'logIndex', 'transactionIndex'):
+        log[field] = _int_or_none(raw_log.get(field))
+    return AttributeDict(log)
+
+
+class AsyncHTTPProvider:
+    """Awaitable JSON-RPC access to a node, for use from an asyncio event loop.
+
+    Requests are sent over the pooled `requests` session web3.py uses for the same endpoint, from
+    a bounded pool of worker threads, so a single event loop can have many requests in flight
+    without blocking on any of them. Blocking web3.py calls (like contract reads) can be awaited
+    in the same way using `run`.
+
+    Attributes:
+        web3: An instance of `Web3` from `web3.py`, with an `HTTPProvider`.
+        max_workers: Maximum number of requests in flight at the same time.
+    """
+
+    def __init__(self, web3: Web3, max_workers: int = 20):
+        assert isinstance(web3, Web3)
+        assert isinstance(web3.provider, HTTPProvider)
+        assert isinstance(max_workers, int)
+
+        self.web3 = web3
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rpc")
+
+    @property
+    def endpoint_uri(self) -> str:
+        return self.web3.provider.endpoint_uri
+
+    async def run(self, function, *args, **kwargs):
+        """Awaits a blocking call, i.e. `await rpc.run(contract.functions.balanceOf(a).call)`."""
+        return await asyncio.get_event_loop().run_in_executor(self._executor,
+                                                              functools.partial(function, *args, **kwargs))
+
+    async def make_request(self, method: str, params: list) -> dict:
+        """Sends a single JSON-RPC request and returns the raw response."""
+        return await self.run(self.web3.provider.make_request, method, params)
+
+    async def request(self, method: str, params: list):
+        """Sends a single JSON-RPC request and returns its raw result, raising `ValueError` on errors."""
+        return _unwrap_response(await self.make_request(method, params))
+
+    async def batch_request(self, calls: List[Tuple[str, list]], batch_size: int = 100) -> list:
+        """Awaitable version of :py:func:`pymaker.rpc.batch_request`."""
+        return await self.run(batch_request, self.web3, calls, batch_size)
+
+    async def block_number(self) -> int:
+        return int(await self.request("eth_blockNumber", []), 16)
+
+    async def get_block(self, block_identifier="latest") -> dict:
+        return await self.run(self.web3.eth.getBlock, block_identifier)
+
+    async def syncing(self) -> bool:
+        return bool(await self.request("eth_syncing", []))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def __repr__(self):
+        return f"AsyncHTTPProvider('{self.endpoint_uri}')"
+
+
+class _CallerContext:
+    # `contextvars` follows the caller across threads and asyncio tasks alike; on Python 3.6,
+    # which does not have it, the caller is tracked per thread instead.
+    def __init__(self):
+        self._var = ContextVar("pymaker_rpc_caller", default=None) if ContextVar is not None else None
+        self._local = threading.local()
+
+    def get(self) -> Optional[str]:
+        return self._var.get() if self._var is not None else getattr(self._local, 'caller', None)
+
+    def set(self, caller: Optional[str]):
+        if self._var is not None:
+            return self._var.set(caller)
+        previous = getattr(self._local, 'caller', None)
+        self._local.caller = caller
+        return previous
+
+    def reset(self, token):
+        if self._var is not None:
+            self._var.reset(token)
+        else:
+            self._local.caller = token
+
+
+_caller = _CallerContext()
+_instrumentations = WeakKeyDictionary()
+_SKIPPED_MODULES = ('pymaker.rpc', 'pymaker.concurrency', 'web3', 'eth_', 'requests', 'urllib3', 'http', 'hexbytes',
+                    'toolz', 'cytoolz', 'functools', 'asyncio', 'concurrent', 'threading', 'contextlib')
+
+
+@contextmanager
+def rpc_caller(name: str):
+    """Attributes all RPC requests made within the block to `name`, i.e. `with rpc_caller("Keeper.check_all"):`.
+
+    Without it, requests get attributed to the innermost method on the call stack which is not
+    part of web3.py or of its dependencies, like `Vat.urn` or `Transact.transact_async`.
+    """
+    assert isinstance(name, str)
+
+    token = _caller.set(name)
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def _calling_method() -> str:
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not module.startswith(_SKIPPED_MODULES):
+            owner = frame.f_locals.get('self')
+            if owner is not None:
+                return f"{type(owner).__name__}.{frame.f_code.co_name}"
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def rpc_instrumentation(web3: Web3) -> Optional['RpcInstrumentation']:
+    """Returns the :py:class:`pymaker.rpc.RpcInstrumentation` installed on `web3`, if any."""
+    return _instrumentations.get(web3)
+
+
+class RpcInstrumentation:
+    """Web3 middleware accounting for every JSON-RPC request made, to find out where RPC calls come from.
+
+    For each JSON-RPC method and calling method, it counts requests and errors, and sums up latency and
+    the number of bytes sent and received. Callers are taken from :py:func:`pymaker.rpc.rpc_caller`
+    if set, otherwise from the call stack. The same figures are forwarded to a metrics sink, as
+    `pymaker_rpc_requests_total`, `pymaker_rpc_errors_total`, `pymaker_rpc_latency_seconds` (histogram
+    by method) and `pymaker_rpc_bytes_total` (by method and direction).
+
+    Install it with `web3_via_http(endpoint_uri, instrumentation=RpcInstrumentation())`, or with `install`.
+    Byte counts are only available when it has been given the `requests` session the provider uses,
+    which `web3_via_http` does. Requests sent as JSON-RPC batches by :py:func:`pymaker.rpc.batch_request`
+    do not pass through web3.py middlewares and are not accounted for.
+
+    Attributes:
+        metrics: The :py:class:`pymaker.metrics.MetricsSink` receiving the metrics.
+    """
+
+    def __init__(self, metrics: Optional[MetricsSink] = None):
+        assert isinstance(metrics, MetricsSink) or metrics is None
+
+        self.metrics = metrics if metrics is not None else InMemoryMetrics()
+        self.stats = {}
+        self._lock = Lock()
+        self._transfers = threading.local()
+
+    def install(self, web3: Web3, session=None):
+        """Adds the middleware to `web3` and, if given, hooks the `requests` session to count bytes."""
+        assert isinstance(web3, Web3)
+
+        web3.middleware_onion.add(self.middleware, name='rpc_instrumentation')
+        if session is not None:
+            session.hooks['response'].append(self._response_hook)
+        _instrumentations[web3] = self
+
+    def middleware(self, make_request, web3):
+        def instrumented_request(method, params):
+            caller = _caller.get() or _calling_method()
+            self._transfers.sent = 0
+            self._transfers.received = 0
+            start = time.perf_counter()
+            failed = True
+            try:
+                response = make_request(method, params)
+                failed = 'error' in response
+                return response
+            finally:
+                self._record(method, caller, time.perf_counter() - start, failed,
+                             self._transfers.sent, self._transfers.received)
+
+        return instrumented_request
+
+    def _response_hook(self, response, *args, **kwargs):
+        body = response.request.body
+        self._transfers.sent = len(body) if body is not None else 0
+        self._transfers.received = len(response.content)
+
+    def _record(self, method: str, caller: str, seconds: float, failed: bool, sent: int, received: int):
+        with self._lock:
+            stats = self.stats.setdefault((method, caller), {'count': 0, 'errors': 0, 'seconds': 0.0,
+                                                             'bytes_sent': 0, 'bytes_received': 0})
+            stats['count'] += 1
+            stats['errors'] += int(failed)
+            stats['seconds'] += seconds
+            stats['bytes_sent'] += sent
+            stats['bytes_received'] += received
+
+        labels = {'method': method, 'caller': caller}
+        self.metrics.increment("pymaker_rpc_requests_total", labels=labels)
+        if failed:
+            self.metrics.increment("pymaker_rpc_errors_total", labels=labels)
+        self.metrics.observe("pymaker_rpc_latency_seconds", seconds, {'method': method})
+        self.metrics.increment("pymaker_rpc_bytes_total", sent, {'method': method, 'direction': 'sent'})
+        self.metrics.increment("pymaker_rpc_bytes_total", received, {'method': method, 'direction': 'received'})
+
+    def counts(self, method: Optional[str] = None, caller: Optional[str] = None) -> int:
+        """Returns the number of requests made, optionally only those of one method and/or one caller."""
+        with self._lock:
+            return sum(stats['count'] for (stats_method, stats_caller), stats in self.stats.items()
+                       if (method is None or stats_method == method) and (caller is None or stats_caller == caller))
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+    def summary(self) -> List[dict]:
+        """Returns the accounting per method and caller, the most requested first."""
+        with self._lock:
+            rows = [{'method': method, 'caller': caller, **stats} for (method, caller), stats in self.stats.items()]
+        return sorted(rows, key=lambda row: (-row['count'], row['method'], row['caller']))
+
+    def log_summary(self, limit: int = 50):
+        rows = self.summary()
+        logger.info(f"RPC usage: {sum(row['count'] for row in rows)} requests"
+                    f" ({sum(row['errors'] for row in rows)} failed)")
+        for row in rows[:limit]:
+            logger.info(f"  {row['count']:>8} x {row['method']:<28} from {row['caller']:<40}"
+                        f" avg {1000 * row['seconds'] / row['count']:.1f}ms,"
+                        f" {row['bytes_sent'] + row['bytes_received']} bytes, {row['errors']} errors")
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.exception = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Web3 middleware coalescing identical JSON-RPC reads which are in flight at the same time.
+
+    When a request is made while an identical one (same method and params, including the block tag)
+    is still waiting for its response, no new request is sent; the caller waits for the pending one
+    and gets the same response. Nothing is cached beyond that, so reads made one after another
+    still get fresh results.
+
+    Only methods without side effects are coalesced. Responses are shared between all waiters, so they
+    must not be modified in place.
+
+    Attributes:
+        methods: JSON-RPC methods subject to coalescing.
+        requests: Number of requests actually sent for these methods.
+        coalesced: Number of requests served by another request already in flight.
+    """
+
+    READS = frozenset(['eth_call', 'eth_getLogs', 'eth_getBalance', 'eth_getCode', 'eth_getStorageAt',
+                       'eth_getBlockByNumber', 'eth_getBlockByHash', 'eth_getTransactionReceipt',
+                       'eth_getTransactionByHash', 'eth_blockNumber', 'eth_gasPrice', 'eth_chainId', 'net_version'])
+
+    def __init__(self, methods=READS, metrics: Optional[MetricsSink] = None):
+        assert isinstance(metrics, MetricsSink) or metrics is None
+
+        self.methods = frozenset(methods)
+        self.metrics = metrics if metrics is not None else MetricsSink()
+        self.requests = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = Lock()
+
+    def install(self, web3: Web3):
+        """Adds the middleware to `web3`.
+
+        If installed after :py:class:`pymaker.rpc.RpcInstrumentation`, the latter only accounts for
+        the requests actually sent.
+        """
+        assert isinstance(web3, Web3)
+
+        web3.middleware_onion.add(self.middleware, name='single_flight')
+
+    def middleware(self, make_request, web3):
+        def coalescing_request(method, params):
+            if method not in self.methods:
+                return make_request(method, params)
+
+            key = (method, json.dumps(params, sort_keys=True, default=str))
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    self.requests += 1
+                    leader = True
+                else:
+                    flight.followers += 1
+                    self.coalesced += 1
+                    leader = False
+
+            if not leader:
+                self.metrics.increment("pymaker_rpc_coalesced_total", labels={'method': method})
+                flight.done.wait()
+                if flight.exception is not None:
+                    raise flight.exception
+                return flight.response
+
+            try:
+                flight.response = make_request(method, params)
+                return flight.response
+            except Exception as e:
+                flight.exception = e
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+        return coalescing_request
+
+    def __repr__(self):
+        return f"SingleFlight(requests={self.requests}, coalesced={self.coalesced})"
+
+
+class _Endpoint:
+    def __init__(self, uri: str, session: requests.Session, max_workers: int):
+        self.uri = uri
+        self.session = session
+        self.latencies = deque(maxlen=100)
+        self.average_latency = None
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        self.block_number = None
+        self.lock = threading.Lock()
+        # one pool per node, so a node which stopped responding can only hold up requests sent to itself
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rpc")
+        self._in_flight = {}
+
+    def healthy(self, now: float) -> bool:
+        with self.lock:
+            return now >= self.unhealthy_until
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self.lock:
+            if len(self.latencies) == 0:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    def expected_latency(self) -> float:
+        """Average latency, or for how long the oldest pending request has been waiting if that is longer."""
+        with self.lock:
+            average_latency = self.average_latency or 0.0
+            if len(self._in_flight) == 0:
+                return average_latency
+            return max(average_latency, time.perf_counter() - min(self._in_flight.values()))
+
+    def request_started(self) -> object:
+        token = object()
+        with self.lock:
+            self._in_flight[token] = time.perf_counter()
+        return token
+
+    def request_finished(self, token: object):
+        with self.lock:
+            self._in_flight.pop(token, None)
+
+    def record_success(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+            self._update_average(seconds)
+            self.failures = 0
+
+    def record_slow(self, seconds: float):
+        """Counts a request which got overtaken by a hedged one as having taken at least `seconds`."""
+        with self.lock:
+            self._update_average(seconds)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.unhealthy_until = time.time() + min(2 ** self.failures, 60)
+
+    def _update_average(self, seconds: float):
+        self.average_latency = seconds if self.average_latency is None else 0.8 * self.average_latency + 0.2 * seconds
+
+    def __repr__(self):
+        return f"Endpoint('{self.uri}', latency={self.average_latency}, block={self.block_number})"
+
+
+class MultiEndpointProvider(HTTPProvider):
+    """HTTP provider spreading requests over several nodes for lower tail latency and failover.
+
+    Idempotent reads go to the node with the lowest recent latency. If no response arrives within
+    that node's `hedge_percentile` latency, the same request is sent to the second fastest node as well,
+    and whichever answers first wins. Time spent waiting for a node counts towards its latency even
+    before it responds, so a node which stopped responding is no longer picked first. Each node has
+    its own pool of `http_pool_size` worker threads, so requests stuck on it do not hold up hedged
+    requests and broadcasts to the others. Nodes whose block height lags more than `max_lag` blocks
+    behind the highest one seen are not used for reads.
+
+    Raw transactions are broadcast to all nodes. Any other request (i.e. nonces or filters, which
+    are node-local) goes to the first healthy node in the configured order. A node failing to respond
+    is skipped for an exponentially growing period of time. JSON-RPC error responses, like reverted
+    calls, are returned as they are, as they would be the same on any node.
+
+    `endpoint_uri` is the first endpoint, which is also where :py:func:`pymaker.rpc.batch_request`
+    sends batches.
+
+    Attributes:
+        endpoints: The nodes, in the configured order.
+        hedge_percentile: Latency percentile of the fastest node after which a hedged request is sent.
+        min_hedge_delay: Minimum delay (in seconds) before a hedged request is sent.
+        max_lag: Maximum number of blocks a node may lag behind to be used for reads.
+        height_check_interval: How often (in seconds) block heights of all nodes are checked.
+        hedged_requests: Number of hedged requests sent so far.
+    """
+
+    IDEMPOTENT_READS = frozenset(['eth_call', 'eth_getLogs', 'eth_getTransactionReceipt', 'eth_getTransactionByHash',
+                                  'eth_getBlockByNumber', 'eth_getBlockByHash', 'eth_getBalance', 'eth_getCode',
+                                  'eth_getStorageAt', 'eth_estimateGas', 'eth_chainId', 'net_version'])
+    BROADCASTS = frozenset(['eth_sendRawTransaction'])
+
+    def __init__(self, endpoint_uris: List[str], request_kwargs: Optional[dict] = None, http_pool_size: int = 20,
+                 hedge_percentile: float = 0.9, min_hedge_delay: float = 0.05, max_lag: int = 2,
+                 height_check_interval: float = 5.0):
+        assert isinstance(endpoint_uris, list)
+        assert len(endpoint_uris) > 0
+        assert all(uri.startswith("http") for uri in endpoint_uris)
+        assert 0 < hedge_percentile <= 1
+        assert isinstance(max_lag, int)
+
+        super().__init__(endpoint_uris[0], request_kwargs)
+        self.endpoints = [_Endpoint(uri, self._session(http_pool_size), http_pool_size) for uri in endpoint_uris]
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_lag = max_lag
+        self.height_check_interval = height_check_interval
+        self.hedged_requests = 0
+        self._heights_checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _session(http_pool_size: int) -> requests.Session:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def make_request(self, method: str, params: list) -> dict:
+        request_data = self.encode_rpc_request(method, params)
+        self._refresh_heights()
+
+        if method in self.BROADCASTS:
+            return self._broadcast(request_data)
+        elif method in self.IDEMPOTENT_READS:
+            return self._hedged(request_data, self._read_candidates())
+        else:
+            return self._failover(request_data, self._candidates())
+
+    def _post(self, endpoint: _Endpoint, request_data: bytes) -> dict:
+        start = time.perf_counter()
+        token = endpoint.request_started()
+        try:
+            response = endpoint.session.post(endpoint.uri, data=request_data, **self.get_request_kwargs())
+            response.raise_for_status()
+            result = self.decode_rpc_response(response.content)
+        except Exception:
+            endpoint.record_failure()
+            raise
+        finally:
+            endpoint.request_finished(token)
+
+        endpoint.record_success(time.perf_counter() - start)
+        return result
+
+    def _candidates(self) -> List[_Endpoint]:
+        now = time.time()
+        healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy(now)]
+        return healthy if len(healthy) > 0 else list(self.endpoints)
+
+    def _read_candidates(self) -> List[_Endpoint]:
+        candidates = self._candidates()
+        heights = [endpoint.block_number for endpoint in candidates if endpoint.block_number is not None]
+        if len(heights) > 0:
+            synced = [endpoint for endpoint in candidates
+                      if endpoint.block_number is None or endpoint.block_number >= max(heights) - self.max_lag]
+            candidates = synced if len(synced) > 0 else candidates
+
+        # nodes without latency data yet come first, so they get measured, while a node which has stopped
+        # responding drops behind the others as soon as its pending requests take longer than their latency
+        return sorted(candidates, key=lambda endpoint: endpoint.expected_latency())
+
+    def _failover(self, request_data: bytes, candidates: List[_Endpoint]) -> dict:
+        last_exception = None
+        for endpoint in candidates:
+            try:
+                return self._post(endpoint, request_data)
+            except Exception as e:
+                logger.warning(f"Request to {endpoint.uri} failed ({e})")
+                last_exception = e
+
+        raise last_exception
+
+    def _hedged(self, request_data: bytes, candidates: List[_Endpoint]) -> dict:
+        if len(candidates) < 2:
+            return self._failover(request_data, candidates)
+
+        primary, secondary = candidates[0], candidates[1]
+        delay = max(primary.percentile(self.hedge_percentile) or self.min_hedge_delay, self.min_hedge_delay)
+        start = time.perf_counter()
+        primary_future = primary.executor.submit(self._post, primary, request_data)
+        done, pending = wait({primary_future}, timeout=delay)
+        if len(done) == 0 or next(iter(done)).exception() is not None:
+            with self._lock:
+                self.hedged_requests += 1
+            pending.add(secondary.executor.submit(self._post, secondary, request_data))
+
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary_future and not primary_future.done():
+                        primary.record_slow(time.perf_counter() - start)
+                    return future.result()
+
+        return self._failover(request_data, candidates[2:] or candidates)
+
+    def _broadcast(self, request_data: bytes) -> dict:
+        futures = [endpoint.executor.submit(self._post, endpoint, request_data) for endpoint in self._candidates()]
+        responses = []
+        last_exception = None
+        for future in as_completed(futures):
+            try:
+                response = future.result()
+            except Exception as e:
+                last_exception = e
+                continue
+            if 'error' not in response:
+                return response
+            responses.append(response)
+
+        # if all nodes rejected the transaction, the first rejection is as good as any other
+        if len(responses) > 0:
+            return responses[0]
+        raise last_exception
+
+    def _refresh_heights(self):
+        now = time.time()
+        if len(self.endpoints) < 2 or now - self._heights_checked_at < self.height_check_interval:
+            return
+
+        self._heights_checked_at = now
+        for endpoint in self.endpoints:
+            if endpoint.healthy(now):
+                endpoint.executor.submit(self._refresh_height, endpoint)
+
+    def _refresh_height(self, endpoint: _Endpoint):
+        try:
+            response = self._post(endpoint, self.encode_rpc_request("eth_blockNumber", []))
+            endpoint.block_number = int(response['result'], 16)
+        except Exception as e:
+            logger.debug(f"Failed to check block height of {endpoint.uri} ({e})")
+
+    def __str__(self):
+        return f"RPC connection to {', '.join(endpoint.uri for endpoint in self.endpoints)}"
+
+
+def web3_via_endpoints(endpoint_uris: List[str], timeout=60, http_pool_size=20, instrumentation=None,
+                       single_flight=None, **kwargs) -> Web3:
+    """Creates a `Web3` instance spreading requests over several nodes using :py:class:`pymaker.rpc.MultiEndpointProvider`.
+
+    Args:
+        endpoint_uris: HTTP(S) endpoints of the nodes, the first one being the preferred one.
+        timeout: Request timeout (in seconds).
+        http_pool_size: Maximum number of pooled connections per node.
+        instrumentation: Optional :py:class:`pymaker.rpc.RpcInstrumentation` accounting for all requests.
+        single_flight: Optional :py:class:`pymaker.rpc.SingleFlight` coalescing identical concurrent reads.
+        kwargs: Other arguments of :py:class:`pymaker.rpc.MultiEndpointProvider`.
+    """
+    web3 = Web3(MultiEndpointProvider(endpoint_uris, request_kwargs={"timeout": timeout}, http_pool_size=http_pool_size,
+                                      **kwargs))
+    if instrumentation is not None:
+        instrumentation.install(web3)
+    if single_flight is not None:
+        single_flight.install(web3)
+    return web3
@@ -0,0 +1,222 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import itertools
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+logger = logging.getLogger()
+
+PRIORITY_BLOCK = 0
+PRIORITY_EVENT = 5
+PRIORITY_TIMER = 10
+
+
+class ScheduledCallback:
+    """A callback executed by a :py:class:`pymaker.scheduler.Scheduler`.
+
+    It is a drop-in replacement for :py:class:`pymaker.util.AsyncCallback`: a new invocation is refused
+    while the previous one is still queued or running, and `wait` blocks until it has finished.
+    Instead of getting its own thread, the invocation is queued to the scheduler worker pool.
+
+    Attributes:
+        callback: The callback function.
+        priority: Lower values are executed first when more invocations are waiting for a worker.
+        name: Name used in logs and metrics.
+        runs: Number of completed invocations.
+        skipped: Number of invocations refused because the previous one was still running.
+    """
+
+    def __init__(self, scheduler, callback, priority: int, name: str):
+        assert callable(callback)
+        assert isinstance(priority, int)
+        assert isinstance(name, str)
+
+        self.scheduler = scheduler
+        self.callback = callback
+        self.priority = priority
+        self.name = name
+        self.runs = 0
+        self.skipped = 0
+        self.lateness = deque(maxlen=100)
+        self._pending = False
+        self._done = threading.Event()
+        self._done.set()
+
+    def trigger(self, on_start=None, on_finish=None, args: tuple = ()) -> bool:
+        """Queues the callback for execution, unless the previous invocation hasn't finished yet.
+
+        Arguments:
+            on_start: Optional method to be called before the actual callback. Can be `None`.
+            on_finish: Optional method to be called after the actual callback. Can be `None`.
+            args: Positional arguments the callback will be invoked with.
+
+        Returns:
+            `True` if the callback has been queued, `False` if the previous invocation is still running.
+        """
+        return self.scheduler._enqueue(self, time.time(), on_start, on_finish, args)
+
+    def wait(self):
+        """Waits for the queued or running invocation to finish. Returns instantly if there is none."""
+        self._done.wait()
+
+    def metrics(self) -> dict:
+        """Returns the number of runs and skips, and the lateness of recent invocations (in seconds).
+
+        Lateness is the time between an invocation being due and a worker starting it; jitter is
+        its standard deviation.
+        """
+        lateness = list(self.lateness)
+        return {'name': self.name,
+                'priority': self.priority,
+                'runs': self.runs,
+                'skipped': self.skipped,
+                'lateness_avg': statistics.mean(lateness) if lateness else 0.0,
+                'lateness_max': max(lateness) if lateness else 0.0,
+                'jitter': statistics.pstdev(lateness) if len(lateness) > 1 else 0.0}
+
+    def __repr__(self):
+        return f"ScheduledCallback('{self.name}', priority={self.priority})"
+
+
+class Scheduler:
+    """Runs callbacks on a fixed-size pool of worker threads, either on demand or periodically.
+
+    Periodic callbacks are kept in a heap ordered by due time, served by a single scheduler thread,
+    so no thread gets created per timer or per invocation. Invocations waiting for a free worker
+    are picked by priority, so block callbacks get ahead of housekeeping timers when the pool is busy.
+    Running callbacks are never interrupted.
+
+    Attributes:
+        max_workers: Number of worker threads, which is also the maximum number of callbacks running
+            at the same time.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        assert isinstance(max_workers, int)
+        assert max_workers > 0
+
+        self.max_workers = max_workers
+        self.callbacks = []
+        self._timers = []
+        self._ready = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    def callback(self, callback, priority: int = PRIORITY_TIMER, name: Optional[str] = None) -> ScheduledCallback:
+        """Wraps a callback so it can be triggered on the worker pool."""
+        scheduled = ScheduledCallback(self, callback, priority, name or getattr(callback, '__name__', repr(callback)))
+        self.callbacks.append(scheduled)
+        return scheduled
+
+    def every(self, frequency_in_seconds: float, callback: ScheduledCallback, first_delay: float = 0):
+        """Triggers the callback every `frequency_in_seconds`, first after `first_delay` seconds.
+
+        A tick is skipped (and counted as such) if the previous invocation is still running.
+        """
+        assert isinstance(callback, ScheduledCallback)
+        assert frequency_in_seconds > 0
+
+        with self._condition:
+            heapq.heappush(self._timers, (time.time() + first_delay, next(self._sequence), frequency_in_seconds, callback))
+            self._condition.notify_all()
+
+    def start(self):
+        """Starts the scheduler thread and the worker threads."""
+        assert len(self._threads) == 0
+
+        self._threads.append(threading.Thread(target=self._schedule, name="scheduler", daemon=True))
+        for index in range(self.max_workers):
+            self._threads.append(threading.Thread(target=self._work, name=f"worker-{index}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stops firing timers and accepting new invocations. Already queued invocations still get executed."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+    @property
+    def stopping(self) -> bool:
+        """`True` once `stop` has been called, after which no new invocations are accepted."""
+        return self._stopping
+
+    def metrics(self) -> List[dict]:
+        return [callback.metrics() for callback in self.callbacks]
+
+    def _enqueue(self, callback: ScheduledCallback, due_time: float, on_start, on_finish, args: tuple) -> bool:
+        with self._condition:
+            if callback._pending or self._stopping:
+                callback.skipped += 1
+                return False
+
+            callback._pending = True
+            callback._done.clear()
+            job = (due_time, on_start, on_finish, args)
+            heapq.heappush(self._ready, (callback.priority, next(self._sequence), callback, job))
+            self._condition.notify_all()
+            return True
+
+    def _schedule(self):
+        with self._condition:
+            while not self._stopping:
+                now = time.time()
+                while len(self._timers) > 0 and self._timers[0][0] <= now:
+                    due_time, _, frequency, callback = heapq.heappop(self._timers)
+                    if not self._enqueue(callback, due_time, None, None, ()):
+                        logger.debug(f"Ignoring timer {callback.name} as previous one is already running")
+
+                    # keep a fixed rate, but do not try to catch up on ticks missed entirely
+                    next_due = due_time + frequency
+                    if next_due <= now:
+                        next_due = now + frequency
+                    heapq.heappush(self._timers, (next_due, next(self._sequence), frequency, callback))
+
+                timeout = self._timers[0][0] - time.time() if len(self._timers) > 0 else None
+                self._condition.wait(timeout=max(timeout, 0) if timeout is not None else None)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while len(self._ready) == 0:
+                    if self._stopping:
+                        return
+                    self._condition.wait()
+                _, _, callback, (due_time, on_start, on_finish, args) = heapq.heappop(self._ready)
+
+            callback.lateness.append(max(time.time() - due_time, 0.0))
+            try:
+                if on_start is not None:
+                    on_start()
+                callback.callback(*args)
+                if on_finish is not None:
+                    on_finish()
+            except Exception as e:
+                logger.exception(f"Callback {callback.name} failed ({e})")
+            finally:
+                with self._condition:
+                    callback.runs += 1
+                    callback._pending = False
+                    callback._done.set()
@@ -0,0 +1,186 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+from pymaker.metrics import MetricsSink
+
+logger = logging.getLogger()
+
+# Stages a transaction goes through, in order
+GAS_ESTIMATION = "gas_estimation"
+LOCK_WAIT = "lock_wait"
+NONCE = "nonce"
+SIGNING = "signing"
+BROADCAST = "broadcast"
+FIRST_SEEN = "first_seen"
+GAS_BUMP = "gas_bump"
+MINED = "mined"
+RECEIPT_DECODE = "receipt_decode"
+
+
+class Span:
+    """A timed stage of a transaction.
+
+    Attributes:
+        stage: Name of the stage, i.e. `broadcast`.
+        start: Timestamp the stage started at.
+        end: Timestamp the stage ended at.
+        attributes: Additional details, i.e. the gas price of a bump.
+    """
+
+    def __init__(self, stage: str, start: float, end: float, attributes: Optional[dict] = None):
+        assert isinstance(stage, str)
+        assert isinstance(attributes, dict) or attributes is None
+
+        self.stage = stage
+        self.start = start
+        self.end = end
+        self.attributes = attributes or {}
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def to_dict(self) -> dict:
+        return {'stage': self.stage, 'start': self.start, 'end': self.end, 'duration': self.duration,
+                **self.attributes}
+
+    def __repr__(self):
+        return f"Span({self.stage}, {self.duration:.3f}s)"
+
+
+class TransactionTrace:
+    """Timings of all stages of a single :py:class:`pymaker.Transact`, from gas estimation to receipt decoding.
+
+    Spans mean:
+    - `gas_estimation`: estimating gas (or getting it from `Transact.gas_limit_model`),
+    - `lock_wait`: waiting for `transaction_lock`, held by other transactions being sent,
+    - `nonce`: getting the nonce, lock wait included,
+    - `signing`: signing locally, when not left to the `web3.py` middleware as part of `broadcast`,
+    - `broadcast`: sending a transaction to the node, signing included, one span per transaction sent,
+    - `first_seen`: from sending until the node returns the transaction by its hash,
+    - `gas_bump`: time spent at a gas price before replacing the transaction with a higher one,
+    - `mined`: from the first broadcast until a receipt is available,
+    - `receipt_decode`: turning the receipt into a :py:class:`pymaker.Receipt`.
+
+    Tracing costs one extra `eth_getTransactionByHash` request per poll until the node returns
+    the transaction, polled right after the first broadcast and then after 1, 2, 4 and every
+    8 seconds, so `first_seen` is only accurate to within the polling interval. Nothing else
+    costs any additional requests.
+
+    Attributes:
+        function: Contract and function name, or `transfer`, used to aggregate traces.
+        start: Timestamp the transaction execution started at.
+        end: Timestamp the transaction execution finished at, `None` until finished.
+        spans: Recorded spans.
+        outcome: `success`, `failure` or `None` until finished.
+    """
+
+    def __init__(self, function: str):
+        assert isinstance(function, str)
+
+        self.function = function
+        self.start = time.time()
+        self.end = None
+        self.spans = []
+        self.outcome = None
+
+    @contextmanager
+    def span(self, stage: str, **attributes):
+        """Records the time spent in the `with` block as a span."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(stage, start, time.time(), **attributes)
+
+    def add_span(self, stage: str, start: float, end: float, **attributes):
+        self.spans.append(Span(stage, start, end, attributes))
+
+    def first(self, stage: str) -> Optional[Span]:
+        return next((span for span in self.spans if span.stage == stage), None)
+
+    def stages(self, stage: str) -> List[Span]:
+        return [span for span in self.spans if span.stage == stage]
+
+    def finish(self, successful: bool):
+        self.end = time.time()
+        self.outcome = "success" if successful else "failure"
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def to_dict(self) -> dict:
+        return {'function': self.function, 'start': self.start, 'end': self.end, 'outcome': self.outcome,
+                'spans': [span.to_dict() for span in self.spans]}
+
+    def __repr__(self):
+        spans = ", ".join(f"{span.stage}={span.duration:.3f}s" for span in self.spans)
+        return f"TransactionTrace({self.function}, {self.outcome}, {self.duration:.3f}s: {spans})"
+
+
+class TraceSink:
+    """Receives traces of finished transactions.
+
+    The base class discards them. Set `Transact.trace_sink` to an instance of a subclass to get them,
+    i.e. :py:class:`pymaker.tracing.MetricsTraceSink`.
+    """
+
+    def export(self, trace: TransactionTrace):
+        pass
+
+
+class MetricsTraceSink(TraceSink):
+    """Aggregates traces into histograms per function and stage.
+
+    Records `pymaker_transaction_stage_seconds` (labels `function`, `stage`) for each span,
+    `pymaker_transaction_seconds` (labels `function`, `outcome`) for the whole transaction and
+    `pymaker_transaction_gas_bumps_total` (label `function`).
+
+    Attributes:
+        metrics: The :py:class:`pymaker.metrics.MetricsSink` to record to, i.e. an
+            :py:class:`pymaker.metrics.InMemoryMetrics` exported to Prometheus.
+        log: Whether to also log every trace at debug level.
+    """
+
+    def __init__(self, metrics: MetricsSink, log: bool = False):
+        assert isinstance(metrics, MetricsSink)
+        assert isinstance(log, bool)
+
+        self.metrics = metrics
+        self.log = log
+
+    def export(self, trace: TransactionTrace):
+        assert isinstance(trace, TransactionTrace)
+
+        for span in trace.spans:
+            self.metrics.observe("pymaker_transaction_stage_seconds", span.duration,
+                                 {'function': trace.function, 'stage': span.stage})
+        self.metrics.observe("pymaker_transaction_seconds", trace.duration,
+                             {'function': trace.function, 'outcome': trace.outcome})
+        bumps = len(trace.stages(GAS_BUMP))
+        if bumps > 0:
+            self.metrics.increment("pymaker_transaction_gas_bumps_total", bumps, {'function': trace.function})
+
+        if self.log:
+            logger.debug(f"{trace}")
@@ -43,14 +43,26 @@ def http_response_summary(response) -> str:
     return f"{response.status_code} {response.reason} ({text})"
 
 
-# CAUTION: Used by Transact class, this breaks applications running their own asyncio event loop.
+_thread_loops = threading.local()
+
+
+def _thread_event_loop() -> asyncio.AbstractEventLoop:
+    loop = getattr(_thread_loops, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _thread_loops.loop = loop
+    return loop
+
+
+# Used by Transact class. Runs the futures on a long-lived event loop private to the calling thread,
+# so it can not be called from a coroutine; applications running their own event loop should
+# `await` the futures (i.e. `await transact.transact_async()`) instead.
 def synchronize(futures) -> list:
     if len(futures) > 0:
-        loop = asyncio.new_event_loop()
-        try:
-            return loop.run_until_complete(asyncio.gather(*futures, loop=loop))
-        finally:
-            loop.close()
+        async def gather():
+            return await asyncio.gather(*futures)
+
+        return _thread_event_loop().run_until_complete(gather())
     else:
         return []
 
@@ -117,7 +129,7 @@ class AsyncCallback:
         self.callback = callback
         self.thread = None
 
-    def trigger(self, on_start=None, on_finish=None) -> bool:
+    def trigger(self, on_start=None, on_finish=None, args: tuple = ()) -> bool:
         """Invokes the callback in a separate thread, unless one is already running.
 
         If callback isn't currently running, invokes it in a separate thread and returns `True`.
@@ -127,6 +139,7 @@ class AsyncCallback:
         Arguments:
             on_start: Optional method to be called before the actual callback. Can be `None`.
             on_finish: Optional method to be called after the actual callback. Can be `None`.
+            args: Positional arguments the callback will be invoked with.
 
         Returns:
             `True` if callback has been invoked, or if it invocation attempt failed.
@@ -136,7 +149,7 @@ class AsyncCallback:
             def thread_target():
                 if on_start is not None:
                     on_start()
-                self.callback()
+                self.callback(*args)
                 if on_finish is not None:
                     on_finish()
 
@@ -0,0 +1,200 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+
+import pytest
+from web3 import Web3
+from web3.providers import BaseProvider
+
+from pymaker.backtest import BlockHistory, BlockRecord, GasBacktest
+from pymaker.gas import FixedGasFees, FixedGasPrice, GasFees, GasPrice, GeometricGasPrice, IncreasingGasPrice
+
+GWEI = GasPrice.GWEI
+
+
+def history(inclusion_prices: list, base_fee: int = 0) -> BlockHistory:
+    # one block every 12 seconds, the cheapest transaction of each block paying the given price
+    return BlockHistory([BlockRecord(100 + index, 1000 + 12 * index, base_fee, [price * GWEI, 500 * GWEI])
+                         for index, price in enumerate(inclusion_prices)])
+
+
+class BlockNode(BaseProvider):
+    def make_request(self, method, params):
+        number = int(params[0], 16)
+        block = {'number': hex(number), 'timestamp': hex(1000 + 12 * number), 'baseFeePerGas': hex(10),
+                 'transactions': [{'gasPrice': hex(30)},
+                                  {'gasPrice': hex(25), 'maxFeePerGas': hex(40), 'maxPriorityFeePerGas': hex(15)}]}
+        return {'jsonrpc': "2.0", 'id': 1, 'result': block}
+
+
+class TestBlockRecord:
+    def test_should_compute_inclusion_price(self):
+        # given
+        block = BlockRecord(1, 1000, 5, [40, 10, 30, 20])
+
+        # expect
+        assert block.gas_prices == [10, 20, 30, 40]
+        assert block.inclusion_price(0) == 10
+        assert block.inclusion_price(50) == 30
+        assert block.inclusion_price(100) == 40
+        assert BlockRecord(1, 1000, 5, []).inclusion_price(50) == 5
+
+    def test_should_use_effective_gas_price_of_type2_transactions(self):
+        # when
+        block = BlockRecord.from_block({'number': "0x1", 'timestamp': "0x3e8", 'baseFeePerGas': "0xa",
+                                        'transactions': [{'gasPrice': "0x1e"},
+                                                         {'maxFeePerGas': "0x28", 'maxPriorityFeePerGas': "0xf"}]})
+
+        # then
+        assert block.gas_prices == [25, 30]
+        assert block.base_fee == 10
+
+
+class TestBlockHistory:
+    def test_should_record_blocks_from_node(self):
+        # when
+        block_history = BlockHistory.from_node(Web3(BlockNode()), 5, 7)
+
+        # then
+        assert [block.number for block in block_history.blocks] == [5, 6, 7]
+        assert block_history.blocks[0].gas_prices == [25, 30]
+
+    def test_should_save_and_load_file(self, tmpdir):
+        # given
+        path = str(tmpdir.join("blocks.jsonl"))
+        block_history = history([10, 20, 30], base_fee=5)
+
+        # when
+        block_history.to_file(path)
+        loaded = BlockHistory.from_file(path)
+
+        # then
+        assert [block.to_json() for block in loaded.blocks] == [block.to_json() for block in block_history.blocks]
+
+    def test_should_find_first_block_after_timestamp(self):
+        # given
+        block_history = history([10, 20, 30])
+
+        # expect
+        assert block_history.first_block_after(999) == 0
+        assert block_history.first_block_after(1000) == 1
+        assert block_history.first_block_after(1030) == 3
+
+
+class TestGasBacktest:
+    def test_should_include_transactions_paying_enough(self):
+        # given
+        backtest = GasBacktest(history([10] * 20), max_blocks=5)
+
+        # when
+        result = backtest.run(FixedGasPrice(10 * GWEI))
+
+        # then
+        assert result.included == 15
+        assert set(result.inclusion_times) == {12}
+        assert set(result.inclusion_blocks) == {1}
+        assert result.total_cost == 15 * 21000 * 10 * GWEI
+
+    def test_should_miss_transactions_paying_too_little(self):
+        # given
+        backtest = GasBacktest(history([10] * 20), max_blocks=5)
+
+        # when
+        result = backtest.run(FixedGasPrice(9 * GWEI))
+
+        # then
+        assert result.included == 0
+        assert result.inclusion_time(0.5) == float('inf')
+
+    def test_should_replace_with_increasing_gas_price(self):
+        # given
+        backtest = GasBacktest(history([20] * 20), max_blocks=10)
+
+        # when
+        result = backtest.run(IncreasingGasPrice(10 * GWEI, 5 * GWEI, 12, None), submit_times=[1000])
+
+        # then
+        assert result.inclusion_times == [24]
+        assert result.inclusion_blocks == [2]
+        assert result.replacements == 1
+        assert result.costs == [21000 * 20 * GWEI]
+
+    def test_should_respect_replacement_rules(self):
+        # given the strategy increases by 5% every block, which is not enough for a replacement every time
+        backtest = GasBacktest(history([11] * 20), max_blocks=10)
+
+        # when
+        result = backtest.run(GeometricGasPrice(10 * GWEI, 12, 1.05), submit_times=[1000])
+
+        # then
+        assert result.replacements == 1
+        assert result.inclusion_blocks == [4]
+
+    def test_should_require_base_fee_for_type2_transactions(self):
+        # given
+        backtest = GasBacktest(history([0] * 20, base_fee=30 * GWEI), max_blocks=5)
+
+        # expect
+        assert backtest.run(FixedGasFees(29 * GWEI, 2 * GWEI)).included == 0
+        result = backtest.run(FixedGasFees(40 * GWEI, 2 * GWEI))
+        assert result.included == 15
+        assert result.average_cost == 21000 * 32 * GWEI
+
+    def test_should_replace_legacy_gas_price_with_type2_fees(self):
+        # given a strategy switching to EIP-1559 fees after the first block
+        class SwitchingGasPrice(GasPrice):
+            def get_gas_price(self, time_elapsed: int):
+                return 10 * GWEI
+
+            def get_gas_fees(self, time_elapsed: int):
+                return GasFees(40 * GWEI, 20 * GWEI) if time_elapsed >= 24 else None
+
+        backtest = GasBacktest(history([0] * 20, base_fee=30 * GWEI), max_blocks=5)
+
+        # when
+        result = backtest.run(SwitchingGasPrice(), submit_times=[1000])
+
+        # then
+        assert result.replacements == 1
+        assert result.inclusion_blocks == [2]
+        assert result.costs == [21000 * 40 * GWEI]
+
+    def test_should_compare_strategies(self):
+        # given
+        backtest = GasBacktest(history([10, 30] * 10), max_blocks=5)
+
+        # when
+        summaries = backtest.compare({'cheap': FixedGasPrice(10 * GWEI), 'fast': FixedGasPrice(30 * GWEI)})
+
+        # then
+        assert summaries['cheap']['p90'] > summaries['fast']['p90']
+        assert summaries['cheap']['average_cost'] < summaries['fast']['average_cost']
+
+    def test_should_simulate_thousands_of_transactions_per_second(self):
+        # given
+        backtest = GasBacktest(history([10 + index % 50 for index in range(2000)]), max_blocks=100)
+        strategy = GeometricGasPrice(10 * GWEI, 12, 1.125, 100 * GWEI)
+
+        # when
+        start = time.time()
+        result = backtest.run(strategy)
+
+        # then
+        assert len(result.inclusion_times) == 1900
+        assert time.time() - start < 1.9
@@ -0,0 +1,321 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import threading
+import time
+
+import pytest
+from eth_account import Account
+from eth_utils import keccak
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.providers import BaseProvider
+
+from pymaker import Address, RecoveredTransact, Transact, TransactStatus
+from pymaker.batch import ReceiptTracker, submit_many, TransactBatch
+from pymaker.gas import FixedGasFees, FixedGasPrice, GasFees
+from pymaker.keys import register_private_key
+from pymaker.numeric import Wad
+
+PRIVATE_KEY = "0x" + "11" * 32
+ACCOUNT = Account.privateKeyToAccount(PRIVATE_KEY).address
+OTHER_ADDRESS = Address("0x50ff810797f75f6bfbf2227442e0c961a8562f4c")
+
+
+class FakeNode(BaseProvider):
+    """Accepts every transaction and mines it when asked to, producing receipts with a single log."""
+    endpoint_uri = "http://localhost:8545"
+
+    def __init__(self, tx_count: int = 7):
+        self.tx_count = tx_count
+        self.requests = []
+        self.sent = []
+        self.mined = {}
+        self.transactions = {}
+        self.block_number = 16
+        self.lock = threading.Lock()
+
+    def mine(self):
+        with self.lock:
+            for tx_hash in self.sent:
+                self.mined[tx_hash] = {'transactionHash': tx_hash, 'transactionIndex': "0x0", 'blockNumber': "0x10",
+                                       'blockHash': "0x" + "aa" * 32, 'cumulativeGasUsed': "0x5208",
+                                       'gasUsed': "0x5208", 'contractAddress': None, 'status': "0x1",
+                                       'logs': [{'address': ACCOUNT, 'topics': ["0x" + "bb" * 32], 'data': "0x",
+                                                 'blockNumber': "0x10", 'blockHash': "0x" + "aa" * 32,
+                                                 'transactionHash': tx_hash, 'transactionIndex': "0x0",
+                                                 'logIndex': "0x0", 'removed': False}],
+                                       'logsBloom': "0x" + "00" * 256, 'from': ACCOUNT, 'to': OTHER_ADDRESS.address}
+            self.tx_count += len(self.sent)
+            self.block_number += 1
+
+    def make_request(self, method, params):
+        with self.lock:
+            self.requests.append((method, params))
+            if method == "web3_clientVersion":
+                result = "Geth/v1.10.0"
+            elif method == "eth_getTransactionCount":
+                result = hex(self.tx_count)
+            elif method in ("eth_chainId", "net_version"):
+                result = "0x1"
+            elif method == "eth_gasPrice":
+                result = hex(10)
+            elif method == "eth_sendRawTransaction":
+                result = "0x" + keccak(HexBytes(params[0])).hex()
+                self.sent.append(result)
+            elif method == "eth_sendTransaction":
+                result = "0x" + format(len(self.sent) + 1, "064x")
+                self.sent.append(result)
+            elif method == "eth_blockNumber":
+                result = hex(self.block_number)
+            elif method == "eth_getTransactionByHash":
+                result = self.transactions.get(params[0]) or \
+                    ({'hash': params[0], 'from': ACCOUNT} if params[0] in self.sent else None)
+            elif method == "eth_getTransactionReceipt":
+                result = self.mined.get(params[0])
+            else:
+                return {'jsonrpc': "2.0", 'id': 1, 'error': {'code': -32601, 'message': f"Unknown method {method}"}}
+            return {'jsonrpc': "2.0", 'id': 1, 'result': result}
+
+    def methods(self, method: str) -> list:
+        return [params for request_method, params in self.requests if request_method == method]
+
+
+def transfer(web3: Web3, value: int) -> Transact:
+    return Transact(None, web3, None, OTHER_ADDRESS, None, None, None, {'value': value})
+
+
+def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        time.sleep(0.05)
+    raise TimeoutError()
+
+
+@pytest.mark.timeout(30)
+class TestTransactBatch:
+    def setup_method(self):
+        self.node = FakeNode()
+        self.web3 = Web3(self.node)
+        self.web3.eth.defaultAccount = ACCOUNT
+
+    def test_should_send_transactions_with_consecutive_nonces(self):
+        # given
+        transacts = [transfer(self.web3, value) for value in range(1, 4)]
+
+        # when
+        futures = submit_many(transacts, gas_price=FixedGasPrice(20))
+
+        # then
+        sent = self.node.methods("eth_sendTransaction")
+        assert [int(params[0]['nonce'], 16) for params in sent] == [7, 8, 9]
+        assert [int(params[0]['value'], 16) for params in sent] == [1, 2, 3]
+        assert all(int(params[0]['gasPrice'], 16) == 20 for params in sent)
+        assert [transact.nonce for transact in transacts] == [7, 8, 9]
+        assert all(transact.status == TransactStatus.IN_PROGRESS for transact in transacts)
+        assert not any(future.done() for future in futures)
+
+    def test_should_sign_locally_with_registered_key(self):
+        # given
+        register_private_key(self.web3, PRIVATE_KEY)
+        transacts = [transfer(self.web3, value) for value in range(1, 3)]
+
+        # when
+        submit_many(transacts)
+
+        # then
+        raw_transactions = self.node.methods("eth_sendRawTransaction")
+        assert len(raw_transactions) == 2
+        assert len(self.node.methods("eth_sendTransaction")) == 0
+        assert all(Account.recover_transaction(params[0]) == ACCOUNT for params in raw_transactions)
+        assert [transact.tx_hashes for transact in transacts] == [[tx_hash] for tx_hash in self.node.sent]
+
+    def test_should_resolve_futures_once_mined(self):
+        # given
+        transacts = [transfer(self.web3, value) for value in range(1, 4)]
+        batch = TransactBatch(self.web3, transacts)
+        futures = batch.submit()
+        tracker = ReceiptTracker(self.web3)
+        pending = [{'transact': transact, 'from': ACCOUNT, 'future': future, 'misses': 0}
+                   for transact, future in zip(transacts, futures)]
+        tracker.pending.extend(pending)
+
+        # when
+        self.node.mine()
+        tracker.poll(pending)
+
+        # then
+        receipts = [future.result(timeout=5) for future in futures]
+        assert [receipt.transaction_hash for receipt in receipts] == [HexBytes(tx_hash) for tx_hash in self.node.sent]
+        assert all(receipt.successful for receipt in receipts)
+        assert all(transact.status == TransactStatus.FINISHED for transact in transacts)
+
+    def test_should_resolve_futures_with_shared_tracker(self):
+        # given
+        transacts = [transfer(self.web3, value) for value in range(1, 3)]
+        futures = submit_many(transacts)
+
+        # when
+        self.node.mine()
+
+        # then
+        assert all(future.result(timeout=10) is not None for future in futures)
+
+    def test_should_not_send_transactions_failing_gas_estimation(self):
+        # given
+        class FailingTransact(Transact):
+            def estimated_gas(self, from_address):
+                raise ValueError("execution reverted")
+
+        transacts = [transfer(self.web3, 1),
+                     FailingTransact(None, self.web3, None, OTHER_ADDRESS, None, None, None, {'value': 2}),
+                     transfer(self.web3, 3)]
+
+        # when
+        futures = submit_many(transacts)
+
+        # then
+        assert futures[1].result(timeout=0) is None
+        sent = self.node.methods("eth_sendTransaction")
+        assert [int(params[0]['nonce'], 16) for params in sent] == [7, 8]
+        assert [int(params[0]['value'], 16) for params in sent] == [1, 3]
+
+    def test_should_send_type2_transactions(self):
+        # given
+        transacts = [transfer(self.web3, value) for value in range(1, 3)]
+
+        # when
+        submit_many(transacts, gas_price=FixedGasFees(200, 20))
+
+        # then
+        sent = self.node.methods("eth_sendTransaction")
+        assert all(params[0]['type'] == "0x2" for params in sent)
+        assert all(int(params[0]['maxFeePerGas'], 16) == 200 for params in sent)
+        assert all(int(params[0]['maxPriorityFeePerGas'], 16) == 20 for params in sent)
+        assert all('gasPrice' not in params[0] for params in sent)
+        assert all(transact.gas_fees_last == GasFees(200, 20) for transact in transacts)
+
+    def test_should_reject_unknown_kwargs(self):
+        with pytest.raises(ValueError):
+            TransactBatch(self.web3, [transfer(self.web3, 1)], replace=None)
+
+
+@pytest.mark.timeout(30)
+class TestType2Transact:
+    def setup_method(self):
+        self.node = FakeNode()
+        self.web3 = Web3(self.node)
+        self.web3.eth.defaultAccount = ACCOUNT
+
+    def run_in_background(self, function) -> list:
+        result = []
+        threading.Thread(target=lambda: result.append(function()), daemon=True).start()
+        return result
+
+    def test_should_replace_with_both_fees_bumped(self):
+        # given
+        gas_fees = FixedGasFees(200, 20)
+        result = self.run_in_background(lambda: transfer(self.web3, 1).transact(gas_price=gas_fees))
+        wait_for(lambda: len(self.node.sent) == 1)
+
+        # when the strategy raises the maximum fee only
+        gas_fees.update_gas_fees(300, 20)
+        wait_for(lambda: len(self.node.sent) == 2)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then the priority fee goes up by 10% as well, so the node accepts the replacement
+        sent = self.node.methods("eth_sendTransaction")
+        assert [(int(params[0]['maxFeePerGas'], 16), int(params[0]['maxPriorityFeePerGas'], 16)) for params in sent] \
+            == [(200, 20), (300, 22)]
+        assert sent[0][0]['nonce'] == sent[1][0]['nonce']
+        assert result[0] is not None
+
+    def test_should_sign_type2_transactions_locally(self):
+        # given
+        register_private_key(self.web3, PRIVATE_KEY)
+        result = self.run_in_background(lambda: transfer(self.web3, 1).transact(gas_price=FixedGasFees(200, 20)))
+
+        # when
+        wait_for(lambda: len(self.node.sent) == 1)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        raw_transaction = HexBytes(self.node.methods("eth_sendRawTransaction")[0][0])
+        assert raw_transaction[0] == 2
+        assert len(self.node.methods("eth_sendTransaction")) == 0
+        assert result[0] is not None
+
+    def test_should_cancel_recovered_transaction_with_bumped_fees(self):
+        # given
+        recovered = RecoveredTransact(self.web3, Address(ACCOUNT), nonce=6, latest_tx_hash="0x" + "cc" * 32,
+                                      current_gas=100, current_fees=GasFees(100, 10))
+
+        # when
+        result = self.run_in_background(lambda: recovered.cancel(FixedGasFees(50, 5)))
+        wait_for(lambda: len(self.node.sent) == 1)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        cancellation = self.node.methods("eth_sendTransaction")[0][0]
+        assert cancellation['type'] == "0x2"
+        assert (int(cancellation['maxFeePerGas'], 16), int(cancellation['maxPriorityFeePerGas'], 16)) == (110, 11)
+        assert int(cancellation['nonce'], 16) == 6
+        assert cancellation['to'] == ACCOUNT
+
+
+class SlowNode(FakeNode):
+    """Takes a while to answer every request, like a remote node would."""
+    def make_request(self, method, params):
+        time.sleep(0.05)
+        return super().make_request(method, params)
+
+
+@pytest.mark.timeout(30)
+class TestTransactAsync:
+    def test_should_not_block_the_event_loop(self):
+        # given
+        node = SlowNode()
+        web3 = Web3(node)
+        web3.eth.defaultAccount = ACCOUNT
+        ticks = []
+        threading.Thread(target=lambda: (wait_for(lambda: len(node.sent) == 3), node.mine()), daemon=True).start()
+
+        async def ticker(done: asyncio.Event):
+            while not done.is_set():
+                ticks.append(time.time())
+                await asyncio.sleep(0.01)
+
+        async def transact_all():
+            done = asyncio.Event()
+            ticking = asyncio.ensure_future(ticker(done))
+            receipts = await asyncio.gather(*[transfer(web3, value).transact_async(gas_price=FixedGasPrice(20))
+                                              for value in range(3)])
+            done.set()
+            await ticking
+            return receipts
+
+        # when
+        receipts = asyncio.new_event_loop().run_until_complete(transact_all())
+
+        # then other tasks kept running while the transactions were waiting for the node
+        assert all(receipt is not None for receipt in receipts)
+        assert max(later - earlier for earlier, later in zip(ticks, ticks[1:])) < 0.04
@@ -0,0 +1,383 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from unittest.mock import Mock, patch
+
+from eth_utils import keccak
+from hexbytes import HexBytes
+from web3 import Web3
+
+from pymaker import Address
+from pymaker.blocks import bloom_contains, BlockContext, BlockStream, LogTailer, WebsocketBlockSource
+
+
+VAT = Address("0x35d1b3f3d7966a1dfe207aa4514c12a259a0492b")
+CLIPPER = Address("0xc67963a226eddd77b91ad8c421630a1b0adff270")
+TAKE = bytes.fromhex("05e309fd6ce72f2ab888a20056bb4210df08daed86f21f95053deb19964d86b1")
+KICK = bytes.fromhex("7c5bfdc0a5e8192f6cd4972f382cec69116862fb62e6abff8003874c58e064b8")
+
+
+def make_bloom(*values) -> bytes:
+    bloom = 0
+    for value in values:
+        value_hash = keccak(value)
+        for index in (0, 2, 4):
+            bloom |= 1 << (int.from_bytes(value_hash[index:index+2], byteorder='big') % 2048)
+    return bloom.to_bytes(256, byteorder='big')
+
+
+def mocked_web3() -> Web3:
+    web3 = Mock(Web3)
+    web3.eth = Mock()
+    web3.eth.getLogs = Mock(return_value=[{'logIndex': 0}])
+    return web3
+
+
+def block(logs_bloom: bytes) -> dict:
+    return {'hash': bytes(32), 'number': 1, 'logsBloom': logs_bloom}
+
+
+class TestBloom:
+    def test_should_contain_added_values(self):
+        # given
+        bloom = make_bloom(VAT.as_bytes(), TAKE)
+
+        # expect
+        assert bloom_contains(bloom, VAT.as_bytes())
+        assert bloom_contains(bloom, TAKE)
+        assert bloom_contains("0x" + bloom.hex(), TAKE)
+
+    def test_should_not_contain_anything_when_empty(self):
+        # expect
+        assert not bloom_contains(bytes(256), VAT.as_bytes())
+        assert not bloom_contains(bytes(256), TAKE)
+
+
+class TestLogTailer:
+    def test_should_skip_blocks_without_tracked_address(self):
+        # given
+        web3 = mocked_web3()
+        tailer = LogTailer(web3, [CLIPPER])
+
+        # when
+        logs = tailer.logs(block(make_bloom(VAT.as_bytes(), TAKE)))
+
+        # then
+        assert logs == []
+        assert web3.eth.getLogs.call_count == 0
+        assert tailer.blocks_skipped == 1
+
+    def test_should_skip_blocks_without_tracked_topic(self):
+        # given
+        web3 = mocked_web3()
+        tailer = LogTailer(web3, [CLIPPER], [TAKE])
+
+        # when
+        logs = tailer.logs(block(make_bloom(CLIPPER.as_bytes(), KICK)))
+
+        # then
+        assert logs == []
+        assert web3.eth.getLogs.call_count == 0
+
+    def test_should_query_blocks_matching_the_bloom(self):
+        # given
+        web3 = mocked_web3()
+        tailer = LogTailer(web3, [VAT, CLIPPER], [TAKE])
+
+        # when
+        logs = tailer.logs(block(make_bloom(CLIPPER.as_bytes(), TAKE)))
+
+        # then
+        assert logs == [{'logIndex': 0}]
+        assert tailer.blocks_queried == 1
+        filter_params = web3.eth.getLogs.call_args[0][0]
+        assert filter_params['address'] == [VAT.address, CLIPPER.address]
+        assert filter_params['topics'] == [["0x" + TAKE.hex()]]
+
+
+class TestBlockContext:
+    def test_should_build_from_block(self):
+        # given
+        bloom = make_bloom(CLIPPER.as_bytes(), TAKE)
+        raw = {'number': 7, 'hash': HexBytes(bytes(31) + b'\x07'), 'parentHash': HexBytes(bytes(31) + b'\x06'),
+               'timestamp': 1600000007, 'baseFeePerGas': 1000000000, 'logsBloom': HexBytes(bloom)}
+
+        # when
+        context = BlockContext.from_block(raw)
+
+        # then
+        assert context.number == 7
+        assert context.block_identifier == 7
+        assert context.base_fee == 1000000000
+        assert context['parentHash'] == raw['parentHash']
+        assert context.get('transactions') is None
+
+    def test_should_have_no_base_fee_before_london(self):
+        # when
+        context = BlockContext.from_block({'number': 1, 'hash': bytes(32), 'parentHash': bytes(32),
+                                           'timestamp': 0, 'logsBloom': bytes(256)})
+
+        # then
+        assert context.base_fee is None
+
+    def test_should_be_accepted_by_log_tailer(self):
+        # given
+        web3 = mocked_web3()
+        tailer = LogTailer(web3, [CLIPPER], [TAKE])
+        context = BlockContext.from_block({'number': 1, 'hash': bytes(32), 'parentHash': bytes(32), 'timestamp': 0,
+                                           'logsBloom': make_bloom(CLIPPER.as_bytes(), TAKE)})
+
+        # expect
+        assert tailer.logs(context) == [{'logIndex': 0}]
+
+
+class MockChain:
+    """Builds blocks identified by (number, fork) pairs and serves them through a mocked web3."""
+    def __init__(self):
+        self.blocks = {}
+        self.web3 = Mock(Web3)
+        self.web3.eth = Mock()
+        self.web3.eth.getBlock = Mock(side_effect=lambda block_hash: self.blocks[HexBytes(block_hash)])
+
+    def block(self, number: int, fork: int = 0) -> dict:
+        parent = self.hash(number - 1, fork if self.hash(number - 1, fork) in self.blocks else 0)
+        block = {'number': number, 'hash': self.hash(number, fork), 'parentHash': parent, 'timestamp': number}
+        self.blocks[block['hash']] = block
+        return block
+
+    @staticmethod
+    def hash(number: int, fork: int) -> HexBytes:
+        return HexBytes(number.to_bytes(16, byteorder='big') + fork.to_bytes(16, byteorder='big'))
+
+
+class TestBlockStream:
+    def setup_method(self):
+        self.chain = MockChain()
+        self.stream = BlockStream(self.chain.web3, depth=4)
+        self.blocks = []
+        self.reorgs = []
+        self.stream.on_block(lambda block: self.blocks.append(block))
+        self.stream.on_reorg(lambda depth, orphaned: self.reorgs.append((depth, orphaned)))
+
+    def test_should_deliver_consecutive_blocks(self):
+        # when
+        for number in range(1, 4):
+            self.stream.process(self.chain.block(number))
+
+        # then
+        assert [block.number for block in self.blocks] == [1, 2, 3]
+        assert self.reorgs == []
+        assert self.stream.tip.number == 3
+
+    def test_should_ignore_duplicate_blocks(self):
+        # when
+        block = self.chain.block(1)
+        self.stream.process(block)
+        self.stream.process(block)
+
+        # then
+        assert len(self.blocks) == 1
+
+    def test_should_backfill_missed_blocks(self):
+        # given
+        self.stream.process(self.chain.block(1))
+        self.chain.block(2)
+        self.chain.block(3)
+
+        # when
+        self.stream.process(self.chain.block(4))
+
+        # then
+        assert [block.number for block in self.blocks] == [1, 2, 3, 4]
+        assert self.reorgs == []
+
+    def test_should_detect_reorg(self):
+        # given
+        for number in range(1, 5):
+            self.stream.process(self.chain.block(number))
+
+        # when
+        self.chain.block(3, fork=1)
+        self.chain.block(4, fork=1)
+        self.stream.process(self.chain.block(5, fork=1))
+
+        # then
+        assert len(self.reorgs) == 1
+        depth, orphaned = self.reorgs[0]
+        assert depth == 2
+        assert [block.number for block in orphaned] == [4, 3]
+        assert all(block.removed for block in orphaned)
+
+        # and
+        assert [block.number for block in self.blocks] == [1, 2, 3, 4, 3, 4, 5]
+        assert self.stream.tip.hash == MockChain.hash(5, 1)
+
+    def test_should_orphan_everything_on_reorg_deeper_than_tracked(self):
+        # given
+        for number in range(1, 7):
+            self.stream.process(self.chain.block(number))
+
+        # when
+        for number in range(1, 6):
+            self.chain.blocks[MockChain.hash(number, 1)] = {'number': number, 'hash': MockChain.hash(number, 1),
+                                                            'parentHash': MockChain.hash(number - 1, 1),
+                                                            'timestamp': number}
+        self.stream.process(self.chain.block(6, fork=1))
+
+        # then
+        depth, orphaned = self.reorgs[0]
+        assert depth == 4
+        assert [block.number for block in orphaned] == [6, 5, 4, 3]
+
+
+def raw_header(number: int) -> dict:
+    return {'number': hex(number), 'hash': "0x" + bytes(MockChain.hash(number, 0)).hex(),
+            'parentHash': "0x" + bytes(MockChain.hash(number - 1, 0)).hex(), 'timestamp': hex(1600000000 + number),
+            'logsBloom': "0x" + bytes(256).hex(), 'baseFeePerGas': "0x3b9aca00"}
+
+
+def raw_log(number: int, log_index: int = 0) -> dict:
+    return {'blockNumber': hex(number), 'blockHash': "0x" + bytes(MockChain.hash(number, 0)).hex(),
+            'logIndex': hex(log_index), 'topics': ["0x" + TAKE.hex()], 'removed': False}
+
+
+class FakeConnection:
+    """Answers `eth_subscribe` requests, then replays notifications and fails once they run out."""
+    def __init__(self, notifications: list, on_exhausted=None):
+        self.messages = []
+        self.notifications = notifications
+        self.on_exhausted = on_exhausted
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def send(self, message: str):
+        request = json.loads(message)
+        self.messages.append({'jsonrpc': "2.0", 'id': request['id'], 'result': request['params'][0]})
+
+    async def recv(self) -> str:
+        if self.messages:
+            return json.dumps(self.messages.pop(0))
+        if self.notifications:
+            subscription, result = self.notifications.pop(0)
+            return json.dumps({'jsonrpc': "2.0", 'method': "eth_subscription",
+                               'params': {'subscription': subscription, 'result': result}})
+        if self.on_exhausted:
+            self.on_exhausted()
+        raise ConnectionError("connection closed")
+
+
+class TestWebsocketBlockSource:
+    def setup_method(self):
+        self.chain = MockChain()
+        self.chain.web3.eth.getBlock = Mock(side_effect=lambda number: self.chain.block(number))
+        self.chain.web3.eth.getLogs = Mock(return_value=[{'logIndex': 0}])
+        self.source = WebsocketBlockSource(self.chain.web3, "ws://localhost:8546")
+        self.heads = []
+        self.logs = []
+        self.source.on_head(lambda header: self.heads.append(header))
+        self.source.subscribe_logs({'address': CLIPPER.address}, lambda log: self.logs.append(log))
+
+    def test_should_format_headers(self):
+        # when
+        self.source._handle_head(raw_header(5))
+
+        # then
+        header = self.heads[0]
+        assert header['number'] == 5
+        assert header['timestamp'] == 1600000005
+        assert header['hash'] == MockChain.hash(5, 0)
+        assert header['parentHash'] == MockChain.hash(4, 0)
+        assert header['baseFeePerGas'] == 1000000000
+        assert self.chain.web3.eth.getBlock.call_count == 0
+
+    def test_should_format_logs(self):
+        # given
+        handler = self.source._log_handler(lambda log: self.logs.append(log))
+
+        # when
+        handler({'blockNumber': "0x10", 'logIndex': "0x1", 'topics': ["0x" + TAKE.hex()],
+                 'transactionHash': "0x" + bytes(32).hex(), 'removed': True})
+
+        # then
+        assert self.logs[0]['blockNumber'] == 16
+        assert self.logs[0]['logIndex'] == 1
+        assert self.logs[0]['topics'] == [HexBytes(TAKE)]
+        assert self.logs[0]['removed']
+
+    def test_should_backfill_missed_heads_and_logs(self):
+        # given
+        self.source._handle_head(raw_header(1))
+
+        # when
+        self.source._handle_head(raw_header(4))
+
+        # then
+        assert [header['number'] for header in self.heads] == [1, 2, 3, 4]
+        assert self.chain.web3.eth.getLogs.call_args[0][0] == {'address': CLIPPER.address,
+                                                               'fromBlock': 2, 'toBlock': 3}
+        assert self.logs == [{'logIndex': 0}]
+
+    def test_should_skip_heads_and_logs_delivered_twice(self):
+        # given
+        self.chain.web3.eth.getLogs = Mock(return_value=[self.source._format_log(raw_log(2))])
+        self.source._handle_head(raw_header(1))
+
+        # when the log of block 2 is notified, then backfilled, and block 2 is notified after its backfill
+        self.source._log_handler(self.source.log_subscriptions[0][1])(raw_log(2))
+        self.source._handle_head(raw_header(3))
+        self.source._handle_head(raw_header(2))
+        self.source._handle_head(raw_header(3))
+
+        # then
+        assert [header['number'] for header in self.heads] == [1, 2, 3]
+        assert [(log['blockNumber'], log['logIndex']) for log in self.logs] == [(2, 0)]
+
+    def test_should_deliver_removed_logs(self):
+        # given
+        handler = self.source._log_handler(self.logs.append)
+        handler(raw_log(2))
+
+        # when
+        handler({**raw_log(2), 'removed': True})
+
+        # then
+        assert [log['removed'] for log in self.logs] == [False, True]
+
+    def test_should_not_deliver_anything_twice_after_reconnect(self):
+        # given the node advances to block 3 while disconnected, and notifies blocks 2 and 3 late
+        self.source.reconnect_delay = 0
+        self.chain.web3.eth.getLogs = Mock(return_value=[self.source._format_log(raw_log(2))])
+        first = FakeConnection([("newHeads", raw_header(1))],
+                               on_exhausted=lambda: setattr(self.chain.web3.eth, 'blockNumber', 3))
+        second = FakeConnection([("logs", raw_log(2)), ("newHeads", raw_header(2)), ("newHeads", raw_header(3)),
+                                 ("newHeads", raw_header(4))], on_exhausted=self.source.stop)
+        self.chain.web3.eth.blockNumber = 1
+
+        # when
+        with patch('websockets.connect', side_effect=[first, second]):
+            self.source.start().join(timeout=10)
+
+        # then
+        assert [header['number'] for header in self.heads] == [1, 2, 3, 4]
+        assert [(log['blockNumber'], log['logIndex']) for log in self.logs] == [(2, 0)]
+        assert self.chain.web3.eth.getLogs.call_args[0][0] == {'address': CLIPPER.address,
+                                                               'fromBlock': 2, 'toBlock': 3}
@@ -0,0 +1,192 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+import requests
+from web3 import Web3
+
+from pymaker.concurrency import AdaptiveConcurrency, block_chunks, concurrency_controller, is_throttled
+from pymaker.metrics import InMemoryMetrics
+
+
+def throttled_error(retry_after=None) -> requests.HTTPError:
+    response = Mock(status_code=429, headers={'Retry-After': retry_after} if retry_after is not None else {})
+    return requests.HTTPError("429 Too Many Requests", response=response)
+
+
+class TestIsThrottled:
+    def test_should_recognize_throttling(self):
+        assert is_throttled(throttled_error())
+        assert is_throttled(requests.Timeout())
+        assert is_throttled(ValueError({'code': -32005, 'message': "query returned more than 10000 results"}))
+        assert is_throttled(ValueError({'code': -32000, 'message': "daily request count exceeded, request rate limited"}))
+
+    def test_should_not_treat_other_errors_as_throttling(self):
+        assert not is_throttled(ValueError({'code': -32000, 'message': "execution reverted"}))
+        assert not is_throttled(requests.HTTPError("500", response=Mock(status_code=500)))
+        assert not is_throttled(Exception("failure"))
+
+
+@pytest.mark.timeout(30)
+class TestAdaptiveConcurrency:
+    def test_should_increase_limit_additively_on_success(self):
+        # given
+        controller = AdaptiveConcurrency(initial_limit=4)
+
+        # when
+        for _ in range(4):
+            controller.run(lambda: None)
+
+        # then
+        assert 4.9 < controller.limit < 5
+
+    def test_should_halve_limit_and_retry_when_throttled(self):
+        # given
+        metrics = InMemoryMetrics()
+        controller = AdaptiveConcurrency(initial_limit=8, metrics=metrics)
+        responses = [throttled_error(retry_after="0.01"), "result"]
+
+        def request():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        # when
+        result = controller.run(request)
+
+        # then
+        assert result == "result"
+        assert controller.throttled == 1
+        assert 4 <= controller.limit < 5
+        assert metrics.counter("pymaker_rpc_throttled_total") == 1
+
+    def test_should_decrease_limit_once_per_round_trip(self):
+        # given
+        controller = AdaptiveConcurrency(initial_limit=16)
+        controller._latencies.append(10.0)
+
+        # when
+        controller._on_throttled()
+        controller._on_throttled()
+        controller._on_throttled()
+
+        # then
+        assert controller.limit == 8
+        assert controller.throttled == 3
+
+    def test_should_give_up_after_max_retries(self):
+        # given
+        controller = AdaptiveConcurrency(initial_limit=2, max_retries=2)
+        calls = []
+
+        def request():
+            calls.append(1)
+            raise throttled_error(retry_after="0")
+
+        # when
+        with pytest.raises(requests.HTTPError):
+            controller.run(request)
+
+        # then
+        assert len(calls) == 3
+        assert controller.limit == 1
+
+    def test_should_raise_other_errors_straight_away(self):
+        # given
+        controller = AdaptiveConcurrency()
+        calls = []
+
+        def request():
+            calls.append(1)
+            raise ValueError({'code': -32000, 'message': "execution reverted"})
+
+        # when
+        with pytest.raises(ValueError):
+            controller.run(request)
+
+        # then
+        assert len(calls) == 1
+        assert controller.in_flight == 0
+
+    def test_should_lower_limit_when_latency_grows(self):
+        # given
+        controller = AdaptiveConcurrency(initial_limit=8)
+        for _ in range(20):
+            controller._on_success(0.01)
+        limit = controller.limit
+
+        # when
+        controller._on_success(0.1)
+
+        # then
+        assert controller.limit < limit
+
+    def test_should_map_within_limit_and_keep_order(self):
+        # given
+        controller = AdaptiveConcurrency(initial_limit=3, max_limit=3)
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def square(value):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return value * value
+
+        # when
+        results = controller.map(square, range(12))
+
+        # then
+        assert results == [value * value for value in range(12)]
+        assert running[1] == 3
+
+
+class TestConcurrencyController:
+    def test_should_share_controller_per_web3(self):
+        # given
+        web3 = Web3()
+        other_web3 = Web3()
+
+        # expect
+        assert concurrency_controller(web3) is concurrency_controller(web3)
+        assert concurrency_controller(web3) is not concurrency_controller(other_web3)
+
+    def test_should_use_installed_controller(self):
+        # given
+        web3 = Web3()
+        controller = AdaptiveConcurrency(initial_limit=2)
+
+        # when
+        controller.install(web3)
+
+        # then
+        assert concurrency_controller(web3) is controller
+
+
+class TestBlockChunks:
+    def test_should_split_block_range(self):
+        assert block_chunks(0, 10, 5) == [(0, 5), (5, 10), (10, 10)]
+        assert block_chunks(3, 3, 20000) == [(3, 3)]
+        assert block_chunks(100, 150, 20000) == [(100, 150)]
@@ -0,0 +1,185 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+from collections import Counter
+
+import pytest
+import rlp
+from eth_account import Account
+from hexbytes import HexBytes
+from web3 import Web3
+
+from pymaker import Address
+from pymaker.dispatcher import TransactDispatcher
+from pymaker.gas import FixedGasPrice
+from pymaker.keys import register_private_key, registered_addresses
+from tests.test_batch import ACCOUNT, FakeNode, transfer, wait_for
+
+PRIVATE_KEYS = ["0x" + digits * 32 for digits in ["21", "22", "23"]]
+ADDRESSES = [Address(Account.from_key(private_key).address) for private_key in PRIVATE_KEYS]
+
+
+@pytest.mark.timeout(30)
+class TestTransactDispatcher:
+    def setup_method(self):
+        self.node = FakeNode()
+        self.web3 = Web3(self.node)
+        self.web3.eth.defaultAccount = ACCOUNT
+        for private_key in PRIVATE_KEYS:
+            register_private_key(self.web3, private_key)
+        self.dispatcher = TransactDispatcher(self.web3)
+
+    def senders(self) -> list:
+        return [Address(Account.recover_transaction(params[0]))
+                for params in self.node.methods("eth_sendRawTransaction")]
+
+    def test_should_use_registered_accounts(self):
+        assert registered_addresses(self.web3) == ADDRESSES
+        assert self.dispatcher.accounts == ADDRESSES
+        assert registered_addresses(Web3(FakeNode())) == []
+
+        with pytest.raises(ValueError):
+            TransactDispatcher(Web3(FakeNode()))
+
+    def test_should_send_concurrent_transactions_from_different_accounts(self):
+        # given
+        results = []
+        for value in range(3):
+            transact = transfer(self.web3, value)
+            threading.Thread(target=lambda transact=transact: results.append(
+                self.dispatcher.transact(transact, gas_price=FixedGasPrice(20))), daemon=True).start()
+
+        # when
+        wait_for(lambda: len(self.node.sent) == 3)
+
+        # then
+        assert set(self.senders()) == set(ADDRESSES)
+        assert self.dispatcher.in_flight() == {address: 1 for address in ADDRESSES}
+
+        # when
+        self.node.mine()
+        wait_for(lambda: len(results) == 3)
+
+        # then
+        assert all(receipt is not None for receipt in results)
+        assert self.dispatcher.in_flight() == {address: 0 for address in ADDRESSES}
+
+    def test_should_respect_from_address(self):
+        # when
+        futures = self.dispatcher.submit_many([transfer(self.web3, value) for value in range(3)],
+                                              from_address=ADDRESSES[1])
+
+        # then
+        assert self.senders() == [ADDRESSES[1]] * 3
+        assert self.dispatcher.in_flight()[ADDRESSES[1]] == 3
+
+        # when the next transactions go to the other accounts first
+        self.dispatcher.submit_many([transfer(self.web3, value) for value in range(4)])
+
+        # then
+        assert Counter(self.senders()[3:]) == {ADDRESSES[0]: 2, ADDRESSES[2]: 2}
+
+        # when
+        self.node.mine()
+
+        # then
+        assert all(future.result(timeout=10) is not None for future in futures)
+
+    def test_should_send_replacements_from_the_account_of_the_replaced_transaction(self):
+        # given the replaced transaction has been sent from the busiest account
+        transacts = [transfer(self.web3, value) for value in range(2)]
+        self.dispatcher.submit_many(transacts, from_address=ADDRESSES[1], gas_price=FixedGasPrice(20))
+        result = []
+
+        # when
+        replacement = transfer(self.web3, 5)
+        threading.Thread(target=lambda: result.append(
+            self.dispatcher.transact(replacement, replace=transacts[1], gas_price=FixedGasPrice(30))),
+            daemon=True).start()
+        wait_for(lambda: len(self.node.sent) == 3)
+
+        # then
+        raw_transactions = [params[0] for params in self.node.methods("eth_sendRawTransaction")]
+        assert self.senders()[2] == ADDRESSES[1]
+        assert rlp.decode(HexBytes(raw_transactions[2]))[0] == rlp.decode(HexBytes(raw_transactions[1]))[0]
+        assert self.dispatcher.in_flight()[ADDRESSES[1]] == 3
+
+        # when
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        assert result[0] is not None
+
+    def test_should_not_replace_from_another_account(self):
+        # given
+        transact = transfer(self.web3, 1)
+        self.dispatcher.submit_many([transact], from_address=ADDRESSES[1])
+
+        # expect
+        with pytest.raises(ValueError):
+            self.dispatcher.transact(transfer(self.web3, 2), replace=transact, from_address=ADDRESSES[0])
+        with pytest.raises(ValueError):
+            self.dispatcher.transact(transfer(self.web3, 2), replace=transfer(self.web3, 3))
+        assert self.dispatcher.in_flight() == {ADDRESSES[0]: 0, ADDRESSES[1]: 1, ADDRESSES[2]: 0}
+
+    def test_should_spread_batches_over_accounts(self):
+        # when
+        futures = self.dispatcher.submit_many([transfer(self.web3, value) for value in range(6)])
+
+        # then
+        assert Counter(self.senders()) == {address: 2 for address in ADDRESSES}
+
+        # when
+        self.node.mine()
+
+        # then
+        assert all(future.result(timeout=10) is not None for future in futures)
+        wait_for(lambda: self.dispatcher.in_flight() == {address: 0 for address in ADDRESSES})
+
+    def test_should_release_accounts_if_a_batch_can_not_be_submitted(self):
+        # given
+        executed = transfer(self.web3, 1)
+        self.dispatcher.submit_many([executed], from_address=ADDRESSES[0])
+
+        # when
+        with pytest.raises(Exception):
+            self.dispatcher.submit_many([transfer(self.web3, value) for value in range(2)] + [executed],
+                                        from_address=ADDRESSES[1])
+        with pytest.raises(ValueError):
+            self.dispatcher.submit_many([transfer(self.web3, value) for value in range(3)], unknown=1)
+
+        # then
+        assert self.dispatcher.in_flight() == {ADDRESSES[0]: 1, ADDRESSES[1]: 0, ADDRESSES[2]: 0}
+
+    def test_should_isolate_stuck_accounts(self):
+        # given the transaction sent from the first account has been pending for a long time
+        stuck = transfer(self.web3, 1)
+        self.dispatcher.submit_many([stuck], from_address=ADDRESSES[0])
+        stuck.initial_time = time.time() - 3600
+        self.dispatcher.submit_many([transfer(self.web3, value) for value in range(2)],
+                                    from_address=ADDRESSES[1])
+
+        # when
+        self.dispatcher.submit_many([transfer(self.web3, value) for value in range(4)])
+
+        # then
+        assert self.dispatcher.is_stuck(ADDRESSES[0])
+        assert Counter(self.senders()[3:]) == {ADDRESSES[1]: 1, ADDRESSES[2]: 3}
@@ -509,6 +509,14 @@ class TestVat:
         assert logmove.dst == other_address
         assert logmove.dart == Rad.from_number(30)
 
+        # confirm the deployment-wide sweep dispatches the same log to the vat
+        sweep = mcd.past_logs(from_block)
+        assert mcd.vat.address in sweep
+        assert mcd.jug.address in sweep
+        assert len(sweep[mcd.vat.address]) == len(logs)
+        assert isinstance(sweep[mcd.vat.address][0], Vat.LogMove)
+        assert sweep[mcd.vat.address][0].tx_hash == logmove.tx_hash
+
         # rollback
         cleanup_urn(mcd, collateral, our_address)
 
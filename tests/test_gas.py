@@ -15,11 +15,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+
 import pytest
 from typing import Optional
 from web3 import Web3
+from web3.providers import BaseProvider
 
-from pymaker.gas import DefaultGasPrice, FixedGasPrice, GasPrice, GeometricGasPrice, IncreasingGasPrice, NodeAwareGasPrice
+from pymaker.gas import DefaultGasPrice, FeeHistoryGasPrice, FixedGasFees, FixedGasPrice, GasFees, GasLimitModel, \
+    GasPrice, gas_price_feed, GasPriceFeed, GeometricGasPrice, IncreasingGasPrice, NodeAwareGasPrice
 from tests.conftest import web3
 
 
@@ -241,3 +245,346 @@ class TestGeometricGasPrice:
     def test_max_price_should_exceed_initial_price(self):
         with pytest.raises(AssertionError):
             GeometricGasPrice(6000, 30, 2.25, 5000)
+
+
+class TestGasFees:
+    def test_should_not_be_provided_by_legacy_strategies(self):
+        assert DefaultGasPrice().get_gas_fees(0) is None
+        assert FixedGasPrice(20).get_gas_fees(0) is None
+
+    def test_should_replace_only_if_both_fees_increase_by_ten_percent(self):
+        # given
+        previous = GasFees(100, 10)
+
+        # expect
+        assert GasFees(110, 11).replaces(previous)
+        assert not GasFees(200, 10).replaces(previous)
+        assert not GasFees(109, 20).replaces(previous)
+
+    def test_should_exceed_if_either_fee_increases_by_ten_percent(self):
+        # given
+        previous = GasFees(100, 10)
+
+        # expect
+        assert GasFees(110, 10).exceeds(previous)
+        assert GasFees(100, 11).exceeds(previous)
+        assert not GasFees(109, 10).exceeds(previous)
+
+    def test_should_bump_both_fees_enough_for_a_replacement(self):
+        # given
+        previous = GasFees(100, 10)
+
+        # when
+        bumped = GasFees(200, 10).bumped_from(previous)
+
+        # then
+        assert bumped == GasFees(200, 11)
+        assert bumped.replaces(previous)
+
+    def test_should_keep_priority_fee_below_max_fee(self):
+        with pytest.raises(AssertionError):
+            GasFees(10, 11)
+
+        assert GasFees(10, 5).bumped_from(GasFees(10, 10)) == GasFees(11, 11)
+
+    def test_should_provide_type2_transaction_params(self):
+        assert GasFees(100, 10).transaction_params() == {'type': 2, 'maxFeePerGas': 100, 'maxPriorityFeePerGas': 10}
+
+
+class TestFixedGasFees:
+    def test_gas_fees_should_be_updated_by_update_gas_fees_method(self):
+        # given
+        fixed_gas_fees = FixedGasFees(200, 20)
+
+        # expect
+        assert fixed_gas_fees.get_gas_fees(0) == GasFees(200, 20)
+        assert fixed_gas_fees.get_gas_fees(3600) == GasFees(200, 20)
+        assert fixed_gas_fees.get_gas_price(0) == 200
+
+        # when
+        fixed_gas_fees.update_gas_fees(300, 30)
+
+        # then
+        assert fixed_gas_fees.get_gas_fees(0) == GasFees(300, 30)
+
+
+class FeeHistoryNode(BaseProvider):
+    def __init__(self, base_fees: list = (10,), rewards: list = (), gas_used_ratios: list = ()):
+        self.history = {'oldestBlock': hex(100),
+                        'baseFeePerGas': [hex(base_fee) for base_fee in base_fees],
+                        'reward': [[hex(reward)] for reward in rewards],
+                        'gasUsedRatio': list(gas_used_ratios)}
+        self.block_number = 100
+        self.gas_price = 20 * GasPrice.GWEI
+        self.requests = []
+
+    def make_request(self, method, params):
+        self.requests.append((method, params))
+        if method == "eth_feeHistory":
+            return {'jsonrpc': "2.0", 'id': 1, 'result': self.history}
+        elif method == "eth_gasPrice":
+            return {'jsonrpc': "2.0", 'id': 1, 'result': hex(self.gas_price)}
+        elif method == "eth_blockNumber":
+            return {'jsonrpc': "2.0", 'id': 1, 'result': hex(self.block_number)}
+        return {'jsonrpc': "2.0", 'id': 1, 'error': {'code': -32601, 'message': f"Unknown method {method}"}}
+
+    def methods(self, method: str) -> list:
+        return [params for request_method, params in self.requests if request_method == method]
+
+
+def web3_with_feed(node: BaseProvider) -> Web3:
+    # the background refresh is left to the tests of `GasPriceFeed`
+    web3 = Web3(node)
+    GasPriceFeed(web3, poll_interval=3600).install()
+    return web3
+
+
+class TestGasPriceFeed:
+    def test_should_request_once_until_next_block(self):
+        # given
+        node = FeeHistoryNode()
+        feed = GasPriceFeed(Web3(node), poll_interval=3600)
+
+        # when
+        gas_prices = [feed.gas_price() for _ in range(10)]
+        feed.refresh()
+        feed.refresh()
+
+        # then
+        assert gas_prices == [20 * GasPrice.GWEI] * 10
+        assert len(node.methods("eth_gasPrice")) == 2
+        assert feed.block_number == 100
+
+    def test_should_refresh_on_new_block(self):
+        # given
+        node = FeeHistoryNode()
+        feed = GasPriceFeed(Web3(node), poll_interval=3600)
+        feed.gas_price()
+        feed.fee_history(20, 50)
+        feed.refresh()
+
+        # when
+        node.gas_price = 30 * GasPrice.GWEI
+        node.block_number = 101
+        feed.refresh()
+
+        # then
+        assert feed.gas_price() == 30 * GasPrice.GWEI
+        assert len(node.methods("eth_gasPrice")) == 3
+        assert len(node.methods("eth_feeHistory")) == 3
+
+    def test_should_refresh_stale_values_without_new_blocks(self):
+        # given
+        node = FeeHistoryNode()
+        feed = GasPriceFeed(Web3(node), poll_interval=3600, max_age=0.01)
+        feed.gas_price()
+        feed.refresh()
+
+        # when
+        node.gas_price = 30 * GasPrice.GWEI
+        time.sleep(0.02)
+        feed.refresh()
+
+        # then
+        assert feed.gas_price() == 30 * GasPrice.GWEI
+
+    def test_should_refresh_in_background(self):
+        # given
+        node = FeeHistoryNode()
+        feed = GasPriceFeed(Web3(node), poll_interval=0.01)
+        assert feed.gas_price() == 20 * GasPrice.GWEI
+
+        # when
+        node.gas_price = 30 * GasPrice.GWEI
+        node.block_number = 101
+        for _ in range(100):
+            if feed.block_number == 101:
+                break
+            time.sleep(0.01)
+
+        # then
+        assert feed.gas_price() == 30 * GasPrice.GWEI
+
+    def test_should_stop_background_refresh_when_idle(self):
+        # given
+        feed = GasPriceFeed(Web3(FeeHistoryNode()), poll_interval=0.01, idle_secs=0.02)
+        feed.gas_price()
+
+        # when
+        for _ in range(100):
+            if feed._thread is None:
+                break
+            time.sleep(0.01)
+
+        # then
+        assert feed._thread is None
+
+    def test_should_not_return_stale_values_after_being_idle(self):
+        # given
+        node = FeeHistoryNode()
+        feed = GasPriceFeed(Web3(node), poll_interval=0.01, idle_secs=0.02)
+        assert feed.gas_price() == 20 * GasPrice.GWEI
+        for _ in range(100):
+            if feed._thread is None:
+                break
+            time.sleep(0.01)
+
+        # when
+        node.gas_price = 30 * GasPrice.GWEI
+
+        # then
+        assert feed.gas_price() == 30 * GasPrice.GWEI
+
+    def test_should_not_return_values_older_than_max_age(self):
+        # given
+        node = FeeHistoryNode()
+        feed = GasPriceFeed(Web3(node), poll_interval=3600, max_age=0.01)
+        assert feed.gas_price() == 20 * GasPrice.GWEI
+
+        # when no refresh happens in the meantime
+        node.gas_price = 30 * GasPrice.GWEI
+        time.sleep(0.02)
+
+        # then
+        assert feed.gas_price() == 30 * GasPrice.GWEI
+
+    def test_should_be_shared_by_node_aware_strategies(self):
+        # given
+        node = FeeHistoryNode()
+        web3 = web3_with_feed(node)
+        strategies = [TestNodeAwareGasPrice.DumbSampleImplementation(web3) for _ in range(3)]
+
+        # when
+        gas_prices = [strategy.get_gas_price(0) for strategy in strategies for _ in range(10)]
+
+        # then
+        assert gas_prices == [20 * GasPrice.GWEI] * 30
+        assert len(node.methods("eth_gasPrice")) == 1
+        assert gas_price_feed(web3) is gas_price_feed(web3)
+
+
+class TestFeeHistoryGasPrice:
+    GWEI = GasPrice.GWEI
+
+    def node(self) -> FeeHistoryNode:
+        # the last base fee is the one of the next block, the empty block does not count towards the priority fee
+        return FeeHistoryNode(base_fees=[90 * self.GWEI, 95 * self.GWEI, 100 * self.GWEI, 100 * self.GWEI],
+                              rewards=[2 * self.GWEI, 50 * self.GWEI, 3 * self.GWEI],
+                              gas_used_ratios=[0.4, 0.0, 0.6])
+
+    def test_should_derive_fees_from_fee_history(self):
+        # given
+        node = self.node()
+        strategy = FeeHistoryGasPrice(web3_with_feed(node), reward_percentile=60, block_count=3)
+
+        # when
+        gas_fees = strategy.get_gas_fees(0)
+
+        # then
+        assert gas_fees == GasFees(203 * self.GWEI, 3 * self.GWEI)
+        assert strategy.get_gas_price(0) == 203 * self.GWEI
+        assert node.requests == [("eth_feeHistory", ["0x3", "latest", [60]])]
+
+    def test_should_cache_fee_history(self):
+        # given
+        node = self.node()
+        strategy = FeeHistoryGasPrice(web3_with_feed(node))
+
+        # when
+        for seconds_elapsed in range(0, 100, 10):
+            strategy.get_gas_fees(seconds_elapsed)
+
+        # then
+        assert len(node.requests) == 1
+
+    def test_should_increase_fees_with_time(self):
+        # given
+        strategy = FeeHistoryGasPrice(web3_with_feed(self.node()), every_secs=30, coefficient=1.2)
+        initial = strategy.get_gas_fees(0)
+
+        # expect
+        assert strategy.get_gas_fees(29) == initial
+        assert strategy.get_gas_fees(30).replaces(initial)
+        assert strategy.get_gas_fees(60) == GasFees(int(initial.max_fee * 1.44), int(initial.max_priority_fee * 1.44))
+
+    def test_should_obey_max_fee(self):
+        # given
+        strategy = FeeHistoryGasPrice(web3_with_feed(self.node()), every_secs=30, max_fee=250 * self.GWEI)
+
+        # expect
+        assert strategy.get_gas_fees(0).max_fee == 203 * self.GWEI
+        assert strategy.get_gas_fees(3600).max_fee == 250 * self.GWEI
+        assert strategy.get_gas_fees(3600).max_priority_fee <= 250 * self.GWEI
+
+    def test_should_use_minimum_priority_fee_when_blocks_are_empty(self):
+        # given
+        node = FeeHistoryNode(base_fees=[10, 10], rewards=[0], gas_used_ratios=[0.0])
+        strategy = FeeHistoryGasPrice(web3_with_feed(node), min_priority_fee=self.GWEI)
+
+        # expect
+        assert strategy.get_gas_fees(0) == GasFees(20 + self.GWEI, self.GWEI)
+
+    def test_should_require_coefficient_allowing_replacements(self):
+        with pytest.raises(AssertionError):
+            FeeHistoryGasPrice(web3_with_feed(self.node()), coefficient=1.05)
+
+
+class TestGasLimitModel:
+    ADDRESS = "0x50ff810797f75f6bfbf2227442e0c961a8562f4c"
+
+    def test_should_not_provide_gas_limit_without_enough_samples(self):
+        # given
+        model = GasLimitModel(min_samples=3)
+        model.record(self.ADDRESS, "bark", 100000)
+        model.record(self.ADDRESS, "bark", 100000)
+
+        # expect
+        assert model.gas_limit(self.ADDRESS, "bark") is None
+
+    def test_should_provide_high_quantile_with_margin(self):
+        # given
+        model = GasLimitModel(quantile=0.9, margin=1.5, min_samples=10)
+        for gas_used in range(100000, 200000, 10000):
+            model.record(self.ADDRESS, "take(bytes32,uint256,uint256,address,bytes)", gas_used)
+
+        # expect
+        assert model.gas_limit(self.ADDRESS.upper().replace("0X", "0x"), "take") == 190000 * 1.5
+        assert model.gas_limit("0x9596c16d7bf9323265c2f2e22f43e6c80eb3d943", "take") is None
+
+    def test_should_only_model_known_functions(self):
+        # given
+        model = GasLimitModel(functions=['bark'], min_samples=1)
+        model.record(self.ADDRESS, "approve", 50000)
+        model.record(self.ADDRESS, "bark", 50000)
+
+        # expect
+        assert model.gas_limit(self.ADDRESS, "approve") is None
+        assert model.gas_limit(self.ADDRESS, None) is None
+        assert model.gas_limit(self.ADDRESS, "bark") == 62500
+
+    def test_should_keep_recent_samples_only(self):
+        # given
+        model = GasLimitModel(quantile=1.0, margin=1.0, min_samples=2, window=2)
+
+        # when
+        for gas_used in [300000, 100000, 110000]:
+            model.record(self.ADDRESS, "bark", gas_used)
+
+        # then
+        assert model.gas_limit(self.ADDRESS, "bark") == 110000
+
+    def test_should_learn_from_background_estimates(self):
+        # given
+        model = GasLimitModel(quantile=1.0, margin=1.0, min_samples=1)
+        model.record(self.ADDRESS, "bark", 100000)
+
+        # when
+        model.validate_in_background(self.ADDRESS, "bark", 100000, lambda: 120000)
+        for _ in range(100):
+            if model.underestimates > 0:
+                break
+            time.sleep(0.01)
+
+        # then
+        assert model.underestimates == 1
+        assert model.gas_limit(self.ADDRESS, "bark") == 120000
@@ -0,0 +1,267 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import threading
+
+import pytest
+from web3 import Web3
+
+from pymaker import Address, RecoveredTransact, Transact
+from pymaker.batch import submit_many
+from pymaker.gas import FixedGasFees, FixedGasPrice, GasFees
+from pymaker.journal import TransactionJournal
+from pymaker.keys import register_private_key
+from tests.test_batch import ACCOUNT, FakeNode, OTHER_ADDRESS, PRIVATE_KEY, transfer, wait_for
+
+
+def sent_record(nonce: int, tx_hash: str, gas_price: int = 20) -> dict:
+    return {'event': 'sent', 'time': 0, 'from': ACCOUNT, 'nonce': nonce, 'txHash': tx_hash,
+            'transaction': {'to': OTHER_ADDRESS.address, 'data': "0x1234", 'value': 5, 'gas': 50000,
+                            'gasPrice': gas_price}}
+
+
+class BroadcastCheckingNode(FakeNode):
+    """Captures what the journal holds at the time of every raw transaction broadcast, failing them if asked to."""
+    def __init__(self, journal: TransactionJournal, fail: bool = False):
+        super().__init__()
+        self.journal = journal
+        self.fail = fail
+        self.pending_at_broadcast = []
+
+    def make_request(self, method, params):
+        if method == "eth_sendRawTransaction":
+            self.pending_at_broadcast.append(self.journal.pending())
+            if self.fail:
+                return {'jsonrpc': "2.0", 'id': 1, 'error': {'code': -32000, 'message': "nonce too low"}}
+        return super().make_request(method, params)
+
+
+@pytest.mark.timeout(30)
+class TestTransactionJournal:
+    def setup_method(self):
+        self.node = FakeNode()
+        self.web3 = Web3(self.node)
+        self.web3.eth.defaultAccount = ACCOUNT
+
+    @pytest.fixture(autouse=True)
+    def journal(self, tmpdir):
+        self.path = str(tmpdir.join("journal.jsonl"))
+        self.journal = TransactionJournal(self.path)
+        Transact.journal = self.journal
+        yield
+        Transact.journal = None
+
+    def write(self, records: list):
+        with open(self.path, 'a') as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+
+    def test_should_record_transactions_until_finished(self):
+        # given
+        transact = transfer(self.web3, 5)
+        result = []
+
+        # when
+        threading.Thread(target=lambda: result.append(transact.transact(gas_price=FixedGasPrice(20))),
+                         daemon=True).start()
+        wait_for(lambda: len(self.node.sent) == 1)
+
+        # then
+        pending = self.journal.pending()
+        assert len(pending) == 1
+        assert pending[0]['nonce'] == 7
+        assert pending[0]['txHash'] == self.node.sent[0]
+        assert pending[0]['transaction'] == {'to': OTHER_ADDRESS.address, 'value': 5, 'gas': 121000, 'gasPrice': 20}
+
+        # when
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        assert self.journal.pending() == []
+
+    def test_should_record_batches(self):
+        # when
+        futures = submit_many([transfer(self.web3, value) for value in range(1, 4)],
+                              gas_price=FixedGasFees(200, 20))
+
+        # then
+        assert [record['nonce'] for record in self.journal.pending()] == [7, 8, 9]
+        assert all(record['transaction']['maxFeePerGas'] == 200 for record in self.journal.pending())
+
+        # when
+        self.node.mine()
+        assert all(future.result(timeout=10) is not None for future in futures)
+
+        # then
+        assert self.journal.pending() == []
+
+    def test_should_record_locally_signed_transactions_before_broadcast(self):
+        # given
+        node = BroadcastCheckingNode(self.journal)
+        web3 = Web3(node)
+        web3.eth.defaultAccount = ACCOUNT
+        register_private_key(web3, PRIVATE_KEY)
+        result = []
+
+        # when
+        threading.Thread(target=lambda: result.append(transfer(web3, 5).transact(gas_price=FixedGasPrice(20))),
+                         daemon=True).start()
+        wait_for(lambda: len(node.sent) == 1)
+
+        # then
+        assert [record['txHash'] for record in node.pending_at_broadcast[0]] == node.sent
+        assert [record['txHash'] for record in self.journal.pending()] == node.sent
+
+        # when
+        node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        assert self.journal.pending() == []
+
+    def test_should_forget_transactions_which_could_not_be_broadcast(self):
+        # given
+        node = BroadcastCheckingNode(self.journal, fail=True)
+        web3 = Web3(node)
+        web3.eth.defaultAccount = ACCOUNT
+        register_private_key(web3, PRIVATE_KEY)
+
+        # when
+        futures = submit_many([transfer(web3, 5)], gas_price=FixedGasPrice(20))
+
+        # then
+        with pytest.raises(Exception):
+            futures[0].result(timeout=10)
+        assert len(node.pending_at_broadcast[0]) == 1
+        assert self.journal.pending() == []
+        assert TransactionJournal(self.path).pending() == []
+
+    def test_should_compact_periodically(self):
+        # given
+        journal = TransactionJournal(self.path, compact_every=4)
+        for nonce in range(7, 10):
+            journal.record_sent(ACCOUNT, nonce, "0x" + format(nonce, "02x") * 32, sent_record(nonce, "")['transaction'])
+
+        # when
+        journal.record_finished(["0x" + "07" * 32])
+        journal.record_finished(["0x" + "08" * 32])
+
+        # then
+        with open(self.path) as file:
+            assert len(file.readlines()) == 1
+        assert [record['nonce'] for record in journal.pending()] == [9]
+        assert [record['nonce'] for record in TransactionJournal(self.path).pending()] == [9]
+
+    def test_should_keep_last_transaction_of_each_nonce(self):
+        # given
+        self.write([sent_record(7, "0x" + "01" * 32),
+                    sent_record(7, "0x" + "02" * 32, gas_price=30),
+                    sent_record(8, "0x" + "03" * 32),
+                    sent_record(9, "0x" + "04" * 32),
+                    {'event': 'finished', 'time': 0, 'txHashes': ["0x" + "03" * 32]}])
+        with open(self.path, 'a') as file:
+            file.write('{"event": "sent", "fr')
+
+        # when
+        pending = self.journal.pending()
+
+        # then
+        assert [(record['nonce'], record['txHash']) for record in pending] == [(7, "0x" + "02" * 32),
+                                                                               (9, "0x" + "04" * 32)]
+
+    def test_should_recover_pending_transactions_and_compact(self):
+        # given nonce 6 has been mined already
+        self.write([sent_record(6, "0x" + "01" * 32), sent_record(7, "0x" + "02" * 32, gas_price=30)])
+
+        # when
+        recovered = self.journal.recover(self.web3)
+
+        # then
+        assert len(recovered) == 1
+        assert isinstance(recovered[0], RecoveredTransact)
+        assert recovered[0].nonce == 7
+        assert recovered[0].address == Address(ACCOUNT)
+        assert recovered[0].current_gas == 30
+        assert recovered[0].tx_hashes == ["0x" + "02" * 32]
+        assert recovered[0].transaction == {'to': OTHER_ADDRESS.address, 'data': "0x1234", 'value': 5, 'gas': 50000}
+        assert [record['nonce'] for record in self.journal.pending()] == [7]
+        with open(self.path) as file:
+            assert len(file.readlines()) == 1
+
+    def test_should_recover_type2_fees(self):
+        # given
+        record = sent_record(7, "0x" + "02" * 32)
+        del record['transaction']['gasPrice']
+        record['transaction'].update({'maxFeePerGas': 200, 'maxPriorityFeePerGas': 20})
+        self.write([record])
+
+        # when
+        recovered = self.journal.recover(self.web3)
+
+        # then
+        assert recovered[0].current_fees == GasFees(200, 20)
+        assert recovered[0].current_gas == 200
+
+    def test_should_resubmit_recovered_transaction(self):
+        # given
+        self.write([sent_record(7, "0x" + "02" * 32, gas_price=20)])
+        recovered = self.journal.recover(self.web3)[0]
+        result = []
+
+        # when
+        threading.Thread(target=lambda: result.append(recovered.transact(gas_price=FixedGasPrice(40))),
+                         daemon=True).start()
+        wait_for(lambda: len(self.node.sent) == 1)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        resubmitted = self.node.methods("eth_sendTransaction")[0][0]
+        assert int(resubmitted['nonce'], 16) == 7
+        assert int(resubmitted['gasPrice'], 16) == 40
+        assert int(resubmitted['gas'], 16) == 50000
+        assert int(resubmitted['value'], 16) == 5
+        assert resubmitted['data'] == "0x1234"
+        assert resubmitted['to'].lower() == OTHER_ADDRESS.address.lower()
+        assert result[0] is not None
+        assert self.journal.pending() == []
+
+    def test_should_not_resubmit_until_gas_price_is_high_enough(self):
+        # given
+        self.write([sent_record(7, "0x" + "02" * 32, gas_price=20)])
+        recovered = self.journal.recover(self.web3)[0]
+        result = []
+
+        # when
+        threading.Thread(target=lambda: result.append(recovered.transact(gas_price=FixedGasPrice(21))),
+                         daemon=True).start()
+        self.node.tx_count += 1
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        assert self.node.methods("eth_sendTransaction") == []
+
+    def test_should_not_resubmit_without_transaction_data(self):
+        # given
+        recovered = RecoveredTransact(self.web3, Address(ACCOUNT), 7, "0x" + "02" * 32, 20)
+
+        # expect
+        with pytest.raises(NotImplementedError):
+            recovered.transact()
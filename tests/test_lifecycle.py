@@ -15,17 +15,21 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import time
 from threading import Event
 from unittest.mock import Mock
 
 import pytest
+from hexbytes import HexBytes
 from mock import MagicMock
 from web3 import Web3, HTTPProvider
 
 import pymaker
 from pymaker import Address
-from pymaker.lifecycle import Lifecycle, trigger_event
+from pymaker.blocks import LogTailer
+from pymaker.lifecycle import AsyncLifecycle, Lifecycle, trigger_event
+from tests.test_blocks import CLIPPER, make_bloom, MockChain
 
 
 @pytest.mark.timeout(60)
@@ -371,3 +375,184 @@ class TestLifecycle:
                 lifecycle.on_event(Event(), 1, event_callback_1)
                 lifecycle.on_event(Event(), 1, event_callback_2)
                 lifecycle.on_shutdown(shutdown_callback)  # assertions are in `shutdown_callback`
+
+
+class TestBlockCallbackArguments:
+    def test_should_detect_callbacks_accepting_block_context(self):
+        class Keeper:
+            def with_context(self, context):
+                pass
+
+            def without_context(self):
+                pass
+
+        # expect
+        assert Lifecycle._accepts_argument(Keeper().with_context)
+        assert Lifecycle._accepts_argument(lambda *args: None)
+        assert not Lifecycle._accepts_argument(Keeper().without_context)
+        assert not Lifecycle._accepts_argument(lambda force=False: None)
+
+
+class TestAsyncLifecycle:
+    def test_should_run_every_callbacks_on_one_loop(self):
+        # given
+        ordering = []
+
+        async def startup():
+            ordering.append('STARTUP')
+
+        async def every_callback():
+            ordering.append('EVERY')
+            await asyncio.sleep(0.1)
+            lifecycle.terminate("Unit test is over")
+
+        def shutdown():
+            ordering.append('SHUTDOWN')
+
+        lifecycle = AsyncLifecycle()
+        lifecycle.on_startup(startup)
+        lifecycle.every(1, every_callback)
+        lifecycle.on_shutdown(shutdown)
+
+        # when
+        with pytest.raises(SystemExit):
+            lifecycle.run()
+
+        # then
+        assert ordering == ['STARTUP', 'EVERY', 'SHUTDOWN']
+        assert lifecycle.terminated_internally
+
+    def test_should_pass_block_context_to_block_callbacks(self):
+        # given
+        blocks = []
+
+        async def get_block(block_identifier):
+            return {'number': 12, 'hash': bytes(32), 'parentHash': bytes(32), 'timestamp': 0,
+                    'logsBloom': bytes(256)}
+
+        async def syncing():
+            return False
+
+        async def on_block(context):
+            blocks.append(context)
+
+        async def poll_twice():
+            await lifecycle._poll_block()
+            await lifecycle._poll_block()
+            await lifecycle._tasks['block']
+
+        lifecycle = AsyncLifecycle(Web3(HTTPProvider("http://localhost:8555")))
+        lifecycle.rpc = Mock(get_block=get_block, syncing=syncing)
+        lifecycle.on_block(on_block)
+
+        # when
+        asyncio.new_event_loop().run_until_complete(poll_twice())
+
+        # then
+        assert [context.number for context in blocks] == [12]
+
+    def test_should_only_accept_coroutine_functions(self):
+        # expect
+        with pytest.raises(AssertionError):
+            AsyncLifecycle().every(1, lambda: None)
+
+
+class TestBlockMetrics:
+    def setup_method(self):
+        self.web3 = Mock(Web3)
+        self.web3.eth = Mock()
+        self.web3.eth.syncing = False
+        self.lifecycle = Lifecycle(self.web3)
+
+    def teardown_method(self):
+        self.lifecycle.scheduler.stop()
+
+    @staticmethod
+    def block(number: int) -> dict:
+        return {'number': number, 'hash': HexBytes(number.to_bytes(32, 'big')), 'parentHash': HexBytes(bytes(32)),
+                'timestamp': int(time.time()) - 3, 'logsBloom': bytes(256)}
+
+    def test_should_record_block_processing_metrics(self):
+        # given
+        release = Event()
+        self.lifecycle.on_block(lambda: release.wait())
+        self.lifecycle._on_block_callback = self.lifecycle.scheduler.callback(self.lifecycle.block_function)
+        self.lifecycle.scheduler.start()
+
+        # when
+        self.lifecycle._on_new_block(None, self.block(10))
+        self.lifecycle._on_new_block(None, self.block(11))
+        self.lifecycle._on_new_block(None, self.block(14))
+        self.lifecycle._on_new_block(None, self.block(12))
+        release.set()
+        self.lifecycle._on_block_callback.wait()
+
+        # then
+        metrics = self.lifecycle.metrics
+        assert metrics.counter("pymaker_blocks_processed_total") == 1
+        assert metrics.counter("pymaker_blocks_skipped_total", {'reason': 'busy'}) == 2
+        assert metrics.counter("pymaker_blocks_skipped_total", {'reason': 'missed'}) == 2
+        assert metrics.counter("pymaker_blocks_skipped_total", {'reason': 'stale'}) == 1
+        assert metrics.gauge_value("pymaker_head_block_number") == 14
+        assert metrics.gauge_value("pymaker_head_lag_seconds") >= 3
+        assert metrics.histogram("pymaker_block_latency_seconds").count == 1
+        assert metrics.histogram("pymaker_block_callback_duration_seconds").count == 1
+
+
+class TestEventTimer:
+    def setup_method(self):
+        self.web3 = Mock(Web3)
+        self.web3.eth = Mock()
+        self.lifecycle = Lifecycle(self.web3)
+
+    def test_should_stop_event_thread_once_scheduler_is_stopped(self):
+        # given
+        runs = []
+        event = Event()
+        self.lifecycle.on_event(event, 1, lambda: runs.append(event.is_set()))
+        self.lifecycle.scheduler.start()
+        self.lifecycle.scheduler.stop()
+        threads = []
+        self.lifecycle._start_thread_safely = lambda thread: (threads.append(thread), thread.start())
+
+        # when
+        self.lifecycle._start_event_timer(1, *self.lifecycle.event_timers[0])
+        threads[0].join(timeout=5)
+
+        # then the thread exits instead of failing and being started again
+        assert not threads[0].is_alive()
+        assert len(threads) == 1
+        assert runs == []
+
+
+class TestReorgCallback:
+    def setup_method(self):
+        self.chain = MockChain()
+        self.chain.web3.eth.syncing = False
+        self.chain.web3.eth.getLogs = Mock(side_effect=lambda filter_params: [{'blockHash': filter_params['blockHash']}])
+        self.lifecycle = Lifecycle(self.chain.web3)
+
+    def teardown_method(self):
+        self.lifecycle.scheduler.stop()
+
+    def block(self, number: int, fork: int = 0) -> dict:
+        block = self.chain.block(number, fork)
+        block['logsBloom'] = make_bloom(CLIPPER.as_bytes())
+        return block
+
+    def test_should_pass_removed_logs_to_reorg_callback(self):
+        # given
+        reorgs = []
+        self.lifecycle.on_reorg(lambda depth, orphaned: reorgs.append((depth, orphaned)), depth=8,
+                                tailer=LogTailer(self.chain.web3, [CLIPPER]))
+        for number in range(1, 4):
+            self.lifecycle._on_new_block(None, self.block(number))
+
+        # when
+        self.block(3, fork=1)
+        self.lifecycle._on_new_block(None, self.block(4, fork=1))
+
+        # then
+        depth, orphaned = reorgs[0]
+        assert depth == 1
+        assert orphaned[0].logs == [{'blockHash': MockChain.hash(3, 0).hex()}]
@@ -0,0 +1,109 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from urllib.request import urlopen
+
+from pymaker.metrics import Histogram, InMemoryMetrics, PrometheusExporter, prometheus_text
+
+
+class TestHistogram:
+    def test_should_count_observations_in_buckets(self):
+        # given
+        histogram = Histogram((0.1, 1.0))
+
+        # when
+        for value in [0.05, 0.1, 0.5, 2.0]:
+            histogram.observe(value)
+
+        # then
+        assert histogram.counts == [2, 1, 1]
+        assert histogram.count == 4
+        assert histogram.sum == 2.65
+        assert histogram.quantile(0.5) == 0.1
+        assert histogram.quantile(0.75) == 1.0
+        assert histogram.quantile(1.0) == float('inf')
+
+
+class TestInMemoryMetrics:
+    def test_should_keep_series_by_labels(self):
+        # given
+        metrics = InMemoryMetrics()
+
+        # when
+        metrics.increment("skipped_total", labels={'reason': 'busy'})
+        metrics.increment("skipped_total", 2, labels={'reason': 'busy'})
+        metrics.increment("skipped_total", labels={'reason': 'stale'})
+        metrics.gauge("head", 12)
+        metrics.observe("duration_seconds", 0.2)
+
+        # then
+        assert metrics.counter("skipped_total", {'reason': 'busy'}) == 3
+        assert metrics.counter("skipped_total", {'reason': 'stale'}) == 1
+        assert metrics.counter("skipped_total", {'reason': 'syncing'}) == 0
+        assert metrics.gauge_value("head") == 12
+        assert metrics.histogram("duration_seconds").count == 1
+        assert metrics.snapshot()['counters'] == {'skipped_total{reason="busy"}': 3, 'skipped_total{reason="stale"}': 1}
+
+    def test_should_render_prometheus_text(self):
+        # given
+        metrics = InMemoryMetrics(buckets=(0.1, 1.0))
+        metrics.increment("skipped_total", labels={'reason': 'busy'})
+        metrics.gauge("head", 12)
+        metrics.observe("duration_seconds", 0.5)
+
+        # when
+        text = prometheus_text(metrics)
+
+        # then
+        assert text == '# TYPE skipped_total counter\n' \
+                       'skipped_total{reason="busy"} 1\n' \
+                       '# TYPE head gauge\n' \
+                       'head 12\n' \
+                       '# TYPE duration_seconds histogram\n' \
+                       'duration_seconds_bucket{le="0.1"} 0\n' \
+                       'duration_seconds_bucket{le="1.0"} 1\n' \
+                       'duration_seconds_bucket{le="+Inf"} 1\n' \
+                       'duration_seconds_sum 0.5\n' \
+                       'duration_seconds_count 1\n'
+
+    def test_should_escape_label_values(self):
+        # given
+        metrics = InMemoryMetrics()
+
+        # when
+        metrics.increment("calls_total", labels={'caller': 'Vat.ilk("ETH-A")'})
+
+        # then
+        assert 'calls_total{caller="Vat.ilk(\\"ETH-A\\")"} 1' in prometheus_text(metrics)
+
+
+class TestPrometheusExporter:
+    def test_should_serve_metrics(self):
+        # given
+        metrics = InMemoryMetrics()
+        metrics.gauge("head", 12)
+        exporter = PrometheusExporter(metrics, 0, "127.0.0.1")
+        exporter.start()
+
+        try:
+            # when
+            body = urlopen(f"http://127.0.0.1:{exporter.server.server_address[1]}/metrics").read().decode()
+
+            # then
+            assert "head 12" in body
+        finally:
+            exporter.stop()
@@ -0,0 +1,130 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from eth_account import Account
+from web3 import Web3
+
+from pymaker import next_nonce
+from pymaker.keys import register_private_key
+from pymaker.presigned import gas_price_ladder, PresignedTransact
+from tests.test_batch import ACCOUNT, FakeNode, PRIVATE_KEY, transfer
+
+
+@pytest.mark.timeout(30)
+class TestPresignedTransact:
+    def setup_method(self):
+        self.node = FakeNode(tx_count=3)
+        self.web3 = Web3(self.node)
+        self.web3.eth.defaultAccount = ACCOUNT
+        register_private_key(self.web3, PRIVATE_KEY)
+        next_nonce.pop(ACCOUNT, None)
+
+    def teardown_method(self):
+        next_nonce.pop(ACCOUNT, None)
+
+    def test_should_build_gas_price_ladder(self):
+        assert gas_price_ladder(100, 3) == [100, 113, 128]
+        assert gas_price_ladder(10, 1) == [10]
+
+    def test_should_require_registered_key(self):
+        # given
+        web3 = Web3(FakeNode())
+        web3.eth.defaultAccount = ACCOUNT
+
+        # expect
+        with pytest.raises(ValueError):
+            PresignedTransact(transfer(web3, 1), gas=21000, gas_prices=[1])
+
+    def test_should_sign_variants_ahead_of_time(self):
+        # given
+        presigned = PresignedTransact(transfer(self.web3, 1), gas=21000, gas_prices=gas_price_ladder(10, 3))
+
+        # when
+        presigned.prepare()
+
+        # then
+        assert presigned.nonce == 3
+        assert len(presigned.raw_transactions) == 3
+        assert len(set(presigned.raw_transactions)) == 3
+        assert all(Account.recover_transaction(raw) == ACCOUNT for raw in presigned.raw_transactions)
+
+    def test_should_send_with_a_single_request(self):
+        # given
+        presigned = PresignedTransact(transfer(self.web3, 1), gas=21000, gas_prices=[10, 12, 14])
+        presigned.prepare()
+        self.node.requests.clear()
+
+        # when
+        future = presigned.send(min_gas_price=11)
+
+        # then
+        assert [method for method, _ in self.node.requests] == ["eth_sendRawTransaction"]
+        assert self.node.requests[0][1] == [presigned.raw_transactions[1]]
+        assert presigned.transact.nonce == 3
+        assert next_nonce[ACCOUNT] == 4
+
+        # and
+        self.node.mine()
+        assert future.result(timeout=10) is not None
+
+    def test_should_bump_to_next_variant(self):
+        # given
+        presigned = PresignedTransact(transfer(self.web3, 1), gas=21000, gas_prices=[10, 12])
+        presigned.prepare()
+        presigned.send()
+
+        # when
+        first_bump = presigned.bump()
+        second_bump = presigned.bump()
+
+        # then
+        assert first_bump
+        assert not second_bump
+        assert self.node.methods("eth_sendRawTransaction") == [[raw] for raw in presigned.raw_transactions]
+        assert len(presigned.transact.tx_hashes) == 2
+
+    def test_should_refuse_to_send_stale_transactions(self):
+        # given
+        presigned = PresignedTransact(transfer(self.web3, 1), gas=21000, gas_prices=[10])
+        presigned.prepare()
+
+        # when
+        next_nonce[ACCOUNT] = 4
+
+        # then
+        assert presigned.is_stale()
+        with pytest.raises(ValueError):
+            presigned.send()
+
+    def test_should_re_sign_when_nonce_moves(self):
+        # given
+        presigned = PresignedTransact(transfer(self.web3, 1), gas=21000, gas_prices=[10])
+        presigned.prepare()
+        raw_transactions = presigned.raw_transactions
+
+        # when
+        unchanged = presigned.refresh()
+        self.node.tx_count = 5
+        changed = presigned.refresh()
+
+        # then
+        assert not unchanged
+        assert changed
+        assert presigned.nonce == 5
+        assert presigned.raw_transactions != raw_transactions
+        assert not presigned.is_stale()
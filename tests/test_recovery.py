@@ -0,0 +1,156 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+
+import pytest
+from web3 import Web3
+
+from pymaker import Address, RecoveredTransact, TransactStatus
+from pymaker.gas import FixedGasFees, FixedGasPrice, GasFees
+from pymaker.recovery import RecoveryManager
+from tests.test_batch import ACCOUNT, FakeNode, OTHER_ADDRESS, wait_for
+
+
+def original_hash(nonce: int) -> str:
+    return "0x" + format(nonce, "064x").replace("0", "e")
+
+
+@pytest.mark.timeout(30)
+class TestRecoveryManager:
+    def setup_method(self):
+        self.node = FakeNode(tx_count=7)
+        self.web3 = Web3(self.node)
+        self.web3.eth.defaultAccount = ACCOUNT
+
+    def recovered(self, nonces, current_gas: int = 10, current_fees=None, transaction=None) -> list:
+        return [RecoveredTransact(self.web3, Address(ACCOUNT), nonce, original_hash(nonce), current_gas,
+                                  current_fees=current_fees, transaction=transaction) for nonce in nonces]
+
+    def run_in_background(self, function) -> list:
+        result = []
+        threading.Thread(target=lambda: result.append(function()), daemon=True).start()
+        return result
+
+    def test_should_cancel_all_stuck_nonces_at_once(self):
+        # given
+        recovered = self.recovered([7, 8, 9])
+        manager = RecoveryManager(self.web3, FixedGasPrice(20), poll_interval=0.01)
+
+        # when
+        result = self.run_in_background(lambda: manager.cancel_all(recovered))
+        wait_for(lambda: len(self.node.sent) == 3)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        cancellations = [params[0] for params in self.node.methods("eth_sendTransaction")]
+        assert [int(cancellation['nonce'], 16) for cancellation in cancellations] == [7, 8, 9]
+        assert all(cancellation['to'] == ACCOUNT and int(cancellation['value'], 16) == 0
+                   for cancellation in cancellations)
+        assert all(int(cancellation['gasPrice'], 16) == 20 for cancellation in cancellations)
+        assert all(receipt is not None for receipt in result[0])
+        assert all(transact.status == TransactStatus.FINISHED for transact in recovered)
+
+    def test_should_bump_type2_fees_of_the_first_cancellation(self):
+        # given
+        recovered = self.recovered([7], current_gas=100, current_fees=GasFees(100, 10))
+        manager = RecoveryManager(self.web3, FixedGasFees(50, 5), poll_interval=0.01)
+
+        # when
+        result = self.run_in_background(lambda: manager.cancel_all(recovered))
+        wait_for(lambda: len(self.node.sent) == 1)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        cancellation = self.node.methods("eth_sendTransaction")[0][0]
+        assert cancellation['type'] == "0x2"
+        assert (int(cancellation['maxFeePerGas'], 16), int(cancellation['maxPriorityFeePerGas'], 16)) == (110, 11)
+
+    def test_should_resubmit_payloads_fetched_from_the_node(self):
+        # given
+        recovered = self.recovered([7, 8])
+        for nonce in [7, 8]:
+            self.node.transactions[original_hash(nonce)] = {'hash': original_hash(nonce), 'from': ACCOUNT,
+                                                            'to': OTHER_ADDRESS.address, 'input': "0xabcd",
+                                                            'value': hex(nonce), 'gas': hex(60000),
+                                                            'gasPrice': hex(10), 'nonce': hex(nonce)}
+        manager = RecoveryManager(self.web3, FixedGasPrice(20), poll_interval=0.01)
+
+        # when
+        result = self.run_in_background(lambda: manager.resubmit_all(recovered))
+        wait_for(lambda: len(self.node.sent) == 2)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        resubmitted = [params[0] for params in self.node.methods("eth_sendTransaction")]
+        assert [int(transaction['nonce'], 16) for transaction in resubmitted] == [7, 8]
+        assert [int(transaction['value'], 16) for transaction in resubmitted] == [7, 8]
+        assert all(transaction['data'] == "0xabcd" for transaction in resubmitted)
+        assert all(int(transaction['gas'], 16) == 60000 for transaction in resubmitted)
+        assert all(receipt is not None for receipt in result[0])
+
+    def test_should_wait_for_gas_price_high_enough_to_replace(self):
+        # given
+        recovered = self.recovered([7], current_gas=20)
+        manager = RecoveryManager(self.web3, FixedGasPrice(21), poll_interval=0.01)
+
+        # when the original transaction gets mined
+        result = self.run_in_background(lambda: manager.cancel_all(recovered))
+        self.node.sent.append(original_hash(7))
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        assert self.node.methods("eth_sendTransaction") == []
+        assert result[0][0].transaction_hash.hex() == original_hash(7)
+
+    def test_should_cancel_transactions_whose_payload_can_not_be_fetched(self):
+        # given no payload is known, as the transaction has been dropped from the mempool
+        recovered = self.recovered([7])
+        manager = RecoveryManager(self.web3, FixedGasPrice(20), poll_interval=0.01)
+
+        # when
+        result = self.run_in_background(lambda: manager.resubmit_all(recovered))
+        wait_for(lambda: len(self.node.sent) == 1)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        cancellation = self.node.methods("eth_sendTransaction")[0][0]
+        assert (int(cancellation['nonce'], 16), cancellation['to'], cancellation['data']) == (7, ACCOUNT, "0x")
+        assert result[0] == [None]
+        assert recovered[0].status == TransactStatus.FINISHED
+
+    def test_should_give_up_on_overridden_transactions(self):
+        # given the gas price is not high enough for a replacement
+        recovered = self.recovered([7])
+        manager = RecoveryManager(self.web3, FixedGasPrice(10), poll_interval=0.01, max_misses=2)
+
+        # when the nonce gets used by another transaction
+        self.node.tx_count = 8
+        result = self.run_in_background(lambda: manager.cancel_all(recovered))
+        wait_for(lambda: len(self.node.methods("eth_getTransactionReceipt")) > 0)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        assert result[0] == [None]
+        assert self.node.methods("eth_sendTransaction") == []
@@ -0,0 +1,545 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+from hexbytes import HexBytes
+from web3 import HTTPProvider, Web3
+from web3._utils.method_formatters import log_entry_formatter
+from web3.providers import BaseProvider
+
+from pymaker import Address
+from pymaker.rpc import AsyncHTTPProvider, batch_request, FastHTTPProvider, format_raw_log, get_raw_logs, \
+    MultiEndpointProvider, rpc_caller, rpc_instrumentation, RpcInstrumentation, SenderResolver, SingleFlight
+
+
+SENDER_1 = "0x50ff810797f75f6bfbf2227442e0c961a8562f4c"
+SENDER_2 = "0x9596c16d7bf9323265c2f2e22f43e6c80eb3d943"
+
+
+def tx_hash(index: int) -> str:
+    return "0x" + format(index, "064x")
+
+
+def mocked_web3(transactions: dict) -> Web3:
+    """Mocks a web3 whose provider knows about the specified transactions, keyed by hash."""
+    def make_request(method, params):
+        if method == "eth_getTransactionByHash":
+            return {'id': 1, 'result': transactions[params[0]]}
+        elif method == "eth_getBlockByNumber":
+            block_number = int(params[0], 16)
+            return {'id': 1, 'result': {'number': params[0],
+                                        'transactions': [tx for tx in transactions.values()
+                                                         if tx['blockNumber'] == block_number]}}
+        else:
+            return {'id': 1, 'error': {'code': -32601, 'message': f"Unknown method {method}"}}
+
+    web3 = Mock(Web3)
+    web3.provider = Mock()
+    web3.provider.make_request = Mock(side_effect=make_request)
+    web3.eth = Mock()
+    web3.eth.getTransaction = Mock(side_effect=lambda h: transactions[h])
+    return web3
+
+
+def log(index: int, block_number: int) -> dict:
+    return {'transactionHash': HexBytes(tx_hash(index)), 'blockNumber': block_number}
+
+
+class TestBatchRequest:
+    def test_should_return_results_in_order(self):
+        # given
+        web3 = mocked_web3({tx_hash(1): {'hash': tx_hash(1), 'from': SENDER_1, 'blockNumber': 1},
+                            tx_hash(2): {'hash': tx_hash(2), 'from': SENDER_2, 'blockNumber': 2}})
+
+        # when
+        results = batch_request(web3, [("eth_getTransactionByHash", [tx_hash(2)]),
+                                       ("eth_getTransactionByHash", [tx_hash(1)])])
+
+        # then
+        assert results[0]['from'] == SENDER_2
+        assert results[1]['from'] == SENDER_1
+
+    def test_should_raise_on_error(self):
+        # given
+        web3 = mocked_web3({})
+
+        # expect
+        with pytest.raises(ValueError):
+            batch_request(web3, [("eth_unknownMethod", [])])
+
+    def test_should_do_nothing_for_no_calls(self):
+        # given
+        web3 = mocked_web3({})
+
+        # expect
+        assert batch_request(web3, []) == []
+        assert web3.provider.make_request.call_count == 0
+
+
+class TestSenderResolver:
+    def test_should_cache_senders(self):
+        # given
+        web3 = mocked_web3({tx_hash(1): {'hash': tx_hash(1), 'from': SENDER_1, 'blockNumber': 1}})
+        resolver = SenderResolver(web3)
+
+        # when
+        assert resolver.sender(tx_hash(1)) == Address(SENDER_1)
+        assert resolver.sender(HexBytes(tx_hash(1))) == Address(SENDER_1)
+
+        # then
+        assert web3.eth.getTransaction.call_count == 1
+
+    def test_should_evict_least_recently_used(self):
+        # given
+        web3 = mocked_web3({tx_hash(i): {'hash': tx_hash(i), 'from': SENDER_1, 'blockNumber': i} for i in range(3)})
+        resolver = SenderResolver(web3, max_size=2)
+
+        # when
+        resolver.sender(tx_hash(0))
+        resolver.sender(tx_hash(1))
+        resolver.sender(tx_hash(0))
+        resolver.sender(tx_hash(2))
+        resolver.sender(tx_hash(0))
+        resolver.sender(tx_hash(1))
+
+        # then
+        assert web3.eth.getTransaction.call_count == 4
+
+    def test_should_prefetch_by_block(self):
+        # given
+        web3 = mocked_web3({tx_hash(1): {'hash': tx_hash(1), 'from': SENDER_1, 'blockNumber': 10},
+                            tx_hash(2): {'hash': tx_hash(2), 'from': SENDER_2, 'blockNumber': 10},
+                            tx_hash(3): {'hash': tx_hash(3), 'from': SENDER_2, 'blockNumber': 11}})
+        resolver = SenderResolver(web3)
+
+        # when
+        resolver.prefetch([log(1, 10), log(2, 10), log(3, 11), log(3, 11)])
+
+        # then
+        methods = [c[0][0] for c in web3.provider.make_request.call_args_list]
+        assert sorted(methods) == ["eth_getBlockByNumber", "eth_getTransactionByHash"]
+
+        # and
+        assert resolver.sender(tx_hash(1)) == Address(SENDER_1)
+        assert resolver.sender(tx_hash(2)) == Address(SENDER_2)
+        assert resolver.sender(tx_hash(3)) == Address(SENDER_2)
+        assert web3.eth.getTransaction.call_count == 0
+
+    def test_should_not_prefetch_cached_senders(self):
+        # given
+        web3 = mocked_web3({tx_hash(1): {'hash': tx_hash(1), 'from': SENDER_1, 'blockNumber': 10}})
+        resolver = SenderResolver(web3)
+        resolver.sender(tx_hash(1))
+
+        # when
+        resolver.prefetch([log(1, 10)])
+
+        # then
+        assert web3.provider.make_request.call_count == 0
+
+
+class TestAsyncHTTPProvider:
+    def setup_method(self):
+        self.web3 = Web3(HTTPProvider("http://localhost:8555"))
+        self.web3.provider.make_request = Mock(side_effect=lambda method, params:
+                                               {'id': 1, 'result': "0x10"} if method == "eth_blockNumber"
+                                               else {'id': 1, 'error': {'code': -32601, 'message': "Unknown"}})
+        self.rpc = AsyncHTTPProvider(self.web3)
+
+    def teardown_method(self):
+        self.rpc.close()
+
+    def test_should_await_requests(self):
+        # given
+        async def requests():
+            return await asyncio.gather(self.rpc.block_number(), self.rpc.request("eth_blockNumber", []))
+
+        # when
+        results = asyncio.new_event_loop().run_until_complete(requests())
+
+        # then
+        assert results == [16, "0x10"]
+        assert self.web3.provider.make_request.call_count == 2
+
+    def test_should_raise_on_errors(self):
+        # expect
+        with pytest.raises(ValueError):
+            asyncio.new_event_loop().run_until_complete(self.rpc.request("eth_unknown", []))
+
+
+class StaticProvider(BaseProvider):
+    def make_request(self, method, params):
+        if method == "eth_blockNumber":
+            return {'jsonrpc': "2.0", 'id': 1, 'result': "0x10"}
+        return {'jsonrpc': "2.0", 'id': 1, 'error': {'code': -32601, 'message': f"Unknown method {method}"}}
+
+
+class Reader:
+    def __init__(self, web3: Web3):
+        self.web3 = web3
+
+    def block_number(self) -> int:
+        return self.web3.eth.blockNumber
+
+
+class TestRpcInstrumentation:
+    def setup_method(self):
+        self.web3 = Web3(StaticProvider())
+        self.instrumentation = RpcInstrumentation()
+        self.instrumentation.install(self.web3)
+
+    def test_should_attribute_requests_to_calling_method(self):
+        # when
+        Reader(self.web3).block_number()
+        Reader(self.web3).block_number()
+
+        # then
+        assert self.instrumentation.counts("eth_blockNumber", "Reader.block_number") == 2
+        assert self.instrumentation.metrics.counter("pymaker_rpc_requests_total",
+                                                    {'method': "eth_blockNumber", 'caller': "Reader.block_number"}) == 2
+        assert self.instrumentation.metrics.histogram("pymaker_rpc_latency_seconds",
+                                                      {'method': "eth_blockNumber"}).count == 2
+        assert rpc_instrumentation(self.web3) is self.instrumentation
+
+    def test_should_attribute_requests_to_explicit_caller(self):
+        # when
+        with rpc_caller("Keeper.check_all"):
+            Reader(self.web3).block_number()
+
+        # then
+        assert self.instrumentation.counts(caller="Keeper.check_all") == 1
+        assert self.instrumentation.counts(caller="Reader.block_number") == 0
+
+    def test_should_count_errors(self):
+        # when
+        with pytest.raises(ValueError):
+            self.web3.manager.request_blocking("eth_unknown", [])
+
+        # then
+        summary = self.instrumentation.summary()
+        assert summary[0]['method'] == "eth_unknown"
+        assert summary[0]['errors'] == 1
+
+    def test_should_count_bytes_reported_by_the_session(self):
+        # given
+        response = Mock(content=b'{"result": "0x10"}')
+        response.request.body = b'{"method": "eth_blockNumber"}'
+        self.web3.provider.make_request = Mock(side_effect=lambda method, params: [
+            self.instrumentation._response_hook(response), {'id': 1, 'result': "0x10"}][1])
+
+        # when
+        Reader(self.web3).block_number()
+
+        # then
+        summary = self.instrumentation.summary()
+        assert summary[0]['bytes_sent'] == len(response.request.body)
+        assert summary[0]['bytes_received'] == len(response.content)
+
+
+class FakeNode:
+    """Stands in for `session.post` of a single node, answering with a fixed result after a delay."""
+    def __init__(self, result="0x1", delay: float = 0.0, block_number: int = 100, fail: bool = False):
+        self.result = result
+        self.delay = delay
+        self.block_number = block_number
+        self.fail = fail
+        self.methods = []
+        self.lock = threading.Lock()
+
+    def post(self, uri, data, **kwargs):
+        method = json.loads(data)['method']
+        with self.lock:
+            self.methods.append(method)
+        if self.fail:
+            raise ConnectionError("node down")
+        if method != "eth_blockNumber":
+            time.sleep(self.delay)
+        result = hex(self.block_number) if method == "eth_blockNumber" else self.result
+        return Mock(content=json.dumps({'jsonrpc': "2.0", 'id': 1, 'result': result}).encode())
+
+    def count(self, method: str) -> int:
+        return self.methods.count(method)
+
+
+@pytest.mark.timeout(30)
+class TestMultiEndpointProvider:
+    def provider(self, *nodes: FakeNode, **kwargs) -> MultiEndpointProvider:
+        provider = MultiEndpointProvider([f"http://node{index}:8545" for index in range(len(nodes))],
+                                         height_check_interval=3600, **kwargs)
+        provider._heights_checked_at = time.time()
+        for endpoint, node in zip(provider.endpoints, nodes):
+            endpoint.session.post = node.post
+        return provider
+
+    def test_should_prefer_the_fastest_node(self):
+        # given
+        slow, fast = FakeNode("0xa", delay=0.05), FakeNode("0xb")
+        provider = self.provider(slow, fast, min_hedge_delay=1.0)
+        provider.endpoints[0].record_success(0.05)
+        provider.endpoints[1].record_success(0.001)
+
+        # when
+        response = provider.make_request("eth_call", [])
+
+        # then
+        assert response['result'] == "0xb"
+        assert slow.count("eth_call") == 0
+        assert provider.hedged_requests == 0
+
+    def test_should_hedge_slow_reads(self):
+        # given
+        stalled, other = FakeNode("0xa", delay=2.0), FakeNode("0xb")
+        provider = self.provider(stalled, other, min_hedge_delay=0.05)
+
+        # when
+        response = provider.make_request("eth_getLogs", [])
+
+        # then
+        assert response['result'] == "0xb"
+        assert provider.hedged_requests == 1
+
+    def test_should_stop_reading_from_a_stalled_node(self):
+        # given
+        stalled, other = FakeNode("0xa", delay=3.0), FakeNode("0xb")
+        provider = self.provider(stalled, other, min_hedge_delay=0.05)
+        assert provider.make_request("eth_call", [])['result'] == "0xb"
+
+        # when
+        responses = [provider.make_request("eth_call", []) for _ in range(3)]
+
+        # then the stalled node, still not having responded, is not picked first anymore
+        assert all(response['result'] == "0xb" for response in responses)
+        assert stalled.count("eth_call") == 1
+        assert provider.hedged_requests == 1
+
+    def test_should_not_queue_broadcasts_behind_a_stalled_node(self):
+        # given
+        stalled, other = FakeNode("0x01", delay=3.0), FakeNode("0x01")
+        provider = self.provider(stalled, other, http_pool_size=2)
+        for _ in range(2):
+            provider.endpoints[0].executor.submit(stalled.post, "", json.dumps({'method': "eth_call"}))
+
+        # when
+        start = time.time()
+        response = provider.make_request("eth_sendRawTransaction", ["0x00"])
+
+        # then
+        assert response['result'] == "0x01"
+        assert time.time() - start < 1.0
+
+    def test_should_broadcast_raw_transactions(self):
+        # given
+        nodes = [FakeNode("0x01"), FakeNode("0x01"), FakeNode("0x01")]
+        provider = self.provider(*nodes)
+
+        # when
+        response = provider.make_request("eth_sendRawTransaction", ["0x00"])
+        time.sleep(0.1)
+
+        # then
+        assert response['result'] == "0x01"
+        assert all(node.count("eth_sendRawTransaction") == 1 for node in nodes)
+
+    def test_should_not_read_from_lagging_nodes(self):
+        # given
+        lagging, synced = FakeNode("0xa", block_number=90), FakeNode("0xb", delay=0.01, block_number=100)
+        provider = self.provider(lagging, synced, min_hedge_delay=1.0)
+        provider.endpoints[0].record_success(0.001)
+        provider.endpoints[1].record_success(0.01)
+        for endpoint in provider.endpoints:
+            provider._refresh_height(endpoint)
+
+        # when
+        response = provider.make_request("eth_call", [])
+
+        # then
+        assert response['result'] == "0xb"
+        assert lagging.count("eth_call") == 0
+
+    def test_should_fail_over_to_next_node(self):
+        # given
+        down, up = FakeNode(fail=True), FakeNode("0x5")
+        provider = self.provider(down, up)
+
+        # when
+        response = provider.make_request("eth_getTransactionCount", [])
+
+        # then
+        assert response['result'] == "0x5"
+        assert not provider.endpoints[0].healthy(time.time())
+
+        # and the failed node is skipped afterwards
+        provider.make_request("eth_getTransactionCount", [])
+        assert down.count("eth_getTransactionCount") == 1
+        assert up.count("eth_getTransactionCount") == 2
+
+    def test_should_keep_stateful_requests_on_the_primary_node(self):
+        # given
+        primary, secondary = FakeNode("0x1", delay=0.01), FakeNode("0x2")
+        provider = self.provider(primary, secondary)
+        provider.endpoints[0].record_success(0.01)
+        provider.endpoints[1].record_success(0.001)
+
+        # when
+        response = provider.make_request("eth_newFilter", [{}])
+
+        # then
+        assert response['result'] == "0x1"
+        assert secondary.count("eth_newFilter") == 0
+
+
+class SlowProvider(BaseProvider):
+    """Answers `eth_getBalance` with the number of requests received so far, once released."""
+    def __init__(self):
+        self.release = threading.Event()
+        self.requests = 0
+
+    def make_request(self, method, params):
+        self.requests += 1
+        count = self.requests
+        self.release.wait()
+        if params[0] == "0x" + "00" * 20:
+            return {'jsonrpc': "2.0", 'id': 1, 'error': {'code': -32000, 'message': "failed"}}
+        return {'jsonrpc': "2.0", 'id': 1, 'result': hex(count)}
+
+
+@pytest.mark.timeout(30)
+class TestSingleFlight:
+    def setup_method(self):
+        self.provider = SlowProvider()
+        self.web3 = Web3(self.provider)
+        self.single_flight = SingleFlight()
+        self.single_flight.install(self.web3)
+
+    def get_balances(self, addresses: list) -> list:
+        results = [None] * len(addresses)
+
+        def get_balance(index):
+            try:
+                results[index] = self.web3.manager.request_blocking("eth_getBalance", [addresses[index], "latest"])
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=get_balance, args=(index,)) for index in range(len(addresses))]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.provider.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_should_coalesce_identical_concurrent_requests(self):
+        # when
+        results = self.get_balances([Web3.toChecksumAddress(SENDER_1)] * 5)
+
+        # then
+        assert results == [1] * 5
+        assert self.provider.requests == 1
+        assert self.single_flight.requests == 1
+        assert self.single_flight.coalesced == 4
+
+    def test_should_not_coalesce_different_requests(self):
+        # when
+        results = self.get_balances([Web3.toChecksumAddress(SENDER_1), Web3.toChecksumAddress(SENDER_2)])
+
+        # then
+        assert sorted(results) == [1, 2]
+        assert self.single_flight.coalesced == 0
+
+    def test_should_not_coalesce_sequential_requests(self):
+        # given
+        self.provider.release.set()
+
+        # when
+        first = self.web3.manager.request_blocking("eth_getBalance", [Web3.toChecksumAddress(SENDER_1), "latest"])
+        second = self.web3.manager.request_blocking("eth_getBalance", [Web3.toChecksumAddress(SENDER_1), "latest"])
+
+        # then
+        assert (first, second) == (1, 2)
+
+    def test_should_fan_out_errors(self):
+        # when
+        results = self.get_balances(["0x" + "00" * 20] * 3)
+
+        # then
+        assert all(isinstance(result, ValueError) for result in results)
+        assert self.provider.requests == 1
+
+
+RAW_LOG = {'address': SENDER_1,
+           'topics': ["0x" + "ab" * 32, "0x" + "00" * 12 + SENDER_2[2:]],
+           'data': "0x" + "00" * 31 + "01",
+           'blockNumber': "0x10",
+           'blockHash': "0x" + "cd" * 32,
+           'transactionHash': "0x" + "ef" * 32,
+           'transactionIndex': "0x2",
+           'logIndex': "0x5",
+           'removed': False}
+
+
+class LogsProvider(BaseProvider):
+    def __init__(self):
+        self.params = []
+
+    def make_request(self, method, params):
+        self.params.append(params)
+        return {'jsonrpc': "2.0", 'id': 1, 'result': [RAW_LOG]}
+
+
+class TestRawLogs:
+    def test_should_format_logs_like_web3(self):
+        # expect
+        assert format_raw_log(RAW_LOG) == log_entry_formatter(RAW_LOG)
+
+    def test_should_format_pending_logs_like_web3(self):
+        # given
+        raw_log = {**RAW_LOG, 'blockNumber': None, 'blockHash': None, 'transactionIndex': None, 'logIndex': None}
+
+        # expect
+        assert format_raw_log(raw_log) == log_entry_formatter(raw_log)
+
+    def test_should_get_raw_logs_with_hex_block_numbers(self):
+        # given
+        provider = LogsProvider()
+        web3 = Web3(provider)
+        instrumentation = RpcInstrumentation()
+        instrumentation.install(web3)
+
+        # when
+        logs = get_raw_logs(web3, {'address': SENDER_1, 'fromBlock': 16, 'toBlock': "latest"})
+
+        # then
+        assert logs == [RAW_LOG]
+        assert provider.params == [[{'address': SENDER_1, 'fromBlock': "0x10", 'toBlock': "latest"}]]
+        assert instrumentation.counts("eth_getLogs") == 1
+
+
+class TestFastHTTPProvider:
+    def test_should_decode_responses(self):
+        # given
+        provider = FastHTTPProvider("http://localhost:8545")
+
+        # expect
+        assert provider.decode_rpc_response(b'{"jsonrpc": "2.0", "id": 1, "result": [1, "0x2"]}') == \
+               {'jsonrpc': "2.0", 'id': 1, 'result': [1, "0x2"]}
@@ -0,0 +1,239 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+from collections import Counter
+
+import pytest
+from web3 import Web3
+
+from pymaker import Address, web3_via_http
+from pymaker.approval import directly, hope_directly
+from pymaker.deployment import Collateral, DssDeployment
+from pymaker.dss import Urn
+from pymaker.keys import register_keys
+from pymaker.model import Token
+from pymaker.numeric import Wad
+from pymaker.oasis import MatchingMarket
+from pymaker.rpc import RpcInstrumentation, rpc_instrumentation
+from pymaker.token import DSToken
+from tests.test_oasis import OasisMockPriceOracle
+from tests.test_dss import frob, get_collateral_price, max_dart, set_collateral_price, wrap_eth
+
+# Operations below are run against local testchains through a separate, instrumented `Web3` instance,
+# and the number of JSON-RPC requests they make is compared to a budget. The budgets follow from
+# the way each operation is implemented, so an accidental extra request per item (i.e. a sweep over
+# all past auctions) fails here, and improvements (i.e. batching) should tighten them.
+#
+# Budgets are expressed per JSON-RPC method; totals are not asserted, as web3.py itself adds requests
+# like `eth_chainId` depending on the middlewares in use.
+
+
+class RpcCounter:
+    """Counts requests made by the instrumented `web3` within the `with` block, per JSON-RPC method."""
+    def __init__(self, web3: Web3):
+        self.instrumentation = rpc_instrumentation(web3)
+        self.counts = Counter()
+
+    def __enter__(self):
+        self.instrumentation.reset()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for row in self.instrumentation.summary():
+            self.counts[row['method']] += row['count']
+        logging.info(f"RPC requests: {dict(self.counts)}")
+
+    def __getitem__(self, method: str) -> int:
+        return self.counts[method]
+
+
+def instrumented_web3(endpoint_uri: str) -> Web3:
+    return web3_via_http(endpoint_uri, instrumentation=RpcInstrumentation())
+
+
+@pytest.fixture(scope="session")
+def counted_web3(web3: Web3) -> Web3:
+    counted_web3 = instrumented_web3(web3.provider.endpoint_uri)
+    counted_web3.eth.defaultAccount = web3.eth.defaultAccount
+    register_keys(counted_web3,
+                  ["key_file=tests/config/keys/UnlimitedChain/key1.json,pass_file=/dev/null",
+                   "key_file=tests/config/keys/UnlimitedChain/key2.json,pass_file=/dev/null",
+                   "key_file=tests/config/keys/UnlimitedChain/key3.json,pass_file=/dev/null",
+                   "key_file=tests/config/keys/UnlimitedChain/key4.json,pass_file=/dev/null",
+                   "key_file=tests/config/keys/UnlimitedChain/key.json,pass_file=/dev/null"])
+    return counted_web3
+
+
+@pytest.fixture(scope="session")
+def counted_mcd(counted_web3: Web3, mcd: DssDeployment) -> DssDeployment:
+    return DssDeployment.from_json(counted_web3, mcd.to_json())
+
+
+def kick_clip(mcd: DssDeployment, collateral: Collateral, address: Address) -> int:
+    """Opens a vault at the limit, drops the price to bark it, and restores the price. Returns the auction id."""
+    ink = Wad.from_number(1)
+    wrap_eth(mcd, address, ink)
+    collateral.approve(address)
+    assert collateral.adapter.join(address, ink).transact(from_address=address)
+    frob(mcd, collateral, address, dink=ink, dart=Wad(0))
+    frob(mcd, collateral, address, dink=Wad(0), dart=max_dart(mcd, collateral, address) - Wad(1))
+
+    price = get_collateral_price(collateral)
+    set_collateral_price(mcd, collateral, price / Wad.from_number(2))
+    urn = mcd.vat.urn(collateral.ilk, address)
+    assert mcd.dog.bark(collateral.ilk, urn, kpr=address).transact(from_address=address)
+    set_collateral_price(mcd, collateral, price)
+    return collateral.clipper.kicks()
+
+
+def take_clip(mcd: DssDeployment, collateral: Collateral, address: Address, id: int):
+    """Takes all the collateral of an auction, which removes it from the list of active auctions."""
+    clipper = collateral.clipper
+    clipper.approve(mcd.vat.address, approval_function=hope_directly(from_address=address))
+    (needs_redo, price, lot, tab) = clipper.status(id)
+    assert not needs_redo
+    clipper.validate_take(id, lot, price, address)
+    assert clipper.take(id, lot, price, address).transact(from_address=address)
+    assert clipper.sales(id).lot == Wad(0)
+
+
+class TestDssBudget:
+    def test_from_json(self, counted_web3, mcd):
+        # given
+        config = mcd.to_json()
+        addresses = set(value for value in json.loads(config).values() if value)
+
+        # when
+        with RpcCounter(counted_web3) as rpc:
+            deployment = DssDeployment.from_json(counted_web3, config)
+
+        # then
+        assert rpc["eth_getCode"] <= len(addresses)
+        assert rpc["eth_call"] == len(deployment.collaterals)
+        assert rpc["eth_getLogs"] == 0
+
+    @pytest.mark.parametrize('urns', [1, 2, 4])
+    def test_can_bite_safe_urns(self, counted_web3, counted_mcd, urns):
+        # given
+        ilk = counted_mcd.collaterals['ETH-A'].ilk
+        addresses = [Address(account) for account in counted_web3.eth.accounts[:urns]]
+
+        # when
+        with RpcCounter(counted_web3) as rpc:
+            results = [counted_mcd.cat.can_bite(ilk, Urn(address)) for address in addresses]
+
+        # then
+        assert results == [False] * urns
+        assert rpc["eth_call"] == 2 * urns
+
+    @pytest.mark.parametrize('auctions', [1, 2, 4])
+    def test_clipper_active_auctions(self, counted_web3, counted_mcd, mcd, deployment_address, auctions):
+        # given auctions kicked one after another, with all but the last one taken
+        collateral = mcd.collaterals['ETH-B']
+        kicks_before = collateral.clipper.kicks()
+        ids = []
+        for _ in range(auctions):
+            if ids:
+                take_clip(mcd, collateral, deployment_address, ids[-1])
+            ids.append(kick_clip(mcd, collateral, deployment_address))
+        assert collateral.clipper.kicks() == kicks_before + auctions
+
+        # when
+        with RpcCounter(counted_web3) as rpc:
+            active = counted_mcd.collaterals['ETH-B'].clipper.active_auctions()
+
+        # then the cost depends on active auctions only, not on all auctions ever kicked
+        assert [auction.id for auction in active] == ids[-1:]
+        assert rpc["eth_call"] == 1 + len(active)
+
+        # cleanup
+        take_clip(mcd, collateral, deployment_address, ids[-1])
+        assert collateral.clipper.active_count() == 0
+
+    def test_flipper_active_auctions(self, counted_web3, counted_mcd):
+        # given
+        flipper = counted_mcd.collaterals['ETH-A'].flipper
+        kicks = flipper.kicks()
+
+        # when
+        with RpcCounter(counted_web3) as rpc:
+            flipper.active_auctions()
+
+        # then flippers have no list of active auctions, so every auction is queried
+        assert rpc["eth_call"] == 1 + kicks
+
+    def test_transact(self, counted_web3, counted_mcd, other_address):
+        # when
+        with RpcCounter(counted_web3) as rpc:
+            assert counted_mcd.dai.approve(other_address, Wad(1)).transact()
+
+        # then
+        assert rpc["eth_estimateGas"] == 1
+        assert rpc["eth_sendTransaction"] + rpc["eth_sendRawTransaction"] == 1
+        assert 1 <= rpc["eth_getTransactionReceipt"] <= 10
+        assert rpc["eth_getLogs"] == 0
+
+
+class TestMatchingMarketBudget:
+    def setup_method(self):
+        self.web3 = instrumented_web3("http://localhost:8555")
+        self.web3.eth.defaultAccount = self.web3.eth.accounts[0]
+
+        price_oracle = OasisMockPriceOracle.deploy(self.web3)
+        price_oracle.set_price(Wad.from_number(10))
+        self.token1 = DSToken.deploy(self.web3, 'AAA')
+        self.token1.mint(Wad.from_number(10000)).transact()
+        self.token1_tokenclass = Token('AAA', self.token1.address, 18)
+        self.token2 = DSToken.deploy(self.web3, 'BBB')
+        self.token2_tokenclass = Token('BBB', self.token2.address, 18)
+
+        self.otc = MatchingMarket.deploy(self.web3, self.token1.address, Wad(0), price_oracle.address)
+        self.otc.add_token_pair_whitelist(self.token1.address, self.token2.address).transact()
+        self.otc.approve([self.token1], directly())
+
+    def make_orders(self, count: int):
+        for index in range(count):
+            assert self.otc.make(p_token=self.token1_tokenclass, pay_amount=Wad.from_number(1),
+                                 b_token=self.token2_tokenclass, buy_amount=Wad.from_number(2 + index)).transact()
+
+    @pytest.mark.parametrize('orders', [1, 3, 6])
+    def test_get_orders_by_pair(self, orders):
+        # given
+        self.make_orders(orders)
+
+        # when
+        with RpcCounter(self.web3) as rpc:
+            result = self.otc.get_orders(self.token1_tokenclass, self.token2_tokenclass)
+
+        # then `getBestOffer`, then `offers` and `getWorseOffer` for each order
+        assert len(result) == orders
+        assert rpc["eth_call"] == 1 + 2 * orders
+
+    @pytest.mark.parametrize('orders', [1, 3, 6])
+    def test_get_all_orders(self, orders):
+        # given
+        self.make_orders(orders)
+
+        # when
+        with RpcCounter(self.web3) as rpc:
+            result = self.otc.get_orders()
+
+        # then `last_offer_id`, then `offers` for each order
+        assert len(result) == orders
+        assert rpc["eth_call"] == 1 + orders
@@ -0,0 +1,136 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import pytest
+
+from pymaker.scheduler import Scheduler, PRIORITY_BLOCK, PRIORITY_TIMER
+
+
+@pytest.mark.timeout(30)
+class TestScheduler:
+    def setup_method(self):
+        self.scheduler = Scheduler(max_workers=1)
+
+    def teardown_method(self):
+        self.scheduler.stop()
+
+    def test_should_call_callback_with_arguments(self):
+        # given
+        calls = []
+        callback = self.scheduler.callback(lambda *args: calls.append(args))
+        self.scheduler.start()
+
+        # when
+        assert callback.trigger(args=(1, 2))
+        callback.wait()
+
+        # then
+        assert calls == [(1, 2)]
+        assert callback.runs == 1
+
+    def test_should_not_call_callback_if_previous_one_is_still_running(self):
+        # given
+        release = threading.Event()
+        callback = self.scheduler.callback(lambda: release.wait())
+        self.scheduler.start()
+
+        # when
+        result1 = callback.trigger()
+        result2 = callback.trigger()
+        release.set()
+        callback.wait()
+
+        # then
+        assert result1
+        assert not result2
+        assert callback.skipped == 1
+        assert callback.trigger()
+
+    def test_should_execute_higher_priority_callbacks_first(self):
+        # given
+        ordering = []
+        release = threading.Event()
+        blocker = self.scheduler.callback(lambda: release.wait())
+        timer = self.scheduler.callback(lambda: ordering.append('TIMER'), PRIORITY_TIMER)
+        block = self.scheduler.callback(lambda: ordering.append('BLOCK'), PRIORITY_BLOCK)
+        self.scheduler.start()
+
+        # when
+        blocker.trigger()
+        time.sleep(0.1)
+        timer.trigger()
+        block.trigger()
+        release.set()
+        timer.wait()
+        block.wait()
+
+        # then
+        assert ordering == ['BLOCK', 'TIMER']
+
+    def test_should_fire_timers_and_record_lateness(self):
+        # given
+        counter = []
+        callback = self.scheduler.callback(lambda: counter.append(1), name="counter")
+        self.scheduler.every(0.1, callback)
+        self.scheduler.start()
+
+        # when
+        time.sleep(0.55)
+        self.scheduler.stop()
+        callback.wait()
+
+        # then
+        assert 4 <= len(counter) <= 7
+        metrics = self.scheduler.metrics()[0]
+        assert metrics['name'] == "counter"
+        assert metrics['runs'] == len(counter)
+        assert 0 <= metrics['lateness_avg'] < 0.1
+        assert metrics['jitter'] >= 0
+
+    def test_should_skip_timer_ticks_while_callback_is_running(self):
+        # given
+        callback = self.scheduler.callback(lambda: time.sleep(0.35))
+        self.scheduler.every(0.1, callback)
+        self.scheduler.start()
+
+        # when
+        time.sleep(0.5)
+        self.scheduler.stop()
+        callback.wait()
+
+        # then
+        assert callback.runs == 2
+        assert callback.skipped >= 2
+
+    def test_should_survive_failing_callbacks(self):
+        # given
+        def fail():
+            raise Exception("failure")
+
+        callback = self.scheduler.callback(fail)
+        self.scheduler.start()
+
+        # when
+        callback.trigger()
+        callback.wait()
+
+        # then
+        assert callback.runs == 1
+        assert callback.trigger()
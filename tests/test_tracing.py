@@ -0,0 +1,177 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2021 Maker Ecosystem Growth Holdings, INC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+
+import pytest
+from web3 import Web3
+
+from pymaker import Transact
+from pymaker.gas import FixedGasPrice
+from pymaker.keys import register_private_key
+from pymaker.metrics import InMemoryMetrics
+from pymaker.tracing import MetricsTraceSink, TraceSink, TransactionTrace
+from tests.test_batch import ACCOUNT, FakeNode, PRIVATE_KEY, submit_many, transfer, wait_for
+
+
+class CollectingSink(TraceSink):
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace: TransactionTrace):
+        self.traces.append(trace)
+
+
+class UnseenNode(FakeNode):
+    """Never returns sent transactions by their hash, as if they were slow to propagate."""
+    def make_request(self, method, params):
+        if method == "eth_getTransactionByHash":
+            with self.lock:
+                self.requests.append((method, params))
+            return {'jsonrpc': "2.0", 'id': 1, 'result': None}
+        return super().make_request(method, params)
+
+
+class TestTransactionTrace:
+    def test_should_record_spans(self):
+        # given
+        trace = TransactionTrace("Dog.bark")
+
+        # when
+        with trace.span("gas_estimation"):
+            time.sleep(0.01)
+        trace.add_span("broadcast", 10.0, 10.5, tx_hash="0x01")
+        trace.finish(True)
+
+        # then
+        assert trace.first("gas_estimation").duration >= 0.01
+        assert trace.stages("broadcast")[0].duration == 0.5
+        assert trace.first("mined") is None
+        assert trace.outcome == "success"
+        assert trace.to_dict()['spans'][1] == {'stage': "broadcast", 'start': 10.0, 'end': 10.5, 'duration': 0.5,
+                                               'tx_hash': "0x01"}
+
+    def test_should_aggregate_into_histograms(self):
+        # given
+        metrics = InMemoryMetrics()
+        sink = MetricsTraceSink(metrics)
+        for outcome in [True, False]:
+            trace = TransactionTrace("Dog.bark")
+            trace.add_span("broadcast", 10.0, 10.2)
+            trace.add_span("gas_bump", 10.2, 40.2)
+            trace.finish(outcome)
+
+            # when
+            sink.export(trace)
+
+        # then
+        assert metrics.histogram("pymaker_transaction_stage_seconds",
+                                 {'function': "Dog.bark", 'stage': "broadcast"}).count == 2
+        assert metrics.histogram("pymaker_transaction_stage_seconds",
+                                 {'function': "Dog.bark", 'stage': "gas_bump"}).sum == pytest.approx(60.0)
+        assert metrics.histogram("pymaker_transaction_seconds", {'function': "Dog.bark", 'outcome': "failure"}).count == 1
+        assert metrics.counter("pymaker_transaction_gas_bumps_total", {'function': "Dog.bark"}) == 2
+
+
+@pytest.mark.timeout(30)
+class TestTransactTracing:
+    def setup_method(self):
+        self.node = FakeNode()
+        self.web3 = Web3(self.node)
+        self.web3.eth.defaultAccount = ACCOUNT
+        self.sink = CollectingSink()
+        Transact.trace_sink = self.sink
+
+    def teardown_method(self):
+        Transact.trace_sink = None
+
+    def test_should_trace_all_stages(self):
+        # given
+        gas_price = FixedGasPrice(20)
+        result = []
+        threading.Thread(target=lambda: result.append(transfer(self.web3, 1).transact(gas_price=gas_price)),
+                         daemon=True).start()
+        wait_for(lambda: len(self.node.sent) == 1)
+
+        # when
+        gas_price.update_gas_price(30)
+        wait_for(lambda: len(self.node.sent) == 2)
+        self.node.mine()
+        wait_for(lambda: len(self.sink.traces) == 1)
+
+        # then
+        trace = self.sink.traces[0]
+        assert trace.function == "transfer"
+        assert trace.outcome == "success"
+        assert [span.stage for span in trace.spans if span.stage not in ("first_seen", "lock_wait")] == \
+            ["gas_estimation", "nonce", "broadcast", "gas_bump", "broadcast", "mined", "receipt_decode"]
+        assert len(trace.stages("lock_wait")) == 2
+        assert trace.first("first_seen") is not None
+        assert trace.first("mined").start == trace.first("broadcast").start
+        assert [span.attributes['tx_hash'] for span in trace.stages("broadcast")] == self.node.sent
+
+    def test_should_poll_for_first_seen_with_backoff(self):
+        # given
+        node = UnseenNode()
+        web3 = Web3(node)
+        web3.eth.defaultAccount = ACCOUNT
+        result = []
+        threading.Thread(target=lambda: result.append(transfer(web3, 1).transact(gas_price=FixedGasPrice(20))),
+                         daemon=True).start()
+        wait_for(lambda: len(node.sent) == 1)
+
+        # when
+        time.sleep(2.5)
+        node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then polled right after sending, then after 1 and 2 more seconds, not on every iteration
+        assert 1 <= len(node.methods("eth_getTransactionByHash")) <= 3
+        assert self.sink.traces[0].first("first_seen") is None
+
+    def test_should_not_trace_without_sink(self):
+        # given
+        Transact.trace_sink = None
+        transact = transfer(self.web3, 1)
+        result = []
+        threading.Thread(target=lambda: result.append(transact.transact()), daemon=True).start()
+
+        # when
+        wait_for(lambda: len(self.node.sent) == 1)
+        self.node.mine()
+        wait_for(lambda: len(result) == 1)
+
+        # then
+        assert transact.trace is None
+        assert self.node.methods("eth_getTransactionByHash") == []
+
+    def test_should_trace_batches(self):
+        # given
+        register_private_key(self.web3, PRIVATE_KEY)
+
+        # when
+        futures = submit_many([transfer(self.web3, value) for value in range(1, 3)])
+        self.node.mine()
+        assert all(future.result(timeout=10) is not None for future in futures)
+
+        # then
+        assert len(self.sink.traces) == 2
+        for trace in self.sink.traces:
+            assert [span.stage for span in trace.spans] == ["gas_estimation", "lock_wait", "nonce", "signing",
+                                                            "broadcast", "mined", "receipt_decode"]
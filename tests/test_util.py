@@ -281,3 +281,15 @@ class TestAsyncCallback:
 
         # then
         assert mock.mock_calls == [call.on_start(), call.callback(), call.on_finish()]
+
+    def test_should_pass_arguments_to_the_callback(self):
+        # given
+        callback = Mock()
+        async_callback = AsyncCallback(callback)
+
+        # when
+        async_callback.trigger(args=(1, 'two'))
+        async_callback.wait()
+
+        # then
+        callback.assert_called_once_with(1, 'two')